@@ -0,0 +1,177 @@
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, Request
+
+load_dotenv()
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason, retry_after):
+        self.reason = reason  # "queue_full", "user_limit" or "timeout"
+        self.retry_after = retry_after
+        super().__init__(f"Server busy ({reason.replace('_', ' ')})")
+
+
+class AdmissionController:
+    """Caps concurrent generations, with a bounded, per-user fair wait queue
+
+    Up to ``max_concurrent`` requests run at once. Beyond that, requests wait in
+    one queue per user, and freed slots go round-robin across users. One user
+    cannot fill the queue ahead of everyone else. A request is rejected at once
+    when the queue is full, or when its user already has ``max_per_user``
+    requests running or waiting. It is also rejected after ``queue_timeout``
+    seconds without a slot.
+    """
+
+    def __init__(self, max_concurrent=64, max_queue=128, max_per_user=4, queue_timeout=10.0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self.queue_timeout = queue_timeout
+        self._waiters = OrderedDict()  # user -> deque of futures; order is the round-robin turn
+        self._per_user = {}  # user -> requests running or waiting
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_user_limit = 0
+        self.timed_out = 0
+        self.queue_wait_seconds = 0.0
+        self.max_queue_wait_seconds = 0.0
+        self.avg_hold_seconds = 0.0  # moving average of how long a slot is held
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_concurrent=int(os.getenv("ADMISSION_MAX_CONCURRENT", "64")),
+            max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "128")),
+            max_per_user=int(os.getenv("ADMISSION_MAX_PER_USER", "4")),
+            queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10")),
+        )
+
+    @property
+    def enabled(self):
+        return self.max_concurrent > 0
+
+    def retry_after(self):
+        """Seconds until a slot is likely free: the queue ahead, drained at the observed rate"""
+        estimate = self.avg_hold_seconds * (self.queued + 1) / max(self.max_concurrent, 1)
+        return max(1, min(60, math.ceil(estimate)))
+
+    def _reject(self, reason):
+        return AdmissionRejected(reason, self.retry_after())
+
+    def _forget(self, user):
+        self._per_user[user] -= 1
+        if not self._per_user[user]:
+            del self._per_user[user]
+
+    async def acquire(self, user):
+        """Wait for a slot for ``user``; raises AdmissionRejected instead of waiting too long"""
+        if not self.enabled:
+            return
+        if self.max_per_user and self._per_user.get(user, 0) >= self.max_per_user:
+            self.rejected_user_limit += 1
+            raise self._reject("user_limit")
+        if self.in_flight < self.max_concurrent and not self.queued:
+            self.in_flight += 1
+            self._per_user[user] = self._per_user.get(user, 0) + 1
+            self.admitted += 1
+            return
+        if self.queued >= self.max_queue:
+            self.rejected_queue_full += 1
+            raise self._reject("queue_full")
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(user, deque()).append(future)
+        self.queued += 1
+        self._per_user[user] = self._per_user.get(user, 0) + 1
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                self.release(user)  # the slot arrived just as we gave up: pass it on
+            else:
+                waiters = self._waiters.get(user)
+                if waiters is not None and future in waiters:
+                    waiters.remove(future)
+                    if not waiters:
+                        del self._waiters[user]
+                self.queued -= 1
+                self._forget(user)
+            if isinstance(e, asyncio.TimeoutError):
+                self.timed_out += 1
+                raise self._reject("timeout")
+            raise
+        waited = time.perf_counter() - start
+        self.queue_wait_seconds += waited
+        self.max_queue_wait_seconds = max(self.max_queue_wait_seconds, waited)
+        self.admitted += 1
+
+    def release(self, user, held_seconds=None):
+        """Free ``user``'s slot and hand it to the next user in turn"""
+        if not self.enabled:
+            return
+        if held_seconds is not None:
+            self.avg_hold_seconds += 0.1 * (held_seconds - self.avg_hold_seconds)
+        self.in_flight -= 1
+        self._forget(user)
+        while self._waiters and self.in_flight < self.max_concurrent:
+            next_user, waiters = next(iter(self._waiters.items()))
+            future = waiters.popleft()
+            if waiters:
+                self._waiters.move_to_end(next_user)  # back of the line until the others had a turn
+            else:
+                del self._waiters[next_user]
+            if future.done():
+                continue  # gave up a moment ago; it does its own accounting
+            self.queued -= 1
+            self.in_flight += 1
+            future.set_result(None)
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "max_concurrent": self.max_concurrent,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "waiting_users": len(self._waiters),
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_user_limit": self.rejected_user_limit,
+            "timed_out": self.timed_out,
+            "queue_wait_seconds_max": self.max_queue_wait_seconds,
+            "queue_wait_seconds_avg": self.queue_wait_seconds / self.admitted if self.admitted else 0.0,
+            "avg_hold_seconds": self.avg_hold_seconds,
+        }
+
+
+admission = AdmissionController.from_env()
+
+
+async def admit_generation(request: Request):
+    """Dependency holding a generation slot for the rest of the request
+
+    Declare it before ``get_db`` so a queued request does not hold a database session.
+    """
+    try:
+        body = await request.json()
+        user = body.get("user_id") if isinstance(body, dict) else None
+    except ValueError:
+        user = None
+    user = user if isinstance(user, str) else f"host:{request.client.host if request.client else 'unknown'}"
+    try:
+        await admission.acquire(user)
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        admission.release(user, time.perf_counter() - start)
@@ -1,51 +1,388 @@
 # Add content to backend/app/ai_service.py
-from groq import Groq
+import asyncio
+import json
+import re
+from functools import cached_property
+from groq import Groq, AsyncGroq
 import os
 from dotenv import load_dotenv
 
+from .cache import ResponseCache, cache_key
+from .hedging import Hedger
+from .model_routing import ModelRouter
+from .rate_limit import LLMScheduler, estimate_tokens
+from .singleflight import SingleFlight
+from .metrics import observe_stage, record_token_usage
+
 load_dotenv()
 
+TONES = ("casual", "formal")
+
+# "separate" makes one completion per tone; "combined" asks for both tones in one JSON completion
+GENERATION_MODE = os.getenv("GENERATION_MODE", "separate")
+COMBINED_TEMPERATURE = 0.5
+
+_CODE_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+
+def parse_dual_tone(content):
+    """Parse a combined completion into {tone: text}; returns (responses, repaired)
+
+    Output that is not valid JSON as-is gets one repair pass for the usual model
+    slips (code fences, prose around the object, trailing commas, raw newlines in
+    strings). Raises ValueError when it still does not yield a non-empty string
+    for every tone.
+    """
+    repaired = False
+    try:
+        data = json.loads(content)
+    except (TypeError, ValueError):
+        text = _CODE_FENCE.sub("", (content or "").strip())
+        start, end = text.find("{"), text.rfind("}")
+        if start == -1 or end < start:
+            raise ValueError("no JSON object in combined completion")
+        data = json.loads(_TRAILING_COMMA.sub(r"\1", text[start:end + 1]), strict=False)
+        repaired = True
+
+    if not isinstance(data, dict):
+        raise ValueError("combined completion is not a JSON object")
+    responses = {}
+    for tone in TONES:
+        value = data.get(tone, data.get(f"{tone}_response"))
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError(f"combined completion has no {tone} text")
+        responses[tone] = value.strip()
+    return responses, repaired
+
+
+class PartialGenerationError(Exception):
+    """Raised when at least one tone failed; keeps whatever text did complete"""
+
+    def __init__(self, responses, errors):
+        self.responses = responses  # tone key -> completed text (None if that tone failed)
+        self.errors = errors  # tone key -> exception
+        failed = ", ".join(sorted(errors))
+        super().__init__(f"Generation failed for: {failed}")
+
+
 class AIService:
     def __init__(self):
-        self.client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+        self.scheduler = LLMScheduler.from_env()
         self.model = "llama3-8b-8192"  # You can change this to other models like "llama-3.3-70b-versatile"
-    
-    def generate_casual_response(self, query):
-        """Generate a casual, conversational response to the query"""
+        self.cache = ResponseCache.from_env()
+        self.singleflight = SingleFlight()
+        self.router = ModelRouter.from_env(self.model)
+        self.hedger = Hedger.from_env()
+        self.generation_mode = GENERATION_MODE
+        self.combined_calls = 0
+        self.combined_repaired = 0
+        self.combined_fallbacks = 0
+
+    # Clients are built on first use (or by warm_up) so importing the service stays cheap
+    @cached_property
+    def client(self):
+        return Groq(api_key=os.getenv("GROQ_API_KEY"))
+
+    @cached_property
+    def async_client(self):
+        # Retries are owned by the scheduler, which also honours Retry-After
+        return AsyncGroq(api_key=os.getenv("GROQ_API_KEY"), max_retries=0)
+
+    def warm_up(self):
+        """Build the Groq clients ahead of the first request"""
+        return self.client, self.async_client
+
+    def _casual_messages(self, query):
         prompt = f"You are a friendly and casual assistant. Explain this in a conversational, easy-to-understand way: {query}"
-        
+        return [
+            {"role": "system", "content": "You are a helpful assistant that speaks in a casual, friendly tone."},
+            {"role": "user", "content": prompt}
+        ]
+
+    def _formal_messages(self, query):
+        prompt = f"You are a professional academic assistant. Provide a formal, detailed explanation of: {query}"
+        return [
+            {"role": "system", "content": "You are a helpful assistant that speaks in a formal, academic tone."},
+            {"role": "user", "content": prompt}
+        ]
+
+    def _combined_messages(self, query):
+        prompt = (
+            "Answer the question below twice. Reply with only a JSON object with two string keys: "
+            '"casual", a friendly, conversational, easy-to-understand explanation, and '
+            '"formal", a formal, detailed, academic explanation.\n\n'
+            f"Question: {query}"
+        )
+        return [
+            {"role": "system", "content": "You are a helpful assistant that writes in both a casual and a formal tone."},
+            {"role": "user", "content": prompt}
+        ]
+
+    def _tone_settings(self, tone, query, history=None):
+        """Messages and temperature for one tone; ``history`` (earlier turns) goes before the query"""
+        if tone == "casual":
+            messages, temperature = self._casual_messages(query), 0.7
+        else:
+            messages, temperature = self._formal_messages(query), 0.3
+        if history:
+            messages = [messages[0], *history, *messages[1:]]
+        return messages, temperature
+
+    def _summary_messages(self, summary, turns):
+        transcript = "\n\n".join(f"User: {query}\nAssistant: {answer}" for query, answer in turns)
+        prompt = (
+            "Condense this conversation into a short summary (at most 150 words) that keeps the "
+            "facts, names and open questions a later reply would need.\n\n"
+            + (f"Summary so far: {summary}\n\n" if summary else "")
+            + f"Conversation:\n{transcript}"
+        )
+        return [
+            {"role": "system", "content": "You summarize conversations accurately and briefly."},
+            {"role": "user", "content": prompt}
+        ]
+
+    async def _create_completion(self, messages, temperature, model=None, **kwargs):
+        """Async chat completion routed through the rate-limiting scheduler
+
+        Plain completions are hedged per model inside the scheduler's slot, so only
+        the provider call is timed and raced; opening a stream is not hedged.
+        """
+        model = model or self.model
+        estimated = estimate_tokens(messages)
+
+        def call():
+            return self.async_client.chat.completions.create(
+                messages=messages,
+                model=model,
+                temperature=temperature,
+                **kwargs,
+            )
+
+        if kwargs.get("stream"):
+            return await self.scheduler.run(call, estimated_tokens=estimated)
+        return await self.scheduler.run(
+            lambda: self.hedger.run(model, call, may_hedge=lambda: self.scheduler.reserve_hedge(estimated)),
+            estimated_tokens=estimated,
+        )
+
+    def generate_casual_response(self, query, use_cache=True):
+        """Generate a casual, conversational response to the query"""
+        model = self.router.model_for(query, "casual")
+        key = cache_key(query, "casual", model, 0.7)
+        if use_cache and (cached := self.cache.get(key)) is not None:
+            return cached
+
+        self.router.record(model)
         completion = self.client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that speaks in a casual, friendly tone."},
-                {"role": "user", "content": prompt}
-            ],
-            model=self.model,
+            messages=self._casual_messages(query),
+            model=model,
             temperature=0.7,
         )
-        
-        return completion.choices[0].message.content
-    
-    def generate_formal_response(self, query):
+
+        response = completion.choices[0].message.content
+        self.cache.set(key, response)
+        return response
+
+    def generate_formal_response(self, query, use_cache=True):
         """Generate a formal, academic response to the query"""
-        prompt = f"You are a professional academic assistant. Provide a formal, detailed explanation of: {query}"
-        
+        model = self.router.model_for(query, "formal")
+        key = cache_key(query, "formal", model, 0.3)
+        if use_cache and (cached := self.cache.get(key)) is not None:
+            return cached
+
+        self.router.record(model)
         completion = self.client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that speaks in a formal, academic tone."},
-                {"role": "user", "content": prompt}
-            ],
-            model=self.model,
+            messages=self._formal_messages(query),
+            model=model,
             temperature=0.3,
         )
-        
-        return completion.choices[0].message.content
-    
-    def generate_responses(self, query):
-        """Generate both casual and formal responses to the query"""
-        casual_response = self.generate_casual_response(query)
-        formal_response = self.generate_formal_response(query)
-        
+
+        response = completion.choices[0].message.content
+        self.cache.set(key, response)
+        return response
+
+    def generate_responses(self, query, use_cache=True, tones=TONES):
+        """Generate the requested tones (both by default) for the query"""
+        responses = {}
+        if "casual" in tones:
+            responses["casual_response"] = self.generate_casual_response(query, use_cache=use_cache)
+        if "formal" in tones:
+            responses["formal_response"] = self.generate_formal_response(query, use_cache=use_cache)
+
+        return responses
+
+    async def _generate_tone_async(self, tone, query, use_cache=True, history=None):
+        messages, temperature = self._tone_settings(tone, query, history)
+        model = self.router.model_for(query, tone)
+        key = cache_key(query, tone, model, temperature)
+        if use_cache and not history and (cached := await self.cache.aget(key)) is not None:
+            return cached
+
+        self.router.record(model)
+        async def complete():
+            with observe_stage(f"completion_{tone}"):
+                completion = await self._create_completion(messages, temperature, model=model)
+            record_token_usage(tone, completion)
+            response = completion.choices[0].message.content
+            if not history:
+                await self.cache.aset(key, response)
+            return response
+
+        if history:
+            return await complete()  # the answer depends on the conversation, so it is neither cached nor shared
+        # Identical queries already in flight share that completion rather than starting another
+        return await self.singleflight.do(key, complete)
+
+    async def generate_casual_response_async(self, query, use_cache=True, history=None):
+        """Async variant of generate_casual_response"""
+        return await self._generate_tone_async("casual", query, use_cache, history)
+
+    async def generate_formal_response_async(self, query, use_cache=True, history=None):
+        """Async variant of generate_formal_response"""
+        return await self._generate_tone_async("formal", query, use_cache, history)
+
+    async def _generate_combined_async(self, query, use_cache=True):
+        """Both tones from one JSON-mode completion, or None when its output cannot be used
+
+        Each tone is cached under the key a single-tone request for it would use, model
+        included, so those hit even when routing sends the combined call to the large model.
+        """
+        model = self.router.model_for(query, *TONES)
+        keys = {
+            tone: cache_key(query, tone, self.router.model_for(query, tone), self._tone_settings(tone, query)[1])
+            for tone in TONES
+        }
+        if use_cache:
+            cached = {tone: await self.cache.aget(key) for tone, key in keys.items()}
+            if all(value is not None for value in cached.values()):
+                return {f"{tone}_response": value for tone, value in cached.items()}
+
+        self.router.record(model)
+        async def complete():
+            messages = self._combined_messages(query)
+            try:
+                with observe_stage("completion_combined"):
+                    completion = await self._create_completion(
+                        messages, COMBINED_TEMPERATURE, model=model, response_format={"type": "json_object"}
+                    )
+            except Exception as e:
+                raise PartialGenerationError({f"{tone}_response": None for tone in TONES}, {f"{tone}_response": e for tone in TONES})
+            self.combined_calls += 1
+            record_token_usage("combined", completion)
+            try:
+                responses, repaired = parse_dual_tone(completion.choices[0].message.content)
+            except ValueError:
+                self.combined_fallbacks += 1
+                return None
+            self.combined_repaired += repaired
+            for tone, response in responses.items():
+                await self.cache.aset(keys[tone], response)
+            return {f"{tone}_response": response for tone, response in responses.items()}
+
+        return await self.singleflight.do(cache_key(query, "combined", model, COMBINED_TEMPERATURE), complete)
+
+    async def generate_responses_async(self, query, use_cache=True, tones=TONES, context=None):
+        """Generate the requested tones concurrently; raises PartialGenerationError if any fails
+
+        Only requested tones appear in the result, so a single-tone request costs one completion.
+        In combined mode a request for both tones tries a single completion first and falls
+        back to one call per tone if its output cannot be parsed. ``context`` maps a tone
+        to the earlier conversation turns (chat messages) its completion should see.
+        """
+        context = context or {}
+        if self.generation_mode == "combined" and not context and all(tone in tones for tone in TONES):
+            responses = await self._generate_combined_async(query, use_cache=use_cache)
+            if responses is not None:
+                return responses
+
+        generators = {
+            "casual": self.generate_casual_response_async,
+            "formal": self.generate_formal_response_async,
+        }
+        selected = [tone for tone in TONES if tone in tones]
+        results = await asyncio.gather(
+            *(generators[tone](query, use_cache=use_cache, history=context.get(tone)) for tone in selected),
+            return_exceptions=True,
+        )
+
+        responses = {}
+        errors = {}
+        for key, result in zip((f"{tone}_response" for tone in selected), results):
+            if isinstance(result, BaseException):
+                if not isinstance(result, Exception):
+                    raise result  # let cancellation and friends propagate untouched
+                responses[key] = None
+                errors[key] = result
+            else:
+                responses[key] = result
+
+        if errors:
+            raise PartialGenerationError(responses, errors)
+        return responses
+
+    async def summarize_async(self, summary, turns):
+        """Fold (query, answer) ``turns`` into the running ``summary`` of a conversation"""
+        model = self.router.small_model
+        with observe_stage("completion_summary"):
+            completion = await self._create_completion(self._summary_messages(summary, turns), 0.2, model=model)
+        record_token_usage("summary", completion)
+        return completion.choices[0].message.content.strip()
+
+    def generation_stats(self):
         return {
-            "casual_response": casual_response,
-            "formal_response": formal_response
+            "mode": self.generation_mode,
+            "combined_calls": self.combined_calls,
+            "combined_repaired": self.combined_repaired,
+            "combined_fallbacks": self.combined_fallbacks,
         }
+
+    async def _stream_tone(self, tone, query, queue, use_cache, history=None):
+        messages, temperature = self._tone_settings(tone, query, history)
+        model = self.router.model_for(query, tone)
+        try:
+            key = cache_key(query, tone, model, temperature)
+            if use_cache and not history and (cached := await self.cache.aget(key)) is not None:
+                await queue.put((tone, "token", cached))
+                await queue.put((tone, "done", None))
+                return
+
+            self.router.record(model)
+            with observe_stage(f"completion_{tone}_stream"):
+                # Only opening the stream is scheduled; throttling surfaces before the first chunk
+                stream = await self._create_completion(messages, temperature, model=model, stream=True)
+                parts = []
+                async for chunk in stream:
+                    token = chunk.choices[0].delta.content if chunk.choices else None
+                    if token:
+                        parts.append(token)
+                        await queue.put((tone, "token", token))
+            if not history:
+                await self.cache.aset(key, "".join(parts))
+            await queue.put((tone, "done", None))
+        except Exception as e:
+            await queue.put((tone, "error", e))
+
+    async def stream_responses(self, query, use_cache=True, tones=TONES, context=None):
+        """Stream the requested tones concurrently as (tone, kind, payload) tuples in arrival order
+
+        kind is "token" (payload is the text delta), "done" (payload is None) or
+        "error" (payload is the exception). Each tone ends with exactly one done or error.
+        """
+        queue = asyncio.Queue()
+        tasks = [
+            asyncio.create_task(self._stream_tone(tone, query, queue, use_cache, (context or {}).get(tone)))
+            for tone in TONES
+            if tone in tones
+        ]
+        pending = len(tasks)
+        try:
+            while pending:
+                event = await queue.get()
+                if event[1] != "token":
+                    pending -= 1
+                yield event
+        finally:
+            # Client went away mid-stream: stop paying for tokens nobody will read
+            for task in tasks:
+                task.cancel()
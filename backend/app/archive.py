@@ -0,0 +1,319 @@
+"""Monthly partitions and archival of old prompts
+
+On PostgreSQL ``prompts`` is range-partitioned by month (``prompts_YYYY_MM``, plus
+``prompts_default`` as a catch-all). SQLite keeps a single hot table. Either way
+whole months older than PROMPT_ARCHIVE_AFTER_DAYS are written to gzip-compressed
+JSONL files in PROMPT_ARCHIVE_DIR (``prompts-YYYY-MM.jsonl.gz``) and then removed
+from the database: by detaching and dropping the month's partition on PostgreSQL,
+with batched ORM deletes (which also unindex the rows for search) on SQLite.
+Response blobs stay, since other prompts may share them.
+
+    python -m app.archive            # partition maintenance and one archival pass
+    python -m app.archive --dry-run  # list the months that would be archived
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from uuid import UUID
+
+from dotenv import load_dotenv
+from sqlalchemy import select, text
+from sqlalchemy.orm import Session
+
+from . import database
+from .models import Prompt
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Months of PostgreSQL partitions created ahead of time, so inserts never land in the default one
+PARTITION_MONTHS_AHEAD = 2
+DELETE_BATCH_SIZE = 1000
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1)
+
+
+def next_month(month):
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"prompts_{month:%Y_%m}"
+
+
+def archive_path(archive_dir, month):
+    return Path(archive_dir) / f"prompts-{month:%Y-%m}.jsonl.gz"
+
+
+def ensure_partitions(conn, until, since=None):
+    """Create the default partition and one per month from ``since`` (default: now) through ``until``"""
+    conn.execute(text("CREATE TABLE IF NOT EXISTS prompts_default PARTITION OF prompts DEFAULT"))
+    month = month_start(since or datetime.utcnow())
+    while month <= until:
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF prompts "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{next_month(month):%Y-%m-%d}')"
+        ))
+        month = next_month(month)
+
+
+def _partitions(conn):
+    return set(conn.scalars(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = 'prompts'"
+    )))
+
+
+def archivable_months(conn, cutoff):
+    """Months that end on or before the month containing ``cutoff`` and still hold rows"""
+    boundary = month_start(cutoff)
+    oldest = conn.scalar(select(Prompt.created_at).where(Prompt.created_at < boundary).order_by(Prompt.created_at).limit(1))
+    months = []
+    month = month_start(oldest) if oldest is not None else boundary
+    while month < boundary:
+        months.append(month)
+        month = next_month(month)
+    return months
+
+
+def archive_record(prompt):
+    return {
+        "id": str(prompt.id),
+        "user_id": prompt.user_id,
+        "query": prompt.query,
+        "casual_response": prompt.casual_response,
+        "formal_response": prompt.formal_response,
+        "created_at": prompt.created_at.isoformat(),
+    }
+
+
+def _export_month(session, month, path):
+    """Write the month's rows to ``path``, merged with any earlier file for it; return their ids
+
+    The file is written under a temporary name and renamed only once complete, so a
+    crash never leaves a truncated archive behind, and rows are deleted only afterwards.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(path.name + ".partial")
+    seen, ids = set(), []
+    with gzip.open(partial, "wt", encoding="utf-8") as out:
+        if path.exists():
+            # An earlier pass over this month (interrupted before its delete, or rows written late)
+            with gzip.open(path, "rt", encoding="utf-8") as existing:
+                for line in existing:
+                    seen.add(json.loads(line)["id"])
+                    out.write(line)
+        stmt = (
+            select(Prompt)
+            .where(Prompt.created_at >= month, Prompt.created_at < next_month(month))
+            .order_by(Prompt.created_at, Prompt.id)
+            .execution_options(yield_per=DELETE_BATCH_SIZE)
+        )
+        for prompt in session.scalars(stmt):
+            ids.append(prompt.id)
+            if str(prompt.id) not in seen:
+                out.write(json.dumps(archive_record(prompt)) + "\n")
+            session.expunge(prompt)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(partial, path)
+    return ids
+
+
+def _remove_month(session, month, ids):
+    conn = session.connection()
+    if conn.dialect.name == "postgresql":
+        name = partition_name(month)
+        if name in _partitions(conn):
+            conn.execute(text(f"DELETE FROM prompt_search WHERE prompt_id IN (SELECT id FROM {name})"))
+            conn.execute(text(f"ALTER TABLE prompts DETACH PARTITION {name}"))
+            conn.execute(text(f"DROP TABLE {name}"))
+            return
+    # ORM deletes, so the flush hooks unindex each row for search
+    for start in range(0, len(ids), DELETE_BATCH_SIZE):
+        for prompt in session.scalars(select(Prompt).where(Prompt.id.in_(ids[start:start + DELETE_BATCH_SIZE]))):
+            session.delete(prompt)
+        session.flush()
+        session.expunge_all()
+
+
+def archive_month(engine, month, archive_dir):
+    """Move one month of prompts to its archive file; returns the number of rows moved"""
+    with Session(engine) as session, session.begin():
+        conn = session.connection()
+        if conn.dialect.name == "postgresql":
+            # One archiver at a time across workers; writers into the month wait until commit
+            if not conn.scalar(text("SELECT pg_try_advisory_xact_lock(hashtext('prompt_archive'))")):
+                return 0
+            if partition_name(month) in _partitions(conn):
+                conn.execute(text(f"LOCK TABLE {partition_name(month)} IN SHARE MODE"))
+        ids = _export_month(session, month, archive_path(archive_dir, month))
+        _remove_month(session, month, ids)
+    return len(ids)
+
+
+def read_archive(archive_dir, user_id, before=None, limit=50):
+    """A user's archived prompts older than the ``before`` (created_at, id) key, newest first
+
+    Files are read newest month first and reading stops once ``limit`` rows are in hand.
+    """
+    records = []
+    for path in sorted(Path(archive_dir).glob("prompts-*.jsonl.gz"), reverse=True):
+        if len(records) >= limit:
+            break
+        month = datetime.strptime(path.name[len("prompts-"):len("prompts-YYYY-MM")], "%Y-%m")
+        if before is not None and month > before[0]:
+            continue
+        with gzip.open(path, "rt", encoding="utf-8") as archive:
+            for line in archive:
+                record = json.loads(line)
+                if record["user_id"] != user_id:
+                    continue
+                record["id"] = UUID(record["id"])
+                record["created_at"] = datetime.fromisoformat(record["created_at"])
+                if before is None or (record["created_at"], record["id"]) < before:
+                    records.append(record)
+    records.sort(key=lambda record: (record["created_at"], record["id"]), reverse=True)
+    return records[:limit]
+
+
+def find_archived(archive_dir, prompt_id):
+    """The archived record with ``prompt_id``, or None"""
+    for path in Path(archive_dir).glob("prompts-*.jsonl.gz"):
+        with gzip.open(path, "rt", encoding="utf-8") as archive:
+            for line in archive:
+                record = json.loads(line)
+                if record["id"] == str(prompt_id):
+                    record["id"] = UUID(record["id"])
+                    record["created_at"] = datetime.fromisoformat(record["created_at"])
+                    return record
+    return None
+
+
+class PromptArchiver:
+    """Background task that keeps partitions ahead and archives months past the cutoff
+
+    Runs every ``interval`` seconds in a worker thread on the sync engine. Archival
+    is off when ``after_days`` is 0; PostgreSQL partition upkeep runs regardless.
+    """
+
+    def __init__(self, archive_dir="archive", after_days=0, interval=3600.0):
+        self.archive_dir = archive_dir
+        self.after_days = after_days
+        self.interval = interval
+        self._task = None
+        self.runs = 0
+        self.months_archived = 0
+        self.rows_archived = 0
+        self.failures = 0
+        self.last_run_seconds = 0.0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            archive_dir=os.getenv("PROMPT_ARCHIVE_DIR", "archive"),
+            after_days=int(os.getenv("PROMPT_ARCHIVE_AFTER_DAYS", "0")),
+            interval=float(os.getenv("PROMPT_ARCHIVE_INTERVAL_SECONDS", "3600")),
+        )
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def run_once(self, now=None, engine=None):
+        """Create upcoming partitions and archive every eligible month; returns the months archived"""
+        engine = engine or database.engine
+        now = now or datetime.utcnow()
+        start = time.perf_counter()
+        if engine.dialect.name == "postgresql":
+            with engine.begin() as conn:
+                ensure_partitions(conn, until=now + timedelta(days=31 * PARTITION_MONTHS_AHEAD))
+        archived = []
+        if self.after_days > 0:
+            with engine.connect() as conn:
+                months = archivable_months(conn, now - timedelta(days=self.after_days))
+            for month in months:
+                rows = archive_month(engine, month, self.archive_dir)
+                logger.info("Archived %d prompts from %s to %s", rows, f"{month:%Y-%m}", self.archive_dir)
+                self.rows_archived += rows
+                archived.append(month)
+        self.runs += 1
+        self.months_archived += len(archived)
+        self.last_run_seconds = time.perf_counter() - start
+        return archived
+
+    async def start(self):
+        if self.running:
+            return
+        if self.after_days <= 0 and database.engine.dialect.name != "postgresql":
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if not self.running:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.run_once)
+            except Exception:
+                self.failures += 1
+                logger.exception("Prompt archival failed")
+            await asyncio.sleep(self.interval)
+
+    def stats(self):
+        return {
+            "enabled": self.after_days > 0,
+            "running": self.running,
+            "runs": self.runs,
+            "months_archived": self.months_archived,
+            "rows_archived": self.rows_archived,
+            "failures": self.failures,
+            "last_run_seconds": self.last_run_seconds,
+        }
+
+
+prompt_archiver = PromptArchiver.from_env()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive old prompts to compressed JSONL files")
+    parser.add_argument("--dry-run", action="store_true", help="list the months that would be archived")
+    parser.add_argument("--after-days", type=int, default=prompt_archiver.after_days or None)
+    args = parser.parse_args(argv)
+    if not args.after_days:
+        parser.error("set PROMPT_ARCHIVE_AFTER_DAYS or pass --after-days")
+
+    logging.basicConfig(level=logging.INFO)
+    engine = database.init_engines()[0]
+    if args.dry_run:
+        with engine.connect() as conn:
+            months = archivable_months(conn, datetime.utcnow() - timedelta(days=args.after_days))
+        print("\n".join(f"would archive  {month:%Y-%m}" for month in months) or "Nothing to archive")
+        return 0
+    archiver = PromptArchiver(prompt_archiver.archive_dir, after_days=args.after_days)
+    months = archiver.run_once(engine=engine)
+    print(f"archived {archiver.rows_archived} prompts from {len(months)} month(s) to {archiver.archive_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
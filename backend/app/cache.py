@@ -0,0 +1,154 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def normalize_query(query: str) -> str:
+    """Collapse whitespace and case so trivially different queries share an entry"""
+    return " ".join(query.split()).casefold()
+
+
+def cache_key(query: str, tone: str, model: str, temperature: float) -> str:
+    raw = "\x1f".join([normalize_query(query), tone, model, repr(float(temperature))])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class DatabaseCacheStore:
+    """Persistent cache tier backed by the response_cache table"""
+
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+
+    def load(self, key: str, ttl_seconds: float) -> Optional[str]:
+        from .models import CachedResponse
+
+        db = self.session_factory()
+        try:
+            entry = db.get(CachedResponse, key)
+            if entry is None:
+                return None
+            if entry.created_at < datetime.utcnow() - timedelta(seconds=ttl_seconds):
+                db.delete(entry)
+                db.commit()
+                return None
+            return entry.response
+        finally:
+            db.close()
+
+    def save(self, key: str, value: str) -> None:
+        from .models import CachedResponse
+
+        db = self.session_factory()
+        try:
+            db.merge(CachedResponse(key=key, response=value, created_at=datetime.utcnow()))
+            db.commit()
+        finally:
+            db.close()
+
+
+class ResponseCache:
+    """In-process LRU cache with a TTL, optionally backed by a persistent store"""
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600, store=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.store = store
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_env(cls):
+        store = None
+        if os.getenv("RESPONSE_CACHE_PERSISTENT", "false").lower() in ("1", "true", "yes"):
+            from .database import SessionLocal
+
+            store = DatabaseCacheStore(SessionLocal)
+        return cls(
+            max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024")),
+            ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600")),
+            store=store,
+        )
+
+    def _get_memory(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _set_memory(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get(self, key: str) -> Optional[str]:
+        value = self._get_memory(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        if self.store is not None:
+            value = self.store.load(key, self.ttl_seconds)
+            if value is not None:
+                self.hits += 1
+                self.persistent_hits += 1
+                self._set_memory(key, value)
+                return value
+        self.misses += 1
+        return None
+
+    def set(self, key: str, value: str) -> None:
+        self._set_memory(key, value)
+        if self.store is not None:
+            self.store.save(key, value)
+
+    async def aget(self, key: str) -> Optional[str]:
+        # Only hop to a thread when the blocking database tier is involved
+        if self.store is None:
+            return self.get(key)
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, value: str) -> None:
+        if self.store is None:
+            return self.set(key, value)
+        await asyncio.to_thread(self.set, key, value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "persistent": self.store is not None,
+        }
@@ -0,0 +1,33 @@
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware, GZipResponder
+
+
+class _EventStreamAwareResponder(GZipResponder):
+    """GZipResponder that passes ``text/event-stream`` responses through unencoded"""
+
+    passthrough = False
+
+    async def send_with_gzip(self, message):
+        if message["type"] == "http.response.start":
+            content_type = Headers(raw=message["headers"]).get("content-type", "")
+            self.passthrough = content_type.startswith("text/event-stream")
+        if self.passthrough:
+            await self.send(message)
+        else:
+            await super().send_with_gzip(message)
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """Gzip responses over ``minimum_size`` bytes, except Server-Sent Events
+
+    GZipMiddleware buffers streamed chunks inside the compressor, which would
+    hold SSE tokens back. The decision is made from the response's content type,
+    so event streams go out unencoded whatever the client sent in ``Accept``.
+    """
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and "gzip" in Headers(scope=scope).get("accept-encoding", ""):
+            responder = _EventStreamAwareResponder(self.app, self.minimum_size, compresslevel=self.compresslevel)
+            await responder(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
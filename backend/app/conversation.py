@@ -0,0 +1,171 @@
+"""Context for multi-turn conversation threads
+
+A thread's prompts are its turns. A new turn is generated with the thread's
+running summary followed by its newest turns verbatim, newest first until
+THREAD_CONTEXT_TOKENS is used up, so prompt size stays bounded however long the
+thread gets. Once more than THREAD_WINDOW_TURNS turns sit outside the summary,
+the oldest of them are folded into it with one extra completion, in batches of
+at least THREAD_SUMMARIZE_EVERY so summarizing does not cost a call per turn.
+"""
+import asyncio
+import logging
+import os
+
+from dotenv import load_dotenv
+from sqlalchemy import select
+
+from .database import AsyncSessionLocal
+from .models import Prompt, Thread
+from .rate_limit import estimate_text_tokens
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+def turn_answer(turn, tone):
+    """The turn's answer in ``tone``, or in the other tone when only that one was requested"""
+    other = "formal" if tone == "casual" else "casual"
+    return getattr(turn, f"{tone}_response") or getattr(turn, f"{other}_response") or ""
+
+
+class ConversationManager:
+    """Builds token-budgeted context for thread turns and keeps thread summaries current"""
+
+    def __init__(self, context_tokens=2000, window_turns=6, summarize_every=4, session_factory=None):
+        self.context_tokens = context_tokens
+        self.window_turns = window_turns
+        self.summarize_every = summarize_every
+        self.session_factory = session_factory  # sessions for summaries run by summarize_later
+        self._summarizing = set()  # thread ids with a summary in progress
+        self._tasks = set()
+        self.contexts_built = 0
+        self.turns_trimmed = 0  # unsummarized turns left out of a context to stay within the budget
+        self.summaries = 0
+        self.turns_summarized = 0
+        self.summary_failures = 0
+
+    @classmethod
+    def from_env(cls, session_factory=AsyncSessionLocal):
+        return cls(
+            context_tokens=int(os.getenv("THREAD_CONTEXT_TOKENS", "2000")),
+            window_turns=int(os.getenv("THREAD_WINDOW_TURNS", "6")),
+            summarize_every=int(os.getenv("THREAD_SUMMARIZE_EVERY", "4")),
+            session_factory=session_factory,
+        )
+
+    @property
+    def max_unsummarized(self):
+        """Unsummarized turns a thread can reach before its oldest are folded into the summary"""
+        return self.window_turns + self.summarize_every - 1
+
+    def build_context(self, summary, turns, tones):
+        """{tone: chat messages} for ``turns`` (oldest first) after ``summary``, within the budget"""
+        context, trimmed = {}, []
+        for tone in tones:
+            messages = []
+            used = estimate_text_tokens(summary)
+            for turn in reversed(turns):
+                answer = turn_answer(turn, tone)
+                cost = estimate_text_tokens(turn.query) + estimate_text_tokens(answer)
+                if used + cost > self.context_tokens:
+                    break
+                messages[:0] = [{"role": "user", "content": turn.query}, {"role": "assistant", "content": answer}]
+                used += cost
+            trimmed.append(len(turns) - len(messages) // 2)
+            if summary:
+                messages.insert(0, {"role": "system", "content": f"Summary of the conversation so far: {summary}"})
+            context[tone] = messages
+        self.contexts_built += 1
+        self.turns_trimmed += max(trimmed, default=0)
+        return context
+
+    def _unsummarized(self, thread):
+        stmt = select(Prompt).where(Prompt.thread_id == thread.id)
+        if thread.summarized_until is not None:
+            stmt = stmt.where(Prompt.created_at > thread.summarized_until)
+        return stmt
+
+    async def get_thread(self, db, thread_id, user_id):
+        """The thread, or None unless it exists and belongs to ``user_id``"""
+        thread = await db.get(Thread, thread_id)
+        return thread if thread is not None and thread.user_id == user_id else None
+
+    async def context(self, db, thread, tones):
+        """Context for the next turn of ``thread``"""
+        stmt = (
+            self._unsummarized(thread)
+            .order_by(Prompt.created_at.desc(), Prompt.id.desc())
+            .limit(self.max_unsummarized)
+        )
+        turns = list(reversed((await db.scalars(stmt)).all()))
+        return self.build_context(thread.summary, turns, tones)
+
+    async def maybe_summarize(self, db, thread_id, summarize):
+        """Fold the turns beyond the window into the summary once enough have built up
+
+        ``summarize(summary, [(query, answer), ...])`` returns the new summary text.
+        Returns the number of turns folded in (0 when it was not yet time, or it failed).
+        """
+        if thread_id in self._summarizing:
+            return 0
+        self._summarizing.add(thread_id)
+        try:
+            thread = await db.get(Thread, thread_id)
+            if thread is None:
+                return 0
+            stmt = self._unsummarized(thread).order_by(Prompt.created_at, Prompt.id)
+            turns = (await db.scalars(stmt)).all()
+            if len(turns) <= self.max_unsummarized:
+                return 0
+            folded = turns[:len(turns) - self.window_turns]
+            thread.summary = await summarize(
+                thread.summary, [(turn.query, turn_answer(turn, "formal")) for turn in folded]
+            )
+            thread.summarized_until = folded[-1].created_at
+            thread.summarized_turns += len(folded)
+            await db.commit()
+            self.summaries += 1
+            self.turns_summarized += len(folded)
+            return len(folded)
+        except Exception:
+            await db.rollback()
+            self.summary_failures += 1
+            logger.exception("Summarizing thread %s failed", thread_id)
+            return 0
+        finally:
+            self._summarizing.discard(thread_id)
+
+    def summarize_later(self, thread_id, summarize):
+        """Run maybe_summarize in a task of its own, with a session of its own
+
+        The request that calls this returns without waiting, and its session and
+        admission slot are released as usual. A FastAPI background task would hold
+        both until the summary finished, since yield dependencies are closed after
+        background tasks run.
+        """
+        task = asyncio.create_task(self._summarize_in_own_session(thread_id, summarize))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _summarize_in_own_session(self, thread_id, summarize):
+        async with self.session_factory() as db:
+            await self.maybe_summarize(db, thread_id, summarize)
+
+    async def shutdown(self):
+        """Wait for summaries in progress, so a completion already paid for is saved"""
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self):
+        return {
+            "context_tokens": self.context_tokens,
+            "window_turns": self.window_turns,
+            "contexts_built": self.contexts_built,
+            "turns_trimmed": self.turns_trimmed,
+            "summaries": self.summaries,
+            "turns_summarized": self.turns_summarized,
+            "summary_failures": self.summary_failures,
+        }
+
+
+conversations = ConversationManager.from_env()
@@ -1,20 +1,249 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import declarative_base, sessionmaker
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, declarative_base, sessionmaker
 import os
 from dotenv import load_dotenv
 
+from .metrics import SLOW_QUERIES
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Optional read replica for history, search and export reads
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL") or None
+# How long after a write a user's reads stay on the primary; cover the replica's usual lag
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+# Statements slower than this are logged with their parameters and row count (0 disables)
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_SECONDS", "0.5"))
+SLOW_QUERY_LOG_PARAMS = os.getenv("SLOW_QUERY_LOG_PARAMS", "true").lower() in ("1", "true", "yes")
+
+# Async driver used for each sync URL scheme; anything else is assumed to already name one
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def to_async_url(url):
+    """Rewrite a sync database URL to the matching async driver"""
+    scheme, sep, rest = url.partition("://")
+    return ASYNC_DRIVERS.get(scheme, scheme) + sep + rest
+
+
+def _env_bool(name, default):
+    return os.getenv(name, str(default)).lower() in ("1", "true", "yes")
+
+
+def pool_options(url):
+    """Connection pool settings from the environment
+
+    SQLite picks its own pool class (a single connection for :memory:), so only
+    pre-ping applies there.
+    """
+    options = {"pool_pre_ping": _env_bool("DB_POOL_PRE_PING", True)}
+    if make_url(url).get_backend_name() != "sqlite":
+        options.update(
+            pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+            max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "20")),
+            pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+            pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        )
+    return options
+
+
+def _truncate(value, limit=200):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<{len(value)} bytes>"
+    text_value = repr(value)
+    return text_value if len(text_value) <= limit else text_value[:limit] + "...'"
+
+
+def _loggable_params(parameters, executemany):
+    if not SLOW_QUERY_LOG_PARAMS:
+        return "[hidden]"
+    if executemany:
+        return f"[{len(parameters)} parameter sets]"
+    if isinstance(parameters, dict):
+        return {key: _truncate(value) for key, value in parameters.items()}
+    return [_truncate(value) for value in parameters or ()]
+
+
+def log_slow_queries(engine, threshold=None):
+    """Log statements on ``engine`` (a sync Engine) that take at least ``threshold`` seconds
+
+    The time covers executing the statement on the driver, not fetching its rows.
+    Row counts come from the driver: SELECTs report -1 on SQLite.
+    """
+    threshold = SLOW_QUERY_SECONDS if threshold is None else threshold
+    if threshold <= 0:
+        return
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def log_if_slow(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        if elapsed >= threshold:
+            SLOW_QUERIES.inc()
+            logger.warning(
+                "Slow query (%.3fs, rowcount %s): %s | params %s",
+                elapsed, cursor.rowcount, " ".join(statement.split()), _loggable_params(parameters, executemany),
+            )
+
+    @event.listens_for(engine, "handle_error")
+    def discard_timer(context):
+        started = context.connection.info.get("query_started") if context.connection is not None else None
+        if started:
+            started.pop()
+
+
+class ReadOnlySession(Session):
+    """Session for read endpoints: flushing pending changes is an error rather than a write"""
+
+    def flush(self, objects=None):
+        if self.new or self.dirty or self.deleted:
+            raise InvalidRequestError("This session is read-only; write through get_db")
+        super().flush(objects)
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+class ReadRouter:
+    """Sends reads to the replica, except for users who wrote within the last ``window`` seconds
+
+    The replica may not have applied a fresh write yet, so for a short while the
+    writer's own reads go to the primary and they always see what they just saved.
+    Writes are tracked per process: behind several workers a user's next request
+    can land on a worker that did not see the write, so keep ``window`` above the
+    replica's usual lag rather than relying on it for strict consistency.
+    """
+
+    def __init__(self, window=5.0, clock=time.monotonic):
+        self.window = window
+        self.clock = clock
+        self._recent = OrderedDict()  # user -> time of their last write, oldest first
+        self.replica_reads = 0
+        self.primary_reads = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(window=READ_YOUR_WRITES_SECONDS)
+
+    def _expire(self, now):
+        while self._recent and next(iter(self._recent.values())) <= now - self.window:
+            self._recent.popitem(last=False)
+
+    def record_write(self, user_id):
+        if user_id is None or self.window <= 0:
+            return
+        now = self.clock()
+        self._recent.pop(user_id, None)
+        self._recent[user_id] = now
+        self._expire(now)
+
+    def use_replica(self, user_id):
+        """Whether ``user_id``'s read can go to the replica; counts the decision"""
+        self._expire(self.clock())
+        if user_id is not None and user_id in self._recent:
+            self.primary_reads += 1
+            return False
+        self.replica_reads += 1
+        return True
+
+    def stats(self):
+        return {
+            "replica_configured": read_async_engine is not None,
+            "window_seconds": self.window,
+            "replica_reads": self.replica_reads,
+            "primary_reads": self.primary_reads,
+            "recent_writers": len(self._recent),
+        }
+
+
+# Engines are created by init_engines() (the app lifespan, or a script's entry
+# point) rather than at import, so importing the app does no driver or pool setup.
+# The session factories exist up front and are bound once the engines do.
+engine = None  # sync: schema management, scripts and the threaded cache store
+async_engine = None  # async: the request path
+read_async_engine = None  # async, on DATABASE_READ_URL; None without a replica
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
+AsyncSessionLocal = async_sessionmaker(class_=AsyncSession, autoflush=False, expire_on_commit=False)
+# Bound per session by get_read_db: to the replica, or to the primary for a recent writer
+ReadSessionLocal = async_sessionmaker(
+    class_=AsyncSession, sync_session_class=ReadOnlySession, autoflush=False, expire_on_commit=False
+)
+read_router = ReadRouter.from_env()
 
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+
+def init_engines(url=None, read_url=None):
+    """Create the engines and bind the session factories; later calls are no-ops
+
+    ``read_url`` (default DATABASE_READ_URL) adds an async engine for replica reads.
+    """
+    global engine, async_engine, read_async_engine
+    if engine is None:
+        url = url or DATABASE_URL
+        read_url = read_url or DATABASE_READ_URL
+        engine = create_engine(url, **pool_options(url))
+        async_engine = create_async_engine(to_async_url(url), **pool_options(url))
+        # Hooks attach to sync engines; the async engine exposes the one it wraps
+        log_slow_queries(engine)
+        log_slow_queries(async_engine.sync_engine)
+        if read_url:
+            read_async_engine = create_async_engine(to_async_url(read_url), **pool_options(read_url))
+            log_slow_queries(read_async_engine.sync_engine)
+        SessionLocal.configure(bind=engine)
+        AsyncSessionLocal.configure(bind=async_engine)
+    return engine, async_engine
+
+
+async def ping_database():
+    async with async_engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+
+
+async def prewarm_pool(connections):
+    """Open ``connections`` pooled connections up front so early requests skip the connect"""
+    # Concurrent checkouts force distinct connections; each returns to the pool afterwards
+    await asyncio.gather(*(ping_database() for _ in range(connections)))
+
+
+async def dispose_engines():
+    """Close pooled connections; the engines stay usable and reconnect on demand"""
+    if async_engine is not None:
+        await async_engine.dispose()
+    if read_async_engine is not None:
+        await read_async_engine.dispose()
+    if engine is not None:
+        engine.dispose()
+
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def get_read_db(user_id: Optional[str] = None):
+    """Read-only session for read endpoints: the replica when configured, else the primary
+
+    Shares the endpoint's ``user_id`` query parameter, so a user who has just
+    written reads from the primary until the replica has caught up.
+    """
+    bind = async_engine
+    if read_async_engine is not None and read_router.use_replica(user_id):
+        bind = read_async_engine
+    async with ReadSessionLocal(bind=bind) as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
@@ -0,0 +1,123 @@
+"""Bulk export of prompts as NDJSON or CSV
+
+Rows are read through a server-side cursor (``yield_per``) and encoded one chunk
+at a time, so memory use does not grow with the size of the export.
+
+    python -m app.export --format csv --user-id alice --since 2024-01-01 --until 2024-07-01 -o alice.csv
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+from datetime import datetime
+
+from dotenv import load_dotenv
+from sqlalchemy import select
+from sqlalchemy.orm import aliased
+
+from .models import Prompt, ResponseBlob
+from .storage import decompress
+
+load_dotenv()
+
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+
+FIELDS = ("id", "user_id", "query", "casual_response", "formal_response", "created_at")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def export_statement(user_id=None, since=None, until=None):
+    """Prompts with their compressed response text, oldest first; ``until`` is exclusive"""
+    casual, formal = aliased(ResponseBlob), aliased(ResponseBlob)
+    stmt = (
+        select(Prompt.id, Prompt.user_id, Prompt.query, casual.data, formal.data, Prompt.created_at)
+        .outerjoin(casual, casual.hash == Prompt.casual_response_hash)
+        .outerjoin(formal, formal.hash == Prompt.formal_response_hash)
+        .order_by(Prompt.created_at, Prompt.id)
+    )
+    if user_id is not None:
+        stmt = stmt.where(Prompt.user_id == user_id)
+    if since is not None:
+        stmt = stmt.where(Prompt.created_at >= since)
+    if until is not None:
+        stmt = stmt.where(Prompt.created_at < until)
+    return stmt.execution_options(yield_per=EXPORT_CHUNK_SIZE)
+
+
+def _record(row):
+    prompt_id, user_id, query, casual, formal, created_at = row
+    return {
+        "id": str(prompt_id),
+        "user_id": user_id,
+        "query": query,
+        "casual_response": decompress(casual) if casual is not None else None,
+        "formal_response": decompress(formal) if formal is not None else None,
+        "created_at": created_at.isoformat(),
+    }
+
+
+def header(fmt):
+    if fmt == "csv":
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(FIELDS)
+        return buffer.getvalue()
+    return ""
+
+
+def encode_chunk(rows, fmt):
+    """One chunk of rows as NDJSON lines or CSV records"""
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            record = _record(row)
+            writer.writerow(["" if record[field] is None else record[field] for field in FIELDS])
+        return buffer.getvalue()
+    return "".join(json.dumps(_record(row)) + "\n" for row in rows)
+
+
+async def stream_export(db, fmt="ndjson", **filters):
+    """Yield the export of ``db`` (an AsyncSession) chunk by chunk"""
+    yield header(fmt)
+    result = await db.stream(export_statement(**filters))
+    async for rows in result.partitions():
+        yield encode_chunk(rows, fmt)
+
+
+def write_export(conn, out, fmt="ndjson", **filters):
+    """Write the export to ``out`` over a sync connection; returns the number of rows"""
+    out.write(header(fmt))
+    count = 0
+    for rows in conn.execute(export_statement(**filters)).partitions():
+        out.write(encode_chunk(rows, fmt))
+        count += len(rows)
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export prompts as NDJSON or CSV")
+    parser.add_argument("--format", choices=sorted(MEDIA_TYPES), default="ndjson")
+    parser.add_argument("--user-id")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="inclusive ISO date or datetime")
+    parser.add_argument("--until", type=datetime.fromisoformat, help="exclusive ISO date or datetime")
+    parser.add_argument("-o", "--output", help="file to write (default: stdout)")
+    args = parser.parse_args(argv)
+
+    from .database import init_engines
+
+    engine, _ = init_engines()
+    out = open(args.output, "w", newline="", encoding="utf-8") if args.output else sys.stdout
+    try:
+        with engine.connect() as conn:
+            count = write_export(conn, out, args.format, user_id=args.user_id, since=args.since, until=args.until)
+    finally:
+        if args.output:
+            out.close()
+    print(f"exported {count} prompts", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+import asyncio
+import os
+import time
+from collections import deque
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class Hedger:
+    """Send a backup request when the first one is slower than usual
+
+    The deadline is a percentile of recent latencies for the same key (model).
+    If the primary call has not finished by then, an identical backup call is
+    started and whichever finishes first wins; the other is cancelled. No hedge
+    is sent until ``min_samples`` latencies have been observed for the key, or
+    when ``may_hedge()`` says there is no rate-limit budget to spare. Wrap only
+    the provider call, so the latencies exclude any rate-limiter wait.
+    """
+
+    def __init__(self, enabled=False, percentile=95.0, min_samples=20, window=200, max_delay=30.0):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.window = window
+        self.max_delay = max_delay
+        self._latencies = {}  # key -> recent successful call latencies
+        self.calls = 0
+        self.hedges_fired = 0
+        self.hedges_won = 0
+        self.hedges_skipped = 0  # past the deadline, but may_hedge() refused
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            enabled=os.getenv("HEDGE_ENABLED", "false").lower() in ("1", "true", "yes"),
+            percentile=float(os.getenv("HEDGE_PERCENTILE", "95")),
+            min_samples=int(os.getenv("HEDGE_MIN_SAMPLES", "20")),
+            window=int(os.getenv("HEDGE_WINDOW", "200")),
+            max_delay=float(os.getenv("HEDGE_MAX_DELAY", "30")),
+        )
+
+    def deadline(self, key):
+        """Seconds to wait before hedging a call for ``key``, or None to never hedge it"""
+        samples = self._latencies.get(key)
+        if not self.enabled or samples is None or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        rank = max(1, round(self.percentile / 100 * len(ordered)))
+        return min(ordered[min(rank, len(ordered)) - 1], self.max_delay)
+
+    def _record(self, key, seconds):
+        self._latencies.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    async def _timed(self, key, call, record_cancelled=False):
+        start = time.perf_counter()
+        try:
+            result = await call()
+        except asyncio.CancelledError:
+            # A primary that lost to its hedge took at least this long; leaving it out
+            # would pull the percentile toward the fast calls that survive
+            if record_cancelled:
+                self._record(key, time.perf_counter() - start)
+            raise
+        self._record(key, time.perf_counter() - start)
+        return result
+
+    async def run(self, key, call, may_hedge=None):
+        """Await ``call()``, racing a second ``call()`` against it past the deadline
+
+        ``may_hedge()`` is asked when the deadline passes; the backup is only sent if it returns True.
+        """
+        self.calls += 1
+        deadline = self.deadline(key)
+        primary = asyncio.ensure_future(self._timed(key, call, record_cancelled=True))
+        if deadline is None:
+            return await primary
+
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=deadline)
+            if not done:
+                if may_hedge is None or may_hedge():
+                    self.hedges_fired += 1
+                    tasks.add(asyncio.ensure_future(self._timed(key, call)))
+                else:
+                    self.hedges_skipped += 1
+            while True:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((task for task in done if task.exception() is None), None)
+                if winner is not None:
+                    if winner is not primary:
+                        self.hedges_won += 1
+                    return winner.result()
+                tasks -= done
+                if not tasks:
+                    # Both failed: surface the primary's error
+                    return primary.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "calls": self.calls,
+            "hedges_fired": self.hedges_fired,
+            "hedges_won": self.hedges_won,
+            "hedges_skipped": self.hedges_skipped,
+            "hedge_rate": self.hedges_fired / self.calls if self.calls else 0.0,
+            "hedge_win_rate": self.hedges_won / self.hedges_fired if self.hedges_fired else 0.0,
+        }
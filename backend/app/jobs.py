@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from .ai_service import PartialGenerationError
+from .database import AsyncSessionLocal, read_router
+from .models import Prompt
+from .persistence import prompt_writer
+from .metrics import GENERATIONS_IN_FLIGHT
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BatchItem:
+    index: int
+    query: str
+    status: str = "pending"  # pending -> running -> completed | failed
+    prompt_id: Optional[str] = None
+    responses: Dict[str, Optional[str]] = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+@dataclass
+class BatchJob:
+    id: str
+    user_id: str
+    tones: List[str]
+    use_cache: bool
+    items: List[BatchItem]
+    status: str = "queued"  # queued -> running -> completed | cancelled
+    created_at: datetime = field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
+
+    def counts(self):
+        counts = {"pending": 0, "running": 0, "completed": 0, "failed": 0}
+        for item in self.items:
+            counts[item.status] += 1
+        return counts
+
+
+class BatchJobManager:
+    """Runs batch generation jobs on a shared pool of at most ``concurrency`` generations
+
+    The limit is global rather than per job, so several large jobs cannot multiply
+    the load on the LLM provider. Jobs live in memory; the newest ``max_jobs`` are
+    kept for status polling.
+    """
+
+    def __init__(self, ai_service, session_factory, concurrency=4, max_jobs=100):
+        self.ai_service = ai_service
+        self.session_factory = session_factory
+        self.concurrency = concurrency
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._tasks = {}
+        self._semaphore = None
+
+    @classmethod
+    def from_env(cls, ai_service, session_factory=AsyncSessionLocal):
+        return cls(
+            ai_service,
+            session_factory,
+            concurrency=int(os.getenv("BATCH_CONCURRENCY", "4")),
+            max_jobs=int(os.getenv("BATCH_MAX_JOBS", "100")),
+        )
+
+    def submit(self, user_id, queries, tones, use_cache=True):
+        """Register a job and start it in the background; returns immediately"""
+        if self._semaphore is None:
+            # Created lazily so it binds to the running event loop
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        job = BatchJob(
+            id=str(uuid.uuid4()),
+            user_id=user_id,
+            tones=sorted(tones),
+            use_cache=use_cache,
+            items=[BatchItem(index=i, query=query) for i, query in enumerate(queries)],
+        )
+        self._jobs[job.id] = job
+        self._evict_finished()
+        self._tasks[job.id] = asyncio.create_task(self._run(job))
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def _evict_finished(self):
+        for job_id in list(self._jobs):
+            if len(self._jobs) <= self.max_jobs:
+                break
+            if job_id not in self._tasks:
+                del self._jobs[job_id]
+
+    async def _run(self, job):
+        job.status = "running"
+        try:
+            await asyncio.gather(*(self._run_item(job, item) for item in job.items))
+            job.status = "completed"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            raise
+        finally:
+            job.finished_at = datetime.utcnow()
+            self._tasks.pop(job.id, None)
+
+    async def _run_item(self, job, item):
+        async with self._semaphore:
+            with GENERATIONS_IN_FLIGHT.labels("batch").track_inprogress():
+                await self._generate_item(job, item)
+
+    async def _generate_item(self, job, item):
+        item.status = "running"
+        try:
+            item.responses = await self.ai_service.generate_responses_async(
+                item.query, use_cache=job.use_cache, tones=set(job.tones)
+            )
+            item.prompt_id = str(await self._persist(job.user_id, item.query, item.responses))
+            item.status = "completed"
+        except PartialGenerationError as e:
+            item.responses = e.responses
+            item.error = str(e)
+            item.status = "failed"
+        except Exception as e:
+            logger.exception("Batch job %s item %d failed", job.id, item.index)
+            item.error = str(e)
+            item.status = "failed"
+
+    async def _persist(self, user_id, query, responses):
+        if prompt_writer.running:
+            return await prompt_writer.enqueue(user_id, query, **responses)
+        prompt = Prompt(id=uuid.uuid4(), user_id=user_id, query=query, **responses)
+        async with self.session_factory() as db:
+            db.add(prompt)
+            await db.commit()
+        read_router.record_write(user_id)
+        return prompt.id
+
+    async def shutdown(self):
+        """Cancel jobs that are still running"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._semaphore = None
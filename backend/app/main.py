@@ -1,18 +1,81 @@
 # Add content to backend/app/main.py
-from fastapi import FastAPI
+import time
+
+# Taken before anything heavy is imported, for the import-to-ready figure
+IMPORT_STARTED = time.perf_counter()
+
+from contextlib import asynccontextmanager
+import asyncio
+import logging
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse
 import os
 from dotenv import load_dotenv
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
-from .database import engine, Base
-from .routes import router
+from . import database
+from .routes import STATS_SOURCES, router, ai_service, batch_jobs
+from .persistence import prompt_writer
+from .conversation import conversations
+from .archive import prompt_archiver
+from .profiling import ProfilingMiddleware, profile_store, router as profiling_router
+from .compression import CompressionMiddleware
+from .metrics import STARTUP_SECONDS, MetricsMiddleware, register_stats
 
 load_dotenv()
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
+logger = logging.getLogger(__name__)
+
+# Connections opened at startup (0 disables); keep it at or below DB_POOL_SIZE
+DB_POOL_PREWARM = int(os.getenv("DB_POOL_PREWARM", "0"))
+READINESS_TIMEOUT_SECONDS = float(os.getenv("READINESS_TIMEOUT_SECONDS", "2"))
+# Responses smaller than this are sent uncompressed
+GZIP_MINIMUM_SIZE = int(os.getenv("GZIP_MINIMUM_SIZE", "1000"))
+
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Create and warm shared resources before serving; release them on shutdown
 
-app = FastAPI(title="AI Response Generator API")
+    The schema is not touched here: run ``python -m app.migrations`` first.
+    """
+    started = time.perf_counter()
+    database.init_engines()
+    ai_service.warm_up()
+    if DB_POOL_PREWARM:
+        await database.prewarm_pool(DB_POOL_PREWARM)
+    await prompt_writer.start()
+    await prompt_archiver.start()
+    startup_seconds = time.perf_counter() - started
+    app.state.startup = {
+        "import_seconds": round(IMPORT_SECONDS, 3),
+        "startup_seconds": round(startup_seconds, 3),
+        "import_to_ready_seconds": round(time.perf_counter() - IMPORT_STARTED, 3),
+    }
+    STARTUP_SECONDS.labels("import").set(IMPORT_SECONDS)
+    STARTUP_SECONDS.labels("startup").set(startup_seconds)
+    STARTUP_SECONDS.labels("import_to_ready").set(app.state.startup["import_to_ready_seconds"])
+    logger.info("Ready in %.3fs (import %.3fs, startup %.3fs)", app.state.startup["import_to_ready_seconds"], IMPORT_SECONDS, startup_seconds)
+    app.state.ready = True
+    try:
+        yield
+    finally:
+        app.state.ready = False
+        # Stop batch jobs first so their results still reach the flusher, then drain it
+        await batch_jobs.shutdown()
+        await conversations.shutdown()
+        await prompt_archiver.stop()
+        # Flush every queued prompt before the process exits
+        await prompt_writer.stop()
+        await database.dispose_engines()
+
+
+# orjson encodes the (already validated) response bodies several times faster than json
+app = FastAPI(title="AI Response Generator API", lifespan=lifespan, default_response_class=ORJSONResponse)
+app.state.ready = False
 
 # Configure CORS
 app.add_middleware(
@@ -22,9 +85,39 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware, minimum_size=GZIP_MINIMUM_SIZE, compresslevel=6)
+# Opt-in (PROFILING_ENABLED); a no-op pass-through for requests it does not select
+app.add_middleware(ProfilingMiddleware, store=profile_store)
+# Added last so it is outermost and its timings include compression
+app.add_middleware(MetricsMiddleware)
+
+# Component counters from the stats() methods, exported next to the histograms
+register_stats(STATS_SOURCES)
 
 # Include routes
 app.include_router(router, prefix="/api")
+app.include_router(profiling_router, prefix="/debug", include_in_schema=False)
+
+@app.get("/health/live", include_in_schema=False)
+def liveness():
+    """The process is up and serving; no dependencies are checked"""
+    return {"status": "alive"}
+
+@app.get("/health/ready", include_in_schema=False)
+async def readiness():
+    """Startup has finished and the database answers; 503 otherwise"""
+    if not app.state.ready:
+        return JSONResponse({"status": "starting"}, status_code=503)
+    try:
+        await asyncio.wait_for(database.ping_database(), READINESS_TIMEOUT_SECONDS)
+    except Exception as e:
+        return JSONResponse({"status": "unavailable", "database": type(e).__name__}, status_code=503)
+    return {"status": "ready", **app.state.startup}
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 @app.get("/")
 def read_root():
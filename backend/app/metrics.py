@@ -0,0 +1,146 @@
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, REGISTRY
+
+# Buckets stretch to a minute because LLM completions routinely take several seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+STAGE_LATENCY = Histogram(
+    "ai_response_stage_seconds",
+    "Latency of individual request stages (completions, database calls, serialization)",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_LATENCY = Histogram(
+    "ai_response_http_request_seconds",
+    "End-to-end HTTP request latency by endpoint",
+    ["method", "endpoint", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_IN_FLIGHT = Gauge("ai_response_http_requests_in_flight", "HTTP requests currently being served")
+GENERATIONS_IN_FLIGHT = Gauge(
+    "ai_response_generations_in_flight",
+    "Generations currently running, by entry point",
+    ["kind"],
+)
+LLM_TOKENS = Counter(
+    "ai_response_llm_tokens_total",
+    "LLM tokens reported by the provider's usage block",
+    ["tone", "kind"],
+)
+STARTUP_SECONDS = Gauge(
+    "ai_response_startup_seconds",
+    "Cold start timings: module import, lifespan startup and import-to-ready",
+    ["phase"],
+)
+SLOW_QUERIES = Counter(
+    "ai_response_slow_queries_total",
+    "SQL statements slower than SLOW_QUERY_SECONDS",
+)
+ERRORS = Counter(
+    "ai_response_errors_total",
+    "Errors by stage and exception type",
+    ["stage", "type"],
+)
+
+
+@contextmanager
+def observe_stage(stage):
+    """Time a block into the stage histogram and count any exception it raises"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        ERRORS.labels(stage, type(e).__name__).inc()
+        raise
+    finally:
+        STAGE_LATENCY.labels(stage).observe(time.perf_counter() - start)
+
+
+def record_token_usage(tone, completion):
+    usage = getattr(completion, "usage", None)
+    for kind in ("prompt_tokens", "completion_tokens"):
+        value = getattr(usage, kind, None)
+        if isinstance(value, int):
+            LLM_TOKENS.labels(tone, kind.replace("_tokens", "")).inc(value)
+
+
+# stats() fields that only ever grow; they are exported as counters (``..._total``)
+COUNTER_FIELDS = frozenset({
+    "hits", "persistent_hits", "misses", "evictions",
+    "batches_flushed", "rows_written", "rows_failed", "flush_retries",
+    "runs", "months_archived", "rows_archived", "failures",
+    "admitted", "rejected_queue_full", "rejected_user_limit", "timed_out",
+    "calls", "throttled_calls", "retries", "queue_wait_seconds_total", "hedges_allowed", "hedges_denied",
+    "executions", "coalesced",
+    "combined_calls", "combined_repaired", "combined_fallbacks",
+    "small_routed", "large_routed",
+    "hedges_fired", "hedges_won", "hedges_skipped",
+    "contexts_built", "turns_trimmed", "summaries", "turns_summarized", "summary_failures",
+    "replica_reads", "primary_reads",
+    "profiled", "skipped_busy",
+})
+
+
+class StatsCollector:
+    """Expose the numeric fields of ``stats()`` dicts (cache, scheduler, ...) as metrics
+
+    Fields in COUNTER_FIELDS become counters and the rest (sizes, rates, limits,
+    averages) gauges.
+    """
+
+    def __init__(self, sources):
+        self.sources = sources  # component name -> zero-argument callable returning a dict
+
+    def collect(self):
+        for component, stats in self.sources.items():
+            for name, value in stats().items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                family = CounterMetricFamily if name in COUNTER_FIELDS else GaugeMetricFamily
+                yield family(
+                    f"ai_response_{component}_{name}",
+                    f"{component} {name.replace('_', ' ')}",
+                    value=value,
+                )
+
+
+def register_stats(sources):
+    REGISTRY.register(StatsCollector(sources))
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request latency and in-flight requests
+
+    Requests are labelled with the handler name (resolved by the router) rather
+    than the raw path, so ids in URLs do not explode label cardinality.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            endpoint = scope.get("endpoint")
+            HTTP_LATENCY.labels(
+                scope["method"],
+                getattr(endpoint, "__name__", "unmatched"),
+                str(status["code"]),
+            ).observe(time.perf_counter() - start)
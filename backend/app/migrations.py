@@ -0,0 +1,384 @@
+"""Explicit, versioned schema migrations
+
+Run once per deploy, before the API starts:
+
+    python -m app.migrations          # apply pending migrations
+    python -m app.migrations --status # list applied and pending ones
+
+Each migration runs in its own transaction and is recorded in
+``schema_migrations``. They are written to be safe on databases that predate
+this runner (tables created by the old import-time ``create_all``).
+"""
+import argparse
+import logging
+import sys
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import Column, DateTime, MetaData, String, Table, Text, Uuid, bindparam, inspect, select, text
+
+from . import database
+from .archive import PARTITION_MONTHS_AHEAD, ensure_partitions
+from .database import Base
+from .models import RESPONSE_TONES, ResponseBlob, Thread, search_user_token, store_blobs
+from .storage import content_hash, decompress, storage_report
+
+logger = logging.getLogger(__name__)
+
+schema_migrations = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("name", String(128), primary_key=True),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+def create_tables(conn):
+    # checkfirst: only tables that do not exist yet are created (with their indexes)
+    Base.metadata.create_all(conn)
+
+
+def _prompt_columns(conn):
+    return {column["name"] for column in inspect(conn).get_columns("prompts")}
+
+
+def _has_inline_responses(conn):
+    """True for databases that still keep response text in prompts (before 0005)"""
+    return "casual_response" in _prompt_columns(conn)
+
+
+def history_index(conn):
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_prompts_user_id_created_at ON prompts (user_id, created_at)"))
+
+
+def nullable_responses(conn):
+    # Single-tone prompts leave the other response NULL; SQLite tables have always been created nullable
+    if conn.dialect.name == "postgresql" and _has_inline_responses(conn):
+        conn.execute(text("ALTER TABLE prompts ALTER COLUMN casual_response DROP NOT NULL"))
+        conn.execute(text("ALTER TABLE prompts ALTER COLUMN formal_response DROP NOT NULL"))
+
+
+# Search over the inline response columns, as first shipped; replaced by 0005
+LEGACY_SQLITE_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS prompts_fts USING fts5("
+    "query, casual_response, formal_response, "
+    "content='prompts', content_rowid='rowid', tokenize='porter unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS prompts_fts_ai AFTER INSERT ON prompts BEGIN "
+    "INSERT INTO prompts_fts(rowid, query, casual_response, formal_response) "
+    "VALUES (new.rowid, new.query, new.casual_response, new.formal_response); END",
+    "CREATE TRIGGER IF NOT EXISTS prompts_fts_ad AFTER DELETE ON prompts BEGIN "
+    "INSERT INTO prompts_fts(prompts_fts, rowid, query, casual_response, formal_response) "
+    "VALUES ('delete', old.rowid, old.query, old.casual_response, old.formal_response); END",
+    "CREATE TRIGGER IF NOT EXISTS prompts_fts_au AFTER UPDATE ON prompts BEGIN "
+    "INSERT INTO prompts_fts(prompts_fts, rowid, query, casual_response, formal_response) "
+    "VALUES ('delete', old.rowid, old.query, old.casual_response, old.formal_response); "
+    "INSERT INTO prompts_fts(rowid, query, casual_response, formal_response) "
+    "VALUES (new.rowid, new.query, new.casual_response, new.formal_response); END",
+]
+
+
+def search_index(conn):
+    if not _has_inline_responses(conn):
+        return  # created by 0001 in its current (0005) form
+    if conn.dialect.name == "postgresql":
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_prompts_search ON prompts USING gin ("
+            "to_tsvector('english', (((coalesce(query, '') || ' ') || coalesce(casual_response, '')) || ' ') "
+            "|| coalesce(formal_response, '')))"
+        ))
+    elif conn.dialect.name == "sqlite":
+        for statement in LEGACY_SQLITE_FTS_DDL:
+            conn.execute(text(statement))
+        # Index rows written before the FTS table existed
+        conn.execute(text("INSERT INTO prompts_fts(prompts_fts) VALUES ('rebuild')"))
+
+
+BACKFILL_BATCH_SIZE = 1000
+
+# Search tables as 0005 creates and fills them: frozen here, since 0009 adds user_id
+SEARCH_DDL_0005 = {
+    "postgresql": [
+        "CREATE TABLE IF NOT EXISTS prompt_search (prompt_id UUID PRIMARY KEY, document TSVECTOR NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS ix_prompt_search_document ON prompt_search USING gin (document)",
+    ],
+    "sqlite": [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS prompts_fts USING fts5("
+        "query, casual_response, formal_response, content='', tokenize='porter unicode61')",
+    ],
+}
+_search_binds_0005 = [bindparam("id", type_=Uuid(as_uuid=True))] + [
+    bindparam(name, type_=Text()) for name in ("query", "casual", "formal")
+]
+SEARCH_INDEX_0005 = {
+    "postgresql": text(
+        "INSERT INTO prompt_search (prompt_id, document) "
+        "VALUES (:id, to_tsvector('english', :query || ' ' || :casual || ' ' || :formal)) "
+        "ON CONFLICT (prompt_id) DO UPDATE SET document = excluded.document"
+    ).bindparams(*_search_binds_0005),
+    "sqlite": text(
+        "INSERT INTO prompts_fts (rowid, query, casual_response, formal_response) "
+        "SELECT rowid, :query, :casual, :formal FROM prompts WHERE id = :id"
+    ).bindparams(*_search_binds_0005),
+}
+
+
+def content_addressed_responses(conn):
+    """Move response text out of prompts into deduplicated, compressed response_blobs
+
+    Rows are rewritten in id order, one batch at a time, and the search tables are
+    rebuilt from the old columns before those are dropped.
+    """
+    ResponseBlob.__table__.create(conn, checkfirst=True)
+    columns = _prompt_columns(conn)
+    for tone in RESPONSE_TONES:
+        if f"{tone}_response_hash" not in columns:
+            conn.execute(text(
+                f"ALTER TABLE prompts ADD COLUMN {tone}_response_hash VARCHAR(64) REFERENCES response_blobs (hash)"
+            ))
+    if "casual_response" not in columns:
+        return
+
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        for trigger in ("prompts_fts_ai", "prompts_fts_ad", "prompts_fts_au"):
+            conn.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+        conn.execute(text("DROP TABLE IF EXISTS prompts_fts"))
+    for statement in SEARCH_DDL_0005.get(dialect, []):
+        conn.execute(text(statement))
+
+    last_id = None
+    while True:
+        page = text(
+            "SELECT id, query, casual_response, formal_response FROM prompts "
+            + ("WHERE id > :last_id " if last_id is not None else "")
+            + "ORDER BY id LIMIT :limit"
+        )
+        rows = conn.execute(page, {"last_id": last_id, "limit": BACKFILL_BATCH_SIZE}).all()
+        if not rows:
+            break
+        texts = {content_hash(value): value for row in rows for value in (row.casual_response, row.formal_response) if value is not None}
+        if texts:
+            store_blobs(conn, texts)
+        conn.execute(
+            text("UPDATE prompts SET casual_response_hash = :casual, formal_response_hash = :formal WHERE id = :id"),
+            [
+                {
+                    "id": row.id,
+                    "casual": content_hash(row.casual_response) if row.casual_response is not None else None,
+                    "formal": content_hash(row.formal_response) if row.formal_response is not None else None,
+                }
+                for row in rows
+            ],
+        )
+        if dialect in SEARCH_INDEX_0005:
+            conn.execute(SEARCH_INDEX_0005[dialect], [
+                {
+                    "id": uuid.UUID(str(row.id)),  # raw column value: hex on SQLite, UUID on PostgreSQL
+                    "query": row.query,
+                    "casual": row.casual_response or "",
+                    "formal": row.formal_response or "",
+                }
+                for row in rows
+            ])
+        last_id = rows[-1].id
+
+    if dialect == "postgresql":
+        conn.execute(text("DROP INDEX IF EXISTS ix_prompts_search"))
+    conn.execute(text("ALTER TABLE prompts DROP COLUMN casual_response"))
+    conn.execute(text("ALTER TABLE prompts DROP COLUMN formal_response"))
+    logger.info("Response storage after migration: %s", storage_report(conn))
+
+
+# prompts as 0006 creates it: frozen here, since later migrations add to the model
+# (0007's thread_id references a table that does not exist yet when 0006 runs)
+PARTITIONED_PROMPTS_DDL = [
+    "CREATE TABLE prompts ("
+    "id UUID NOT NULL, "
+    "user_id VARCHAR NOT NULL, "
+    "query TEXT NOT NULL, "
+    "casual_response_hash VARCHAR(64) REFERENCES response_blobs (hash), "
+    "formal_response_hash VARCHAR(64) REFERENCES response_blobs (hash), "
+    "created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL, "
+    "PRIMARY KEY (id, created_at)"
+    ") PARTITION BY RANGE (created_at)",
+    "CREATE INDEX ix_prompts_user_id_created_at ON prompts (user_id, created_at)",
+]
+
+
+def partition_prompts(conn):
+    """Convert prompts into monthly range partitions on PostgreSQL
+
+    The table is rebuilt: the old one is renamed, the partitioned one created with
+    partitions covering every existing month, the rows copied over and the old
+    table dropped. SQLite keeps one table; old months leave it through app.archive.
+    """
+    if conn.dialect.name != "postgresql":
+        return
+    now = datetime.utcnow()
+    until = now + timedelta(days=31 * PARTITION_MONTHS_AHEAD)
+    if conn.scalar(text("SELECT relkind FROM pg_class WHERE relname = 'prompts'")) == "p":
+        ensure_partitions(conn, until=until)  # created partitioned by 0001
+        return
+
+    # prompt_search can no longer reference prompts (id alone is not unique once partitioned)
+    conn.execute(text("ALTER TABLE prompt_search DROP CONSTRAINT IF EXISTS prompt_search_prompt_id_fkey"))
+    conn.execute(text("ALTER TABLE prompts RENAME TO prompts_unpartitioned"))
+    conn.execute(text("ALTER TABLE prompts_unpartitioned RENAME CONSTRAINT prompts_pkey TO prompts_unpartitioned_pkey"))
+    conn.execute(text("ALTER INDEX IF EXISTS ix_prompts_user_id_created_at RENAME TO ix_prompts_unpartitioned_user_id_created_at"))
+    for statement in PARTITIONED_PROMPTS_DDL:
+        conn.execute(text(statement))
+    oldest = conn.scalar(text("SELECT min(created_at) FROM prompts_unpartitioned"))
+    ensure_partitions(conn, until=until, since=oldest or now)
+    conn.execute(text(
+        "INSERT INTO prompts (id, user_id, query, casual_response_hash, formal_response_hash, created_at) "
+        "SELECT id, user_id, query, casual_response_hash, formal_response_hash, "
+        "coalesce(created_at, now() AT TIME ZONE 'utc') FROM prompts_unpartitioned"
+    ))
+    conn.execute(text("DROP TABLE prompts_unpartitioned"))
+
+
+def conversation_threads(conn):
+    Thread.__table__.create(conn, checkfirst=True)
+    if "thread_id" not in _prompt_columns(conn):
+        uuid_type = "UUID" if conn.dialect.name == "postgresql" else "CHAR(32)"
+        conn.execute(text(f"ALTER TABLE prompts ADD COLUMN thread_id {uuid_type} REFERENCES threads (id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_prompts_thread_id_created_at ON prompts (thread_id, created_at)"))
+
+
+def history_keyset_index(conn):
+    # id breaks created_at ties inside the index, so a cursor page is a single index range
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_prompts_user_id_created_at_id ON prompts (user_id, created_at, id)"
+    ))
+    conn.execute(text("DROP INDEX IF EXISTS ix_prompts_user_id_created_at"))
+
+
+SQLITE_SEARCH_BY_USER_DDL = (
+    "CREATE VIRTUAL TABLE prompts_fts USING fts5("
+    "query, casual_response, formal_response, user_id, content='', tokenize='porter unicode61')"
+)
+
+
+def _blob_text(data):
+    return "" if data is None else decompress(data)
+
+
+def search_by_user(conn):
+    """Store each search row's owner, so a search only matches and ranks that user's rows
+
+    PostgreSQL gains a B-tree on prompt_search.user_id. A contentless FTS5 table
+    cannot be altered or rebuilt from itself, so on SQLite it is recreated with a
+    user_id column and refilled from prompts and their response blobs.
+    """
+    if conn.dialect.name == "postgresql":
+        if "user_id" not in {column["name"] for column in inspect(conn).get_columns("prompt_search")}:
+            conn.execute(text("ALTER TABLE prompt_search ADD COLUMN user_id VARCHAR"))
+            conn.execute(text(
+                "UPDATE prompt_search SET user_id = prompts.user_id FROM prompts WHERE prompts.id = prompt_search.prompt_id"
+            ))
+            # Left behind by prompts deleted without unindexing; they could never match again
+            conn.execute(text("DELETE FROM prompt_search WHERE user_id IS NULL"))
+            conn.execute(text("ALTER TABLE prompt_search ALTER COLUMN user_id SET NOT NULL"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_prompt_search_user_id ON prompt_search (user_id)"))
+        return
+    if conn.dialect.name != "sqlite":
+        return
+    if "user_id" in {row[1] for row in conn.execute(text("PRAGMA table_info(prompts_fts)"))}:
+        return  # created by 0001 in its current form
+    conn.execute(text("DROP TABLE IF EXISTS prompts_fts"))
+    conn.execute(text(SQLITE_SEARCH_BY_USER_DDL))
+    last_rowid = 0
+    while True:
+        rows = conn.execute(text(
+            "SELECT prompts.rowid AS rowid, user_id, query, casual.data AS casual, formal.data AS formal "
+            "FROM prompts "
+            "LEFT JOIN response_blobs AS casual ON casual.hash = prompts.casual_response_hash "
+            "LEFT JOIN response_blobs AS formal ON formal.hash = prompts.formal_response_hash "
+            "WHERE prompts.rowid > :last_rowid ORDER BY prompts.rowid LIMIT :limit"
+        ), {"last_rowid": last_rowid, "limit": BACKFILL_BATCH_SIZE}).all()
+        if not rows:
+            break
+        conn.execute(
+            text(
+                "INSERT INTO prompts_fts (rowid, query, casual_response, formal_response, user_id) "
+                "VALUES (:rowid, :query, :casual, :formal, :user_token)"
+            ),
+            [
+                {
+                    "rowid": row.rowid,
+                    "query": row.query,
+                    "casual": _blob_text(row.casual),
+                    "formal": _blob_text(row.formal),
+                    "user_token": search_user_token(row.user_id),
+                }
+                for row in rows
+            ],
+        )
+        last_rowid = rows[-1].rowid
+
+
+# Append only: applied names are recorded, so never rename or reorder
+MIGRATIONS = [
+    ("0001_create_tables", create_tables),
+    ("0002_history_index", history_index),
+    ("0003_nullable_responses", nullable_responses),
+    ("0004_search_index", search_index),
+    ("0005_content_addressed_responses", content_addressed_responses),
+    ("0006_partition_prompts", partition_prompts),
+    ("0007_conversation_threads", conversation_threads),
+    ("0008_history_keyset_index", history_keyset_index),
+    ("0009_search_by_user", search_by_user),
+]
+
+
+def applied_migrations(engine):
+    if not inspect(engine).has_table("schema_migrations"):
+        return set()
+    with engine.connect() as conn:
+        return set(conn.scalars(select(schema_migrations.c.name)))
+
+
+def pending_migrations(engine):
+    applied = applied_migrations(engine)
+    return [name for name, _ in MIGRATIONS if name not in applied]
+
+
+def migrate(engine=None):
+    """Apply pending migrations in order and return their names"""
+    engine = engine or database.init_engines()[0]
+    schema_migrations.create(engine, checkfirst=True)
+    applied = applied_migrations(engine)
+    ran = []
+    for name, migration in MIGRATIONS:
+        if name in applied:
+            continue
+        with engine.begin() as conn:
+            migration(conn)
+            conn.execute(schema_migrations.insert().values(name=name, applied_at=datetime.utcnow()))
+        logger.info("Applied migration %s", name)
+        ran.append(name)
+    return ran
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply database schema migrations")
+    parser.add_argument("--status", action="store_true", help="list migrations without applying them")
+    args = parser.parse_args(argv)
+
+    engine = database.init_engines()[0]
+    if args.status:
+        pending = pending_migrations(engine)
+        for name, _ in MIGRATIONS:
+            print(f"{'pending' if name in pending else 'applied'}  {name}")
+        return 1 if pending else 0
+
+    ran = migrate(engine)
+    if "0005_content_addressed_responses" in ran:
+        with engine.connect() as conn:
+            print(f"response storage: {storage_report(conn)}")
+    print("\n".join(f"applied  {name}" for name in ran) or "Schema is up to date")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
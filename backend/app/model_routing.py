@@ -0,0 +1,56 @@
+import os
+
+from dotenv import load_dotenv
+
+from .rate_limit import estimate_text_tokens
+
+load_dotenv()
+
+
+class ModelRouter:
+    """Pick the completion model for a query from its length and tone
+
+    Queries whose estimated size reaches the tone's threshold go to the large
+    model, everything else to the small one. Without a large model configured
+    every query uses the small (default) model.
+    """
+
+    def __init__(self, small_model, large_model=None, thresholds=None):
+        self.small_model = small_model
+        self.large_model = large_model
+        self.thresholds = thresholds or {}  # tone -> query tokens at which the large model is used
+        self.routed = {}  # model -> requests routed to it
+
+    @classmethod
+    def from_env(cls, default_model):
+        return cls(
+            small_model=os.getenv("LLM_SMALL_MODEL") or default_model,
+            large_model=os.getenv("LLM_LARGE_MODEL") or None,
+            thresholds={
+                "casual": int(os.getenv("ROUTING_CASUAL_LARGE_TOKENS", "400")),
+                "formal": int(os.getenv("ROUTING_FORMAL_LARGE_TOKENS", "100")),
+            },
+        )
+
+    def wants_large(self, query, tone):
+        threshold = self.thresholds.get(tone)
+        return self.large_model is not None and threshold is not None and estimate_text_tokens(query) >= threshold
+
+    def model_for(self, query, *tones):
+        """Model for one completion serving ``tones``; the large one if any tone calls for it
+
+        Pure, so it can pick cache keys; call ``record`` once the completion is really sent.
+        """
+        return self.large_model if any(self.wants_large(query, tone) for tone in tones) else self.small_model
+
+    def record(self, model):
+        """Count a request routed to ``model``: one that missed the cache"""
+        self.routed[model] = self.routed.get(model, 0) + 1
+
+    def stats(self):
+        return {
+            "small_model": self.small_model,
+            "large_model": self.large_model,
+            "small_routed": self.routed.get(self.small_model, 0),
+            "large_routed": self.routed.get(self.large_model, 0) if self.large_model else 0,
+        }
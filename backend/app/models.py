@@ -1,16 +1,213 @@
-from sqlalchemy import Column, String, Text, DateTime
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import (
+    DDL, Column, DateTime, ForeignKey, Index, Integer, LargeBinary, PrimaryKeyConstraint, String, Text, Uuid,
+    bindparam, event, insert, select, text,
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session, relationship
 from datetime import datetime
+import hashlib
 import uuid
 
 from .database import Base
+from .storage import compress, content_hash, decompress
+
+RESPONSE_TONES = ("casual", "formal")
+
+class ResponseBlob(Base):
+    __tablename__ = "response_blobs"
+
+    hash = Column(String(64), primary_key=True)  # sha256 of the uncompressed UTF-8 text
+    data = Column(LargeBinary, nullable=False)  # zlib-compressed text
+    size = Column(Integer, nullable=False)  # uncompressed bytes, for the storage report
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    @property
+    def text(self):
+        return decompress(self.data)
+
+def _response_text(tone):
+    """Plain-text view of a tone's blob: assigning stores the text by hash, reading returns it"""
+    hash_attr, blob_attr = f"{tone}_response_hash", f"{tone}_blob"
+
+    def get(self):
+        # Text assigned in this process wins: the blob row may not be loaded (or written) yet
+        pending = getattr(self, "_response_texts", {})
+        if tone in pending:
+            return pending[tone]
+        blob = getattr(self, blob_attr)
+        return None if blob is None else blob.text
+
+    def set(self, value):
+        if not hasattr(self, "_response_texts"):
+            self._response_texts = {}
+        self._response_texts[tone] = value
+        setattr(self, hash_attr, None if value is None else content_hash(value))
+
+    return property(get, set)
+
+class Thread(Base):
+    """A conversation: its prompts are the turns, older ones folded into ``summary``"""
+    __tablename__ = "threads"
+
+    id = Column(Uuid(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(String, nullable=False, index=True)
+    title = Column(String, nullable=True)
+    summary = Column(Text, nullable=True)  # condensed turns up to summarized_until
+    summarized_until = Column(DateTime, nullable=True)  # created_at of the newest summarized turn
+    summarized_turns = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
 
 class Prompt(Base):
     __tablename__ = "prompts"
     
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    # Native UUID on PostgreSQL, CHAR(32) elsewhere, so the service also runs on SQLite
+    id = Column(Uuid(as_uuid=True), nullable=False, default=uuid.uuid4)
     user_id = Column(String, nullable=False)
     query = Column(Text, nullable=False)
-    casual_response = Column(Text, nullable=False)
-    formal_response = Column(Text, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    # Responses live in response_blobs; either hash is NULL when the user asked for a single tone
+    casual_response_hash = Column(String(64), ForeignKey("response_blobs.hash"), nullable=True)
+    formal_response_hash = Column(String(64), ForeignKey("response_blobs.hash"), nullable=True)
+    thread_id = Column(Uuid(as_uuid=True), ForeignKey("threads.id"), nullable=True)  # NULL for one-off prompts
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    # Joined so rows come back with their text in one query (lazy loads fail on async sessions)
+    casual_blob = relationship(ResponseBlob, foreign_keys=[casual_response_hash], lazy="joined", viewonly=True)
+    formal_blob = relationship(ResponseBlob, foreign_keys=[formal_response_hash], lazy="joined", viewonly=True)
+
+    casual_response = _response_text("casual")
+    formal_response = _response_text("formal")
+
+    __table_args__ = (
+        # PostgreSQL partitions by month (see app.archive), and the partition key must be
+        # part of the primary key; rows are still identified by id alone
+        PrimaryKeyConstraint("id", "created_at"),
+        # Serves /history: equality on user_id, then a range scan in (created_at, id) cursor order
+        Index("ix_prompts_user_id_created_at_id", "user_id", "created_at", "id"),
+        # Loads a thread's turns in order
+        Index("ix_prompts_thread_id_created_at", "thread_id", "created_at"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+    __mapper_args__ = {"primary_key": [id]}
+
+# Full-text search lives in side tables the app fills on insert (see _index_prompts),
+# because the response text is only stored compressed. Both carry the owner, so a
+# search narrows to one user's rows before anything is matched or ranked.
+# PostgreSQL: one tsvector per prompt behind a GIN index, plus a user_id B-tree. No
+# foreign key: prompts is partitioned, so id alone is not unique there; deletes
+# remove search rows themselves.
+POSTGRES_SEARCH_DDL = [
+    "CREATE TABLE IF NOT EXISTS prompt_search ("
+    "prompt_id UUID PRIMARY KEY, "
+    "user_id VARCHAR NOT NULL, "
+    "document TSVECTOR NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS ix_prompt_search_document ON prompt_search USING gin (document)",
+    "CREATE INDEX IF NOT EXISTS ix_prompt_search_user_id ON prompt_search (user_id)",
+]
+# SQLite: contentless FTS5 table keyed by the prompts rowid; it keeps the index, not the text.
+# user_id holds search_user_token(user_id), a single term matched alongside the query words.
+SQLITE_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS prompts_fts USING fts5("
+    "query, casual_response, formal_response, user_id, content='', tokenize='porter unicode61')",
+]
+for statement in POSTGRES_SEARCH_DDL:
+    event.listen(Prompt.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+for statement in SQLITE_FTS_DDL:
+    event.listen(Prompt.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+event.listen(Prompt.__table__, "before_drop", DDL("DROP TABLE IF EXISTS prompt_search").execute_if(dialect="postgresql"))
+event.listen(Prompt.__table__, "after_drop", DDL("DROP TABLE IF EXISTS prompts_fts").execute_if(dialect="sqlite"))
+
+def search_user_token(user_id):
+    """One FTS5 term per user: raw ids would be split into several words by the tokenizer"""
+    return "u" + hashlib.sha256(user_id.encode()).hexdigest()[:32]
+
+_search_binds = {"id": bindparam("id", type_=Uuid(as_uuid=True))} | {
+    name: bindparam(name, type_=Text()) for name in ("query", "casual", "formal", "user_id", "user_token")
+}
+
+def _search_statement(sql):
+    return text(sql).bindparams(*(bind for name, bind in _search_binds.items() if f":{name}" in sql))
+
+INDEX_STATEMENTS = {
+    "postgresql": _search_statement(
+        "INSERT INTO prompt_search (prompt_id, user_id, document) "
+        "VALUES (:id, :user_id, to_tsvector('english', :query || ' ' || :casual || ' ' || :formal)) "
+        "ON CONFLICT (prompt_id) DO UPDATE SET user_id = excluded.user_id, document = excluded.document"
+    ),
+    "sqlite": _search_statement(
+        "INSERT INTO prompts_fts (rowid, query, casual_response, formal_response, user_id) "
+        "SELECT rowid, :query, :casual, :formal, :user_token FROM prompts WHERE id = :id"
+    ),
+}
+UNINDEX_STATEMENTS = {
+    "postgresql": _search_statement("DELETE FROM prompt_search WHERE prompt_id = :id"),
+    # Contentless FTS5 rows are removed by replaying the indexed values
+    "sqlite": _search_statement(
+        "INSERT INTO prompts_fts (prompts_fts, rowid, query, casual_response, formal_response, user_id) "
+        "SELECT 'delete', rowid, :query, :casual, :formal, :user_token FROM prompts WHERE id = :id"
+    ),
+}
+
+def search_params(prompt):
+    return {
+        "id": prompt.id,
+        "query": prompt.query,
+        "casual": prompt.casual_response or "",
+        "formal": prompt.formal_response or "",
+        "user_id": prompt.user_id,
+        "user_token": search_user_token(prompt.user_id),
+    }
+
+def store_blobs(connection, texts):
+    """Insert the texts not stored yet; ``texts`` maps content hash to text"""
+    existing = set(connection.scalars(select(ResponseBlob.hash).where(ResponseBlob.hash.in_(list(texts)))))
+    rows = [
+        {"hash": key, "data": compress(value), "size": len(value.encode()), "created_at": datetime.utcnow()}
+        for key, value in texts.items()
+        if key not in existing
+    ]
+    if not rows:
+        return
+    dialect = connection.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        # Another writer may store the same text between the check and the insert
+        stmt = (pg_insert if dialect == "postgresql" else sqlite_insert)(ResponseBlob).on_conflict_do_nothing()
+    else:
+        stmt = insert(ResponseBlob)
+    connection.execute(stmt, rows)
+
+def _changed_prompts(session, objects):
+    return [obj for obj in objects if isinstance(obj, Prompt) and getattr(obj, "_response_texts", None) is not None]
+
+@event.listens_for(Session, "before_flush")
+def _store_response_blobs(session, flush_context, instances):
+    prompts = _changed_prompts(session, list(session.new) + list(session.dirty))
+    texts = {
+        content_hash(value): value
+        for prompt in prompts
+        for value in prompt._response_texts.values()
+        if value is not None
+    }
+    connection = session.connection()
+    if texts:
+        store_blobs(connection, texts)
+    # Deleted rows leave the search index first (on SQLite, while their rowid still exists).
+    # Only ORM deletes get this; bulk DELETE statements must run UNINDEX_STATEMENTS themselves.
+    deleted = [prompt for prompt in session.deleted if isinstance(prompt, Prompt)]
+    statement = UNINDEX_STATEMENTS.get(connection.dialect.name)
+    if deleted and statement is not None:
+        connection.execute(statement, [search_params(prompt) for prompt in deleted])
+
+@event.listens_for(Session, "after_flush")
+def _index_prompts(session, flush_context):
+    prompts = [obj for obj in session.new if isinstance(obj, Prompt)]
+    statement = INDEX_STATEMENTS.get(session.connection().dialect.name)
+    if prompts and statement is not None:
+        session.connection().execute(statement, [search_params(prompt) for prompt in prompts])
+
+class CachedResponse(Base):
+    __tablename__ = "response_cache"
+
+    key = Column(String(64), primary_key=True)  # sha256 of normalized query, tone, model and temperature
+    response = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+from .database import AsyncSessionLocal, read_router
+from .models import Prompt
+from .metrics import observe_stage
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class PromptWriter:
+    """Write-behind buffer that persists Prompt rows in batches off the request path
+
+    Records wait in a bounded queue (callers block once it is full, which gives
+    natural backpressure) and a background task commits them when either
+    ``batch_size`` records are waiting or ``flush_interval`` seconds have passed
+    since the first one arrived. A batch whose commit fails is retried up to
+    ``max_retries`` times with exponential backoff before its rows are dropped,
+    since their requests have already been answered.
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        enabled=False,
+        max_queue=1000,
+        batch_size=50,
+        flush_interval=0.5,
+        max_retries=5,
+        retry_delay=0.5,
+    ):
+        self.session_factory = session_factory
+        self.enabled = enabled
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._queue = None
+        self._task = None
+        self.batches_flushed = 0
+        self.rows_written = 0
+        self.rows_failed = 0  # dropped after every retry failed
+        self.flush_retries = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+
+    @classmethod
+    def from_env(cls, session_factory=AsyncSessionLocal):
+        return cls(
+            session_factory,
+            enabled=os.getenv("PROMPT_WRITE_BEHIND", "false").lower() in ("1", "true", "yes"),
+            max_queue=int(os.getenv("PROMPT_WRITE_BEHIND_MAX_QUEUE", "1000")),
+            batch_size=int(os.getenv("PROMPT_WRITE_BEHIND_BATCH_SIZE", "50")),
+            flush_interval=float(os.getenv("PROMPT_WRITE_BEHIND_FLUSH_INTERVAL", "0.5")),
+            max_retries=int(os.getenv("PROMPT_WRITE_BEHIND_MAX_RETRIES", "5")),
+            retry_delay=float(os.getenv("PROMPT_WRITE_BEHIND_RETRY_DELAY", "0.5")),
+        )
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if not self.enabled or self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop accepting work and flush everything still queued"""
+        if not self.running:
+            return
+        await self._queue.put(None)  # sentinel: drain what is ahead of it, then exit
+        await self._task
+        self._task = None
+
+    async def enqueue(self, user_id, query, casual_response=None, formal_response=None, **fields):
+        """Queue a prompt for persistence and return the id it will be stored under"""
+        record = {
+            "id": uuid.uuid4(),
+            "user_id": user_id,
+            "query": query,
+            "casual_response": casual_response,
+            "formal_response": formal_response,
+            "created_at": datetime.utcnow(),
+            **fields,
+        }
+        await self._queue.put(record)
+        return record["id"]
+
+    async def _next_batch(self):
+        first = await self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                record = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if record is None:
+                return batch, True
+            batch.append(record)
+        return batch, False
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = await self._next_batch()
+            if batch:
+                await self._flush(batch)
+
+    async def _commit(self, batch):
+        with observe_stage("db_write_behind_flush"):
+            async with self.session_factory() as db:
+                db.add_all([Prompt(**record) for record in batch])
+                await db.commit()
+
+    async def _flush(self, batch):
+        """Commit one batch, retrying transient failures; rows are dropped only when every attempt failed"""
+        start = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self._commit(batch)
+                break
+            except Exception:
+                if attempt == self.max_retries:
+                    self.rows_failed += len(batch)
+                    logger.exception(
+                        "Write-behind flush of %d prompts failed %d times; dropping prompt ids %s",
+                        len(batch), attempt + 1, ", ".join(str(record["id"]) for record in batch),
+                    )
+                    return
+                delay = self.retry_delay * 2 ** attempt
+                self.flush_retries += 1
+                logger.warning(
+                    "Write-behind flush of %d prompts failed (attempt %d of %d); retrying in %.1fs",
+                    len(batch), attempt + 1, self.max_retries + 1, delay, exc_info=True,
+                )
+                await asyncio.sleep(delay)
+        elapsed = time.perf_counter() - start
+        for record in batch:
+            read_router.record_write(record["user_id"])
+        self.batches_flushed += 1
+        self.rows_written += len(batch)
+        self.last_batch_size = len(batch)
+        self.max_batch_size = max(self.max_batch_size, len(batch))
+        self.last_flush_seconds = elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+        self.total_flush_seconds += elapsed
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "running": self.running,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue": self.max_queue,
+            "batches_flushed": self.batches_flushed,
+            "rows_written": self.rows_written,
+            "rows_failed": self.rows_failed,
+            "flush_retries": self.flush_retries,
+            "last_batch_size": self.last_batch_size,
+            "max_batch_size": self.max_batch_size,
+            "avg_batch_size": self.rows_written / self.batches_flushed if self.batches_flushed else 0.0,
+            "last_flush_seconds": self.last_flush_seconds,
+            "max_flush_seconds": self.max_flush_seconds,
+            "avg_flush_seconds": self.total_flush_seconds / self.batches_flushed if self.batches_flushed else 0.0,
+        }
+
+
+prompt_writer = PromptWriter.from_env()
@@ -0,0 +1,183 @@
+"""Opt-in per-request profiling
+
+A request is profiled when PROFILING_ENABLED is set and it either sends an
+``X-Profile`` header (equal to PROFILING_TOKEN, when one is configured) or is
+picked by PROFILING_SAMPLE_RATE. Its cProfile is kept in memory, the response
+carries ``X-Profile-Id``, and the profile can be downloaded from
+``/debug/profiles/{id}`` (a .prof file for pstats/snakeviz, or ``?format=text``).
+
+cProfile sees the whole event-loop thread, so anything other requests run
+while the profiled one is in progress shows up in its profile too; only one
+request is profiled at a time.
+"""
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import random
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Literal, Optional
+
+from dotenv import load_dotenv
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse, Response
+from starlette.datastructures import Headers, MutableHeaders
+
+load_dotenv()
+
+
+class ProfileStore:
+    """The newest ``max_profiles`` request profiles, as marshalled pstats data"""
+
+    def __init__(self, enabled=False, sample_rate=0.0, token=None, max_profiles=50):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.token = token
+        self.max_profiles = max_profiles
+        self._profiles = OrderedDict()  # id -> (metadata, data)
+        self.active = False
+        self.profiled = 0
+        self.skipped_busy = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            enabled=os.getenv("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes"),
+            sample_rate=float(os.getenv("PROFILING_SAMPLE_RATE", "0")),
+            token=os.getenv("PROFILING_TOKEN") or None,
+            max_profiles=int(os.getenv("PROFILING_MAX_PROFILES", "50")),
+        )
+
+    def wants(self, headers):
+        if not self.enabled:
+            return False
+        requested = headers.get("x-profile")
+        if requested is not None:
+            return self.token is None or requested == self.token
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def add(self, profile_id, metadata, profile):
+        profile.create_stats()
+        self._profiles[profile_id] = ({"id": profile_id, **metadata}, marshal.dumps(profile.stats))
+        while len(self._profiles) > self.max_profiles:
+            self._profiles.popitem(last=False)
+        self.profiled += 1
+        return profile_id
+
+    def get(self, profile_id):
+        return self._profiles.get(profile_id)
+
+    def list(self):
+        return [metadata for metadata, _ in reversed(self._profiles.values())]
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "stored": len(self._profiles),
+            "profiled": self.profiled,
+            "skipped_busy": self.skipped_busy,
+        }
+
+
+profile_store = ProfileStore.from_env()
+
+
+class ProfilingMiddleware:
+    """ASGI middleware running cProfile around the requests ``store`` selects"""
+
+    def __init__(self, app, store=None):
+        self.app = app
+        self.store = store or profile_store
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.store.wants(Headers(scope=scope)):
+            return await self.app(scope, receive, send)
+        if self.store.active:
+            self.store.skipped_busy += 1
+            return await self.app(scope, receive, send)
+
+        status = {"code": 500}
+        profile_id = uuid.uuid4().hex  # reserved up front so the header can go out with the response
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                MutableHeaders(scope=message).append("X-Profile-Id", profile_id)
+            await send(message)
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler (a debugger, coverage) already owns the interpreter's hooks
+            self.store.skipped_busy += 1
+            return await self.app(scope, receive, send)
+        self.store.active = True
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profile.disable()
+            self.store.active = False
+            metadata = {
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status["code"],
+                "duration_seconds": round(time.perf_counter() - start, 6),
+                "created_at": datetime.utcnow().isoformat(),
+            }
+            self.store.add(profile_id, metadata, profile)
+
+
+class _StoredStats:
+    """Marshalled stats in the shape pstats.Stats loads from a profiler"""
+
+    def __init__(self, data):
+        self.stats = marshal.loads(data)
+
+    def create_stats(self):
+        pass
+
+
+def _check_access(x_profile: Optional[str] = Header(None)):
+    """Profiles expose code paths and timings: hide them when disabled, guard them with the token"""
+    if not profile_store.enabled:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    if profile_store.token is not None and x_profile != profile_store.token:
+        raise HTTPException(status_code=403, detail="Send the profiling token in X-Profile")
+
+
+router = APIRouter(dependencies=[Depends(_check_access)])
+
+
+@router.get("/profiles")
+def list_profiles():
+    return profile_store.list()
+
+
+@router.get("/profiles/{profile_id}")
+def get_profile(
+    profile_id: str,
+    format: Literal["prof", "text"] = "prof",
+    sort: Literal["cumulative", "tottime", "calls"] = "cumulative",
+    limit: int = Query(50, ge=1, le=1000),
+):
+    """Download a stored profile: ``format=prof`` (pstats/snakeviz) or ``format=text``"""
+    stored = profile_store.get(profile_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    metadata, data = stored
+    if format == "text":
+        buffer = io.StringIO()
+        pstats.Stats(_StoredStats(data), stream=buffer).sort_stats(sort).print_stats(limit)
+        return PlainTextResponse(buffer.getvalue())
+    return Response(
+        data,
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": f'attachment; filename="{metadata["path"].strip("/").replace("/", "_") or "root"}-{profile_id}.prof"'},
+    )
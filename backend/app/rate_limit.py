@@ -0,0 +1,269 @@
+import asyncio
+import email.utils
+import os
+import random
+import time
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+from groq import InternalServerError, RateLimitError
+
+load_dotenv()
+
+# Provider errors worth waiting out; anything else fails the call immediately
+RETRYABLE_ERRORS = (RateLimitError, InternalServerError)
+
+
+def estimate_text_tokens(text):
+    """Rough token count of ``text`` (~4 characters per token); None counts as empty"""
+    return len(text or "") // 4
+
+
+def estimate_tokens(messages, completion_tokens=512):
+    """Rough token count for budgeting: the messages plus the expected completion"""
+    return sum(estimate_text_tokens(message["content"]) for message in messages) + completion_tokens
+
+
+def retry_after_seconds(exc):
+    """Delay requested by the provider through Retry-After / retry-after-ms, if any"""
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None  # malformed HTTP-date: fall back to our own backoff
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)  # "-0000": HTTP-dates are always UTC
+    return max(0.0, (parsed - datetime.now(timezone.utc)).total_seconds())
+
+
+class TokenBucket:
+    """Continuous-refill token bucket sized in units per minute (0 means unlimited)"""
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+        self._lock = None
+        self._loop = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        if self.per_minute <= 0:
+            return
+        amount = min(amount, self.capacity)  # a single oversized request must still get through eventually
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # asyncio primitives are tied to one event loop
+            self._loop, self._lock = loop, asyncio.Lock()
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) * 60 / self.per_minute)
+
+    def try_acquire(self, amount=1):
+        """Take ``amount`` only if it is available right now; never waits"""
+        if self.per_minute <= 0:
+            return True
+        self._refill()
+        if self.tokens < min(amount, self.capacity):
+            return False
+        self.tokens -= min(amount, self.capacity)
+        return True
+
+    def adjust(self, delta):
+        """Correct an earlier estimate once the real usage is known (may go into debt)"""
+        if self.per_minute > 0:
+            self.tokens = min(self.capacity, self.tokens - delta)
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD limit on in-flight calls: +1 after a window of successes, halved on throttling"""
+
+    def __init__(self, initial, maximum, minimum=1):
+        self.limit = initial
+        self.maximum = maximum
+        self.minimum = minimum
+        self.in_flight = 0
+        self._successes = 0
+        self._condition = None
+        self._loop = None
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._condition = loop, asyncio.Condition()
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def release(self):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self):
+        self._successes += 1
+        if self._successes >= self.limit and self.limit < self.maximum:
+            self.limit += 1
+            self._successes = 0
+
+    def on_throttle(self):
+        self.limit = max(self.minimum, self.limit // 2)
+        self._successes = 0
+
+
+class LLMScheduler:
+    """Shapes outbound completion calls to stay inside the provider's rate limits
+
+    Calls wait for a concurrency slot, a request token and an estimated number of
+    LLM tokens. Throttled calls are retried with exponential backoff and full jitter,
+    or after the provider's Retry-After when it sends one.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute=30,
+        tokens_per_minute=30000,
+        max_concurrency=8,
+        max_retries=4,
+        base_delay=0.5,
+        max_delay=30.0,
+    ):
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.concurrency = AdaptiveConcurrencyLimiter(initial=max_concurrency, maximum=max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.calls = 0
+        self.throttled_calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.waiting = 0  # calls waiting for a slot or rate-limit budget
+        self.backing_off = 0  # calls sleeping before a retry
+        self.hedges_allowed = 0
+        self.hedges_denied = 0
+        self.queue_wait_seconds = 0.0
+        self.max_queue_wait_seconds = 0.0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            requests_per_minute=int(os.getenv("GROQ_RPM_LIMIT", "30")),
+            tokens_per_minute=int(os.getenv("GROQ_TPM_LIMIT", "30000")),
+            max_concurrency=int(os.getenv("GROQ_MAX_CONCURRENCY", "8")),
+            max_retries=int(os.getenv("GROQ_MAX_RETRIES", "4")),
+            base_delay=float(os.getenv("GROQ_RETRY_BASE_DELAY", "0.5")),
+            max_delay=float(os.getenv("GROQ_RETRY_MAX_DELAY", "30")),
+        )
+
+    def backoff(self, attempt, exc=None):
+        requested = retry_after_seconds(exc) if exc is not None else None
+        if requested is not None:
+            return min(requested, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def reserve_hedge(self, estimated_tokens=0):
+        """Take budget for a hedged backup call if there is some to spare right now
+
+        Returns False while other calls are queueing or backing off, when every
+        concurrency slot is taken, or when either bucket is empty: the provider is
+        the bottleneck then, and a backup would only add load to it.
+        """
+        allowed = (
+            not self.waiting
+            and not self.backing_off
+            and self.concurrency.in_flight < self.concurrency.limit
+            and self.request_bucket.try_acquire(1)
+        )
+        if allowed and not self.token_bucket.try_acquire(estimated_tokens):
+            self.request_bucket.adjust(-1)  # hand the request token back
+            allowed = False
+        if allowed:
+            self.hedges_allowed += 1
+        else:
+            self.hedges_denied += 1
+        return allowed
+
+    async def run(self, call, estimated_tokens=0):
+        """Await ``call()`` under the rate limits, retrying throttled attempts"""
+        self.calls += 1
+        for attempt in range(self.max_retries + 1):
+            wait_start = time.perf_counter()
+            self.waiting += 1
+            try:
+                await self.concurrency.acquire()
+            except BaseException:
+                self.waiting -= 1
+                raise
+            try:
+                try:
+                    await self.request_bucket.acquire(1)
+                    await self.token_bucket.acquire(estimated_tokens)
+                finally:
+                    self.waiting -= 1
+                waited = time.perf_counter() - wait_start
+                self.queue_wait_seconds += waited
+                self.max_queue_wait_seconds = max(self.max_queue_wait_seconds, waited)
+                result = await call()
+            except RETRYABLE_ERRORS as e:
+                self.throttled_calls += 1
+                self.concurrency.on_throttle()
+                if attempt == self.max_retries:
+                    self.failures += 1
+                    raise
+                error = e
+            else:
+                self.concurrency.on_success()
+                total_tokens = getattr(getattr(result, "usage", None), "total_tokens", None)
+                if isinstance(total_tokens, int):
+                    self.token_bucket.adjust(total_tokens - estimated_tokens)
+                return result
+            finally:
+                await self.concurrency.release()
+            self.retries += 1
+            self.backing_off += 1
+            try:
+                await asyncio.sleep(self.backoff(attempt, error))
+            finally:
+                self.backing_off -= 1
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "throttled_calls": self.throttled_calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "queue_wait_seconds_total": self.queue_wait_seconds,
+            "queue_wait_seconds_max": self.max_queue_wait_seconds,
+            "queue_wait_seconds_avg": self.queue_wait_seconds / self.calls if self.calls else 0.0,
+            "hedges_allowed": self.hedges_allowed,
+            "hedges_denied": self.hedges_denied,
+            "concurrency_limit": self.concurrency.limit,
+            "in_flight": self.concurrency.in_flight,
+            "requests_per_minute": self.request_bucket.per_minute,
+            "tokens_per_minute": self.token_bucket.per_minute,
+        }
@@ -1,38 +1,69 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
-from pydantic import BaseModel, field_validator, ConfigDict # Added ConfigDict
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Response, UploadFile
+from fastapi.responses import StreamingResponse
+from groq import RateLimitError
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Literal, Optional, Set, Union
+from pydantic import BaseModel, Field, computed_field, field_validator, ConfigDict # Added ConfigDict
 from uuid import UUID 
 from datetime import datetime
+from types import SimpleNamespace
+import asyncio
+import base64
+import json
+import math
+import os
 
-from .database import get_db
-from .models import Prompt
-from .ai_service import AIService
+from .admission import admission, admit_generation
+from .database import get_db, get_read_db, read_router
+from .models import Prompt, Thread
+from .search import search_statement
+from .ai_service import AIService, PartialGenerationError, TONES
+from .rate_limit import retry_after_seconds
+from .metrics import GENERATIONS_IN_FLIGHT, observe_stage
+from .persistence import prompt_writer
+from .archive import find_archived, prompt_archiver, read_archive
+from .conversation import conversations
+from .export import MEDIA_TYPES, stream_export
+from .jobs import BatchJobManager
+from .profiling import profile_store
 
 router = APIRouter()
 ai_service = AIService()
+batch_jobs = BatchJobManager.from_env(ai_service)
+
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "1000"))
 
 class GenerateRequest(BaseModel):
     user_id: str
     query: str
+    use_cache: bool = True  # False skips cached answers and refreshes them with a new completion
+    tones: Set[Literal["casual", "formal"]] = Field(default_factory=lambda: set(TONES), min_length=1)
+    thread_id: Optional[UUID] = None  # continue this conversation; its earlier turns become context
     # If this model had a Config class, update it to model_config = ConfigDict(...)
 
 class GenerateResponse(BaseModel):
-    casual_response: str
-    formal_response: str
+    casual_response: Optional[str] = None  # None when the tone was not requested
+    formal_response: Optional[str] = None
     # If this model had a Config class, update it to model_config = ConfigDict(...)
 
 class PromptResponse(BaseModel):
     id: str
     user_id: str
     query: str
-    casual_response: str
-    formal_response: str
+    casual_response: Optional[str] = None
+    formal_response: Optional[str] = None
+    thread_id: Optional[str] = None
     created_at: datetime
 
     model_config = ConfigDict(from_attributes=True) # New way, at the class level
 
-    @field_validator("id", mode='before')
+    @computed_field
+    @property
+    def tones(self) -> List[str]:
+        return [tone for tone in TONES if getattr(self, f"{tone}_response") is not None]
+
+    @field_validator("id", "thread_id", mode='before')
     @classmethod
     def coerce_id_to_string(cls, v):
         if isinstance(v, UUID):
@@ -40,29 +71,517 @@ class PromptResponse(BaseModel):
         return v
 
 
+# admit_generation comes before get_db: requests waiting for a slot hold no database session
 @router.post("/generate", response_model=GenerateResponse)
-def generate(request: GenerateRequest, db: Session = Depends(get_db)):
+async def generate(
+    request: GenerateRequest,
+    _: None = Depends(admit_generation),
+    db: AsyncSession = Depends(get_db),
+):
+    with GENERATIONS_IN_FLIGHT.labels("generate").track_inprogress():
+        return await _generate(request, db)
+
+
+async def _thread_context(request, db):
+    """Context for a request continuing a thread (None otherwise); 404 for someone else's thread"""
+    if request.thread_id is None:
+        return None
+    thread = await conversations.get_thread(db, request.thread_id, request.user_id)
+    if thread is None:
+        raise HTTPException(status_code=404, detail="Thread not found")
+    with observe_stage("thread_context"):
+        return await conversations.context(db, thread, sorted(request.tones))
+
+
+def _summarize_thread_later(thread_id):
+    # Only after the turn is stored: the summary reads the thread's turns from the database
+    conversations.summarize_later(thread_id, ai_service.summarize_async)
+
+
+async def _generate(request, db):
+    context = await _thread_context(request, db)
     try:
-        responses = ai_service.generate_responses(request.query)
-        new_prompt = Prompt(
-            user_id=request.user_id,
-            query=request.query,
-            casual_response=responses["casual_response"],
-            formal_response=responses["formal_response"]
+        responses = await ai_service.generate_responses_async(
+            request.query, use_cache=request.use_cache, tones=request.tones, context=context
+        )
+    except PartialGenerationError as e:
+        if all(text is None for text in e.responses.values()):
+            if all(isinstance(err, RateLimitError) for err in e.errors.values()):
+                # Still throttled after the scheduler's retries: tell the client when to come back
+                delays = [retry_after_seconds(err) or 1 for err in e.errors.values()]
+                raise HTTPException(
+                    status_code=429,
+                    detail=str(e),
+                    headers={"Retry-After": str(math.ceil(max(delays)))},
+                )
+            raise HTTPException(status_code=500, detail=str(e))
+        # One tone completed; hand its text back instead of discarding it
+        raise HTTPException(
+            status_code=502,
+            detail={
+                "message": str(e),
+                **e.responses,
+                "errors": {key: str(err) for key, err in e.errors.items()},
+            },
         )
-        db.add(new_prompt)
-        db.commit()
-        db.refresh(new_prompt)
-        return responses
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/history", response_model=List[PromptResponse])
-def get_history(user_id: str, db: Session = Depends(get_db)):
-    prompts = (
-        db.query(Prompt)
-        .filter(Prompt.user_id == user_id)
-        .order_by(Prompt.created_at.desc())
-        .all()
+    try:
+        if prompt_writer.running and request.thread_id is None:
+            # Write-behind mode: the row is committed by the background batch flusher
+            with observe_stage("write_behind_enqueue"):
+                await prompt_writer.enqueue(request.user_id, request.query, **responses)
+        else:
+            # Thread turns are written at once: the next turn's context has to see them
+            await _store_prompt(db, request.user_id, request.query, responses, request.thread_id)
+            if request.thread_id is not None:
+                _summarize_thread_later(request.thread_id)
+        with observe_stage("serialization"):
+            return GenerateResponse(**responses)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def _store_prompt(db, user_id, query, responses, thread_id=None):
+    new_prompt = Prompt(
+        user_id=user_id,
+        query=query,
+        casual_response=responses.get("casual_response"),
+        formal_response=responses.get("formal_response"),
+        thread_id=thread_id,
     )
-    return [PromptResponse.model_validate(prompt) for prompt in prompts]
\ No newline at end of file
+    db.add(new_prompt)
+    with observe_stage("db_commit"):
+        await db.commit()
+    read_router.record_write(user_id)
+    with observe_stage("db_refresh"):
+        await db.refresh(new_prompt)
+    return new_prompt
+
+
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.post("/generate/stream")
+async def generate_stream(
+    request: GenerateRequest,
+    _: None = Depends(admit_generation),
+    db: AsyncSession = Depends(get_db),
+):
+    """Stream tokens of the requested tones as tagged Server-Sent Events"""
+    context = await _thread_context(request, db)  # before the stream starts, so a bad thread is a plain 404
+
+    async def event_stream():
+        with GENERATIONS_IN_FLIGHT.labels("stream").track_inprogress():
+            async for event in _stream_events(request, db, context):
+                yield event
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _stream_events(request, db, context=None):
+    """Turn the service's tone events into SSE frames and persist the prompt at the end"""
+    texts = {tone: [] for tone in TONES if tone in request.tones}
+    errors = {}
+    stream = ai_service.stream_responses(
+        request.query, use_cache=request.use_cache, tones=request.tones, context=context
+    )
+    async for tone, kind, payload in stream:
+        if kind == "token":
+            texts[tone].append(payload)
+            yield _sse_event(tone, {"token": payload})
+        elif kind == "error":
+            errors[f"{tone}_response"] = str(payload)
+            yield _sse_event("error", {"tone": tone, "error": str(payload)})
+
+    responses = {f"{tone}_response": "".join(parts) for tone, parts in texts.items()}
+    if errors:
+        # Same contract as /generate: nothing is stored unless every requested tone completed
+        for key in errors:
+            responses[key] = None
+        yield _sse_event("done", {**responses, "errors": errors})
+        return
+
+    try:
+        if prompt_writer.running and request.thread_id is None:
+            await prompt_writer.enqueue(request.user_id, request.query, **responses)
+        else:
+            await _store_prompt(db, request.user_id, request.query, responses, request.thread_id)
+    except Exception as e:
+        await db.rollback()
+        yield _sse_event("error", {"tone": None, "error": str(e)})
+        return
+    if request.thread_id is not None:
+        _summarize_thread_later(request.thread_id)
+    yield _sse_event("done", responses)
+
+
+class BatchRequest(BaseModel):
+    user_id: str
+    queries: List[str] = Field(min_length=1)
+    use_cache: bool = True
+    tones: Set[Literal["casual", "formal"]] = Field(default_factory=lambda: set(TONES), min_length=1)
+
+class BatchItemResponse(BaseModel):
+    index: int
+    query: str
+    status: str
+    prompt_id: Optional[str] = None
+    casual_response: Optional[str] = None
+    formal_response: Optional[str] = None
+    error: Optional[str] = None
+
+class BatchJobResponse(BaseModel):
+    job_id: str
+    status: str
+    total: int
+    pending: int
+    running: int
+    completed: int
+    failed: int
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    results: Optional[List[BatchItemResponse]] = None
+
+
+def _batch_job_response(job, include_results=False):
+    results = None
+    if include_results:
+        results = [
+            BatchItemResponse(
+                index=item.index,
+                query=item.query,
+                status=item.status,
+                prompt_id=item.prompt_id,
+                error=item.error,
+                **item.responses,
+            )
+            for item in job.items
+        ]
+    return BatchJobResponse(
+        job_id=job.id,
+        status=job.status,
+        total=len(job.items),
+        created_at=job.created_at,
+        finished_at=job.finished_at,
+        results=results,
+        **job.counts(),
+    )
+
+
+def _submit_batch(user_id, queries, tones, use_cache):
+    if len(queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=413, detail=f"A batch may contain at most {BATCH_MAX_QUERIES} queries")
+    return _batch_job_response(batch_jobs.submit(user_id, queries, tones, use_cache))
+
+
+@router.post("/generate/batch", response_model=BatchJobResponse, status_code=202)
+async def generate_batch(request: BatchRequest):
+    """Start a background job generating responses for every query"""
+    return _submit_batch(request.user_id, request.queries, request.tones, request.use_cache)
+
+
+@router.post("/generate/batch/upload", response_model=BatchJobResponse, status_code=202)
+async def generate_batch_upload(
+    user_id: str,
+    file: UploadFile = File(...),
+    tones: List[Literal["casual", "formal"]] = Query(list(TONES)),
+    use_cache: bool = True,
+):
+    """Same as /generate/batch, reading queries from a JSONL file
+
+    Each non-empty line is either a JSON string or an object with a "query" key.
+    """
+    queries = []
+    for line_number, line in enumerate((await file.read()).decode("utf-8").splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            queries.append(record if isinstance(record, str) else record["query"])
+        except (ValueError, KeyError, TypeError):
+            raise HTTPException(status_code=422, detail=f"Line {line_number} is not a JSON string or an object with a query")
+    if not queries:
+        raise HTTPException(status_code=422, detail="The uploaded file contains no queries")
+    return _submit_batch(user_id, queries, set(tones), use_cache)
+
+
+@router.get("/generate/batch/{job_id}", response_model=BatchJobResponse)
+async def get_batch_job(job_id: str, include_results: bool = True):
+    job = batch_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    return _batch_job_response(job, include_results)
+
+
+def encode_cursor(prompt):
+    raw = f"{prompt.created_at.isoformat()}|{prompt.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, prompt_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), UUID(prompt_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+# Characters of the query kept in summary rows; the sidebar shows far fewer
+HISTORY_PREVIEW_CHARS = 100
+
+
+class PromptSummary(BaseModel):
+    id: str
+    query_preview: str
+    created_at: datetime
+
+    model_config = ConfigDict(from_attributes=True)
+
+    @field_validator("id", mode='before')
+    @classmethod
+    def coerce_id_to_string(cls, v):
+        if isinstance(v, UUID):
+            return str(v)
+        return v
+
+
+@router.get("/history", response_model=Union[List[PromptResponse], List[PromptSummary]])
+async def get_history(
+    user_id: str,
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    view: Literal["full", "summary"] = "full",
+    include_archived: bool = False,
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Return one page of a user's prompts, newest first
+
+    Pass the X-Next-Cursor header of a page as ``before`` to fetch the next one.
+    Pass X-Newest-Cursor as ``after`` to fetch only rows added since; those come
+    oldest-first from the cursor, so repeat until a short page to catch up fully.
+    (created_at, id) is the sort key so rows sharing a timestamp are never skipped.
+    ``view=summary`` returns only id, a query preview and the timestamp; the full
+    row is then fetched from /history/{id}. With ``include_archived`` a page that
+    runs past the oldest row in the database continues into the archive files.
+    """
+    if before is not None and after is not None:
+        raise HTTPException(status_code=400, detail="Pass either before or after, not both")
+    if view == "summary":
+        # Response columns are never read, so their text never leaves the database
+        stmt = select(
+            Prompt.id,
+            func.substr(Prompt.query, 1, HISTORY_PREVIEW_CHARS).label("query_preview"),
+            Prompt.created_at,
+        )
+        fetch, schema = db.execute, PromptSummary
+    else:
+        stmt = select(Prompt)
+        fetch, schema = db.scalars, PromptResponse
+    stmt = stmt.where(Prompt.user_id == user_id)
+    if after is not None:
+        created_at, prompt_id = decode_cursor(after)
+        # Same index range as ``before``, walked forward from the cursor
+        stmt = stmt.where(tuple_(Prompt.created_at, Prompt.id) > (created_at, prompt_id))
+        stmt = stmt.order_by(Prompt.created_at, Prompt.id).limit(limit)
+        with observe_stage("db_history_query"):
+            prompts = list(reversed((await fetch(stmt)).all()))
+        if prompts:
+            response.headers["X-Newest-Cursor"] = encode_cursor(prompts[0])
+        with observe_stage("serialization"):
+            return [schema.model_validate(prompt) for prompt in prompts]
+    if before is not None:
+        created_at, prompt_id = decode_cursor(before)
+        # A row-value comparison, unlike the equivalent OR, is one range on the (user_id, created_at, id) index
+        stmt = stmt.where(tuple_(Prompt.created_at, Prompt.id) < (created_at, prompt_id))
+    stmt = stmt.order_by(Prompt.created_at.desc(), Prompt.id.desc()).limit(limit + 1)
+    with observe_stage("db_history_query"):
+        prompts = (await fetch(stmt)).all()
+    if len(prompts) <= limit and include_archived:
+        # Archived months are all older than what is left in the database
+        oldest = (prompts[-1].created_at, prompts[-1].id) if prompts else (decode_cursor(before) if before else None)
+        with observe_stage("archive_history_read"):
+            records = await asyncio.to_thread(
+                read_archive, prompt_archiver.archive_dir, user_id, oldest, limit + 1 - len(prompts)
+            )
+        prompts = list(prompts) + [_archived_row(record, view) for record in records]
+    if len(prompts) > limit:
+        prompts = prompts[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(prompts[-1])
+    if prompts and before is None:
+        response.headers["X-Newest-Cursor"] = encode_cursor(prompts[0])
+    with observe_stage("serialization"):
+        return [schema.model_validate(prompt) for prompt in prompts]
+
+
+def _archived_row(record, view):
+    if view == "summary":
+        return SimpleNamespace(
+            id=record["id"], query_preview=record["query"][:HISTORY_PREVIEW_CHARS], created_at=record["created_at"]
+        )
+    return SimpleNamespace(**record)
+
+
+class SearchResult(PromptResponse):
+    rank: float  # higher is more relevant; only comparable within one search
+
+
+@router.get("/history/search", response_model=List[SearchResult])
+async def search_history(
+    user_id: str,
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=500),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=10000),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Ranked full-text search over a user's queries and responses
+
+    Backed by a GIN tsvector index on PostgreSQL and FTS5 on SQLite. Pages are
+    offset-based (rank is not a stable keyset); X-Next-Offset is set when more
+    results exist.
+    """
+    stmt = search_statement(db.bind.dialect.name, user_id, q).offset(offset).limit(limit + 1)
+    with observe_stage("db_history_search"):
+        rows = (await db.execute(stmt)).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Offset"] = str(offset + limit)
+    with observe_stage("serialization"):
+        return [
+            SearchResult.model_validate({**PromptResponse.model_validate(prompt).model_dump(), "rank": rank})
+            for prompt, rank in rows
+        ]
+
+
+@router.get("/history/{prompt_id}", response_model=PromptResponse)
+async def get_history_item(
+    prompt_id: UUID, user_id: str, include_archived: bool = False, db: AsyncSession = Depends(get_read_db)
+):
+    """One prompt with its full responses; 404 unless it belongs to ``user_id``"""
+    with observe_stage("db_history_item"):
+        prompt = await db.get(Prompt, prompt_id)
+    if prompt is None and include_archived:
+        with observe_stage("archive_history_read"):
+            record = await asyncio.to_thread(find_archived, prompt_archiver.archive_dir, prompt_id)
+        prompt = SimpleNamespace(**record) if record is not None else None
+    if prompt is None or prompt.user_id != user_id:
+        raise HTTPException(status_code=404, detail="Prompt not found")
+    return PromptResponse.model_validate(prompt)
+
+
+class ThreadCreate(BaseModel):
+    user_id: str
+    title: Optional[str] = Field(None, max_length=200)
+
+class ThreadResponse(BaseModel):
+    id: str
+    user_id: str
+    title: Optional[str] = None
+    summary: Optional[str] = None  # condensed earlier turns; the newest turns are sent verbatim
+    summarized_turns: int = 0
+    created_at: datetime
+
+    model_config = ConfigDict(from_attributes=True)
+
+    @field_validator("id", mode='before')
+    @classmethod
+    def coerce_id_to_string(cls, v):
+        if isinstance(v, UUID):
+            return str(v)
+        return v
+
+class ThreadDetail(ThreadResponse):
+    turns: List[PromptResponse]  # oldest first
+
+
+@router.post("/threads", response_model=ThreadResponse, status_code=201)
+async def create_thread(request: ThreadCreate, db: AsyncSession = Depends(get_db)):
+    """Start a conversation; pass its id as ``thread_id`` to /generate to add turns"""
+    thread = Thread(user_id=request.user_id, title=request.title)
+    db.add(thread)
+    await db.commit()
+    read_router.record_write(request.user_id)
+    await db.refresh(thread)
+    return ThreadResponse.model_validate(thread)
+
+
+@router.get("/threads", response_model=List[ThreadResponse])
+async def list_threads(user_id: str, limit: int = Query(50, ge=1, le=200), db: AsyncSession = Depends(get_read_db)):
+    """A user's threads, newest first"""
+    stmt = select(Thread).where(Thread.user_id == user_id).order_by(Thread.created_at.desc()).limit(limit)
+    return [ThreadResponse.model_validate(thread) for thread in (await db.scalars(stmt)).all()]
+
+
+@router.get("/threads/{thread_id}", response_model=ThreadDetail)
+async def get_thread(
+    thread_id: UUID, user_id: str, limit: int = Query(50, ge=1, le=200), db: AsyncSession = Depends(get_read_db)
+):
+    """A thread with its newest ``limit`` turns; 404 unless it belongs to ``user_id``"""
+    thread = await conversations.get_thread(db, thread_id, user_id)
+    if thread is None:
+        raise HTTPException(status_code=404, detail="Thread not found")
+    stmt = (
+        select(Prompt)
+        .where(Prompt.thread_id == thread_id)
+        .order_by(Prompt.created_at.desc(), Prompt.id.desc())
+        .limit(limit)
+    )
+    turns = reversed((await db.scalars(stmt)).all())
+    return ThreadDetail(
+        **ThreadResponse.model_validate(thread).model_dump(),
+        turns=[PromptResponse.model_validate(turn) for turn in turns],
+    )
+
+
+@router.get("/export")
+async def export_prompts(
+    user_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Stream prompts, oldest first, as NDJSON or CSV; ``until`` is exclusive
+
+    Rows come off a server-side cursor in fixed-size chunks, so the export can be
+    as large as the table without buffering it.
+    """
+    if since is not None and until is not None and since >= until:
+        raise HTTPException(status_code=400, detail="since must be before until")
+    filename = f"prompts-{user_id or 'all'}.{format}"
+    return StreamingResponse(
+        stream_export(db, format, user_id=user_id, since=since, until=until),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+# Component name -> stats() of each shared component, for /api/stats and /metrics
+STATS_SOURCES = {
+    "cache": ai_service.cache.stats,
+    "write_behind": prompt_writer.stats,
+    "archive": prompt_archiver.stats,
+    "admission": admission.stats,
+    "profiling": profile_store.stats,
+    "llm_scheduler": ai_service.scheduler.stats,
+    "singleflight": ai_service.singleflight.stats,
+    "generation": ai_service.generation_stats,
+    "model_routing": ai_service.router.stats,
+    "hedging": ai_service.hedger.stats,
+    "threads": conversations.stats,
+    "read_routing": read_router.stats,
+}
+
+
+@router.get("/stats")
+def get_stats():
+    return {component: stats() for component, stats in STATS_SOURCES.items()}
@@ -0,0 +1,45 @@
+import re
+
+from sqlalchemy import column, false, func, literal_column, select, table
+
+from .models import Prompt, search_user_token
+
+prompts_fts = table("prompts_fts", column("rowid"))
+prompt_search = table("prompt_search", column("prompt_id"), column("user_id"), column("document"))
+
+
+def fts5_match(text):
+    """Quote each word so user input is never parsed as FTS5 query syntax; all words must match"""
+    return " ".join('"' + word.replace('"', '""') + '"' for word in re.findall(r"\w+", text))
+
+
+def search_statement(dialect, user_id, text):
+    """Ranked full-text search over a user's prompts; rows are (Prompt, rank), best first
+
+    The search tables are narrowed to the user's rows in the index itself, so only
+    those are matched and ranked, however large the whole corpus is.
+    """
+    if dialect == "postgresql":
+        query = func.websearch_to_tsquery(literal_column("'english'"), text)
+        rank = func.ts_rank_cd(prompt_search.c.document, query).label("rank")
+        stmt = (
+            select(Prompt, rank)
+            .join(prompt_search, prompt_search.c.prompt_id == Prompt.id)
+            .where(prompt_search.c.user_id == user_id, prompt_search.c.document.op("@@")(query))
+        )
+    elif dialect == "sqlite":
+        # bm25() is lower-is-better; negate it so rank always grows with relevance.
+        # The user_id column only filters, so it gets no weight in the rank.
+        rank = (-func.bm25(literal_column("prompts_fts"), 1.0, 1.0, 1.0, 0.0)).label("rank")
+        match = fts5_match(text)
+        stmt = (
+            select(Prompt, rank)
+            .join(prompts_fts, prompts_fts.c.rowid == literal_column("prompts.rowid"))
+            .where(
+                literal_column("prompts_fts").op("MATCH")(f'user_id : "{search_user_token(user_id)}" AND {match}')
+                if match else false()
+            )
+        )
+    else:
+        raise NotImplementedError(f"Full-text search is not supported on {dialect}")
+    return stmt.where(Prompt.user_id == user_id).order_by(rank.desc(), Prompt.created_at.desc(), Prompt.id.desc())
@@ -0,0 +1,63 @@
+"""Content-addressed, compressed storage for generated responses
+
+Each distinct response text is stored once in ``response_blobs``, keyed by the
+sha256 of its UTF-8 bytes and zlib-compressed; prompts reference it by hash.
+
+    python -m app.storage   # report how much space deduplication and compression save
+"""
+import hashlib
+import json
+import os
+import zlib
+
+from sqlalchemy import text
+
+COMPRESSION_LEVEL = int(os.getenv("RESPONSE_COMPRESSION_LEVEL", "6"))
+
+
+def content_hash(value):
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+def compress(value):
+    return zlib.compress(value.encode(), COMPRESSION_LEVEL)
+
+
+def decompress(data):
+    return zlib.decompress(data).decode()
+
+
+def storage_report(conn):
+    """Bytes the responses would take stored inline versus what the blob table holds"""
+    logical_bytes, references = 0, 0
+    for tone in ("casual", "formal"):
+        row = conn.execute(text(
+            f"SELECT count(*), coalesce(sum(b.size), 0) FROM prompts p "
+            f"JOIN response_blobs b ON b.hash = p.{tone}_response_hash"
+        )).one()
+        references += row[0]
+        logical_bytes += row[1]
+    blobs, unique_bytes, stored_bytes = conn.execute(text(
+        "SELECT count(*), coalesce(sum(size), 0), coalesce(sum(length(data)), 0) FROM response_blobs"
+    )).one()
+    return {
+        "responses": references,
+        "unique_responses": blobs,
+        "logical_bytes": logical_bytes,  # every response stored inline, uncompressed
+        "deduplicated_bytes": unique_bytes,  # each distinct text once, uncompressed
+        "stored_bytes": stored_bytes,  # each distinct text once, compressed
+        "saved_bytes": logical_bytes - stored_bytes,
+        "ratio": round(logical_bytes / stored_bytes, 2) if stored_bytes else None,
+    }
+
+
+def main():
+    from .database import init_engines
+
+    engine, _ = init_engines()
+    with engine.connect() as conn:
+        print(json.dumps(storage_report(conn), indent=2))
+
+
+if __name__ == "__main__":
+    main()
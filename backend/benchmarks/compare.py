@@ -0,0 +1,56 @@
+"""Compare two saved load test results and flag regressions
+
+    python -m benchmarks.compare results/<old>.json results/<new>.json --threshold 0.10
+
+Exits with status 1 when any endpoint's p50/p95/p99 latency grew, or its
+throughput shrank, by more than the threshold.
+"""
+import argparse
+import json
+import sys
+
+LATENCY_FIELDS = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def compare(old, new, threshold=0.10):
+    """Return (rows, regressions); each row is (endpoint, field, old, new, relative change)"""
+    rows, regressions = [], []
+    for endpoint, new_stats in new["endpoints"].items():
+        old_stats = old["endpoints"].get(endpoint)
+        if old_stats is None:
+            continue
+        for field in LATENCY_FIELDS + ("rps",):
+            before, after = old_stats.get(field), new_stats.get(field)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            row = (endpoint, field, before, after, change)
+            rows.append(row)
+            worse = change > threshold if field in LATENCY_FIELDS else change < -threshold
+            if worse:
+                regressions.append(row)
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed relative change (default 10%%)")
+    args = parser.parse_args(argv)
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    rows, regressions = compare(old, new, args.threshold)
+    print(f"{old.get('commit')} ({old.get('label')}) -> {new.get('commit')} ({new.get('label')})")
+    for endpoint, field, before, after, change in rows:
+        flag = "  REGRESSION" if (endpoint, field, before, after, change) in regressions else ""
+        print(f"{endpoint:<10} {field:<7} {before:>10.2f} -> {after:>10.2f} {change:>+8.1%}{flag}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""Compare the two-call and single-call (combined JSON) dual-tone generation modes
+
+Runs AIService in-process against the fake LLM, once per mode, and reports
+end-to-end latency percentiles, provider-reported tokens and how often the
+combined mode needed a repair or fell back to two calls.
+
+    python -m benchmarks.dual_tone --requests 200 --concurrency 16 \\
+        --llm-latency-ms 400 --llm-tokens-per-second 300 --malformed-json-rate 0.02
+"""
+import argparse
+import asyncio
+import os
+import time
+
+import httpx
+from groq import AsyncGroq
+from prometheus_client import REGISTRY
+
+from .fake_llm import FakeLLMConfig, create_app
+from .loadgen import QUERIES, RESULTS_DIR, percentile, save_results
+
+MODES = ("separate", "combined")
+
+
+def _tokens():
+    """Totals of the LLM token counter across tones, by kind"""
+    totals = {"prompt": 0.0, "completion": 0.0}
+    for metric in REGISTRY.collect():
+        if metric.name != "ai_response_llm_tokens":
+            continue
+        for sample in metric.samples:
+            if sample.name == "ai_response_llm_tokens_total":
+                totals[sample.labels["kind"]] += sample.value
+    return totals
+
+
+async def run_mode(mode, config, requests=200, concurrency=16):
+    # Measure the generation path alone: no client-side throttling, no cache hits
+    os.environ.update({"GROQ_RPM_LIMIT": "0", "GROQ_TPM_LIMIT": "0", "GROQ_MAX_CONCURRENCY": "10000"})
+    os.environ["RESPONSE_CACHE_MAX_ENTRIES"] = "0"
+    from app.ai_service import AIService
+
+    service = AIService()
+    service.generation_mode = mode
+    transport = httpx.ASGITransport(app=create_app(config))
+    latencies, failures = [], 0
+    remaining = iter(range(requests))
+
+    async with httpx.AsyncClient(transport=transport) as http_client:
+        service.async_client = AsyncGroq(api_key="fake", base_url="http://fake-llm", http_client=http_client, max_retries=0)
+
+        async def worker():
+            nonlocal failures
+            for i in remaining:
+                start = time.perf_counter()
+                try:
+                    # A distinct query per request so single-flight never coalesces them
+                    await service.generate_responses_async(f"{QUERIES[i % len(QUERIES)]} #{i}", use_cache=False)
+                except Exception:
+                    failures += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+
+        before = _tokens()
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        after = _tokens()
+
+    prompt_tokens = after["prompt"] - before["prompt"]
+    completion_tokens = after["completion"] - before["completion"]
+    return {
+        "requests": requests,
+        "failures": failures,
+        "rps": round(requests / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        "prompt_tokens_per_request": round(prompt_tokens / requests, 1),
+        "completion_tokens_per_request": round(completion_tokens / requests, 1),
+        "llm_calls": transport.app.state.requests,
+        **{k: v for k, v in service.generation_stats().items() if k != "mode"},
+    }
+
+
+def print_comparison(results):
+    fields = ["p50_ms", "p95_ms", "p99_ms", "rps", "llm_calls", "prompt_tokens_per_request",
+              "completion_tokens_per_request", "combined_repaired", "combined_fallbacks", "failures"]
+    print(f"{'':<30}" + "".join(f"{mode:>12}" for mode in results))
+    for field in fields:
+        print(f"{field:<30}" + "".join(f"{str(stats[field]):>12}" for stats in results.values()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--llm-latency-ms", type=float, default=400.0)
+    parser.add_argument("--llm-latency-sigma", type=float, default=0.3)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=0.0)
+    parser.add_argument("--llm-completion-tokens", type=int, default=120)
+    parser.add_argument("--malformed-json-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--results-dir", default=str(RESULTS_DIR))
+    args = parser.parse_args(argv)
+
+    results = {}
+    for mode in args.modes.split(","):
+        if mode not in MODES:
+            parser.error(f"unknown mode {mode!r}")
+        config = FakeLLMConfig(
+            latency_ms=args.llm_latency_ms,
+            latency_sigma=args.llm_latency_sigma,
+            tokens_per_second=args.llm_tokens_per_second,
+            completion_tokens=args.llm_completion_tokens,
+            malformed_json_rate=args.malformed_json_rate,
+            seed=args.seed,
+        )
+        results[mode] = asyncio.run(run_mode(mode, config, args.requests, args.concurrency))
+
+    print_comparison(results)
+    config = {k: v for k, v in vars(args).items() if k != "results_dir"}
+    print(f"saved {save_results({'modes': results}, 'dual-tone', config, args.results_dir)}")
+
+
+if __name__ == "__main__":
+    main()
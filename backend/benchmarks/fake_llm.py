@@ -0,0 +1,165 @@
+"""Local stand-in for the Groq chat completions API
+
+Speaks enough of the OpenAI-compatible protocol for the groq SDK (plain and
+streaming responses, JSON mode, usage block, 429s with Retry-After) so the service can be
+load tested without spending real quota. Point the backend at it with
+GROQ_BASE_URL=http://localhost:9000.
+
+    python -m benchmarks.fake_llm --port 9000 --latency-ms 800 --latency-sigma 0.5 \\
+        --tokens-per-second 200 --completion-tokens 150 --error-rate 0.02
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = "the a model response latency token stream answer query casual formal explain detail".split()
+
+
+@dataclass
+class FakeLLMConfig:
+    latency_ms: float = 500.0  # median time to first token
+    latency_sigma: float = 0.0  # lognormal spread; 0 makes latency constant
+    tokens_per_second: float = 0.0  # generation speed after the first token; 0 is instant
+    completion_tokens: int = 120
+    error_rate: float = 0.0
+    malformed_json_rate: float = 0.0  # JSON-mode replies that come back unparseable
+    error_status: int = 429
+    retry_after: float = 1.0
+    seed: Optional[int] = None
+
+    def first_token_delay(self, rng):
+        median = self.latency_ms / 1000
+        if self.latency_sigma <= 0:
+            return median
+        return rng.lognormvariate(0, self.latency_sigma) * median
+
+    def token_delay(self):
+        return 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0
+
+
+def _completion_tokens(config, rng):
+    return [("" if i == 0 else " ") + rng.choice(WORDS) for i in range(config.completion_tokens)]
+
+
+def create_app(config=None):
+    config = config or FakeLLMConfig()
+    rng = random.Random(config.seed)
+    app = FastAPI(title="Fake LLM")
+    app.state.config = config
+    app.state.requests = 0
+
+    @app.post("/openai/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.requests += 1
+        if rng.random() < config.error_rate:
+            headers = {"retry-after": str(config.retry_after)} if config.error_status == 429 else {}
+            return JSONResponse(
+                {"error": {"message": "Injected failure", "type": "fake_llm_error"}},
+                status_code=config.error_status,
+                headers=headers,
+            )
+
+        prompt_tokens = sum(len(m.get("content", "")) for m in body.get("messages", [])) // 4
+        tokens = _completion_tokens(config, rng)
+        if (body.get("response_format") or {}).get("type") == "json_object":
+            # Both tones in one object: twice the answer text plus the JSON around it
+            second = _completion_tokens(config, rng)
+            content = json.dumps({"casual": "".join(tokens), "formal": "".join(second)})
+            if rng.random() < config.malformed_json_rate:
+                content = content[: len(content) // 2]
+            tokens = re.findall(r"\s*\S+", content)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        model = body.get("model", "fake-model")
+        delay = config.first_token_delay(rng)
+
+        if body.get("stream"):
+            async def events():
+                await asyncio.sleep(delay)
+                for i, token in enumerate(tokens):
+                    if i:
+                        await asyncio.sleep(config.token_delay())
+                    chunk = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": model,
+                        "system_fingerprint": "fake",
+                        "choices": [{
+                            "index": 0,
+                            "delta": {"role": "assistant", "content": token},
+                            "finish_reason": None,
+                            "logprobs": None,
+                        }],
+                    }
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        await asyncio.sleep(delay + config.token_delay() * max(len(tokens) - 1, 0))
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "system_fingerprint": "fake",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(tokens)},
+                "finish_reason": "stop",
+                "logprobs": None,
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(tokens),
+                "total_tokens": prompt_tokens + len(tokens),
+            },
+        }
+
+    return app
+
+
+def main(argv=None):
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency-ms", type=float, default=500.0)
+    parser.add_argument("--latency-sigma", type=float, default=0.0)
+    parser.add_argument("--tokens-per-second", type=float, default=0.0)
+    parser.add_argument("--completion-tokens", type=int, default=120)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-json-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    config = FakeLLMConfig(
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens,
+        error_rate=args.error_rate,
+        malformed_json_rate=args.malformed_json_rate,
+        error_status=args.error_status,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""Closed-loop load generator for /api/generate and /api/history
+
+Each of ``--concurrency`` workers sends requests back to back until
+``--requests`` have been issued in total. Latency percentiles and throughput are
+reported per endpoint and written to a JSON file tagged with the git commit.
+
+    python -m benchmarks.loadgen --base-url http://localhost:8000 --concurrency 32 \\
+        --requests 1000 --history-ratio 0.3 --label sqlite
+"""
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+QUERIES = [
+    "What is Python?",
+    "Explain quantum computing.",
+    "How do vaccines work?",
+    "What causes inflation?",
+    "Why is the sky blue?",
+    "How does TCP congestion control work?",
+    "What is a black hole?",
+    "Explain the CAP theorem.",
+]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an unsorted list"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, round(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(samples, elapsed):
+    """Reduce (latency_seconds, status_code) samples to the reported figures"""
+    latencies = [latency for latency, _ in samples]
+    statuses = {}
+    for _, status in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    ok = sum(1 for _, status in samples if 200 <= status < 300)
+    return {
+        "requests": len(samples),
+        "ok": ok,
+        "error_rate": 1 - ok / len(samples) if samples else 0.0,
+        "rps": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": _ms(percentile(latencies, 50)),
+        "p95_ms": _ms(percentile(latencies, 95)),
+        "p99_ms": _ms(percentile(latencies, 99)),
+        "max_ms": _ms(max(latencies) if latencies else None),
+        "status_codes": statuses,
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def run_load(base_url, concurrency=16, requests=500, history_ratio=0.3, users=50, seed=None, timeout=60.0):
+    rng = random.Random(seed)
+    samples = {"generate": [], "history": []}
+    remaining = iter(range(requests))
+
+    async def worker(client):
+        for _ in remaining:
+            user_id = f"bench-user-{rng.randrange(users)}"
+            start = time.perf_counter()
+            if rng.random() < history_ratio:
+                endpoint = "history"
+                call = client.get("/api/history", params={"user_id": user_id})
+            else:
+                endpoint = "generate"
+                call = client.post("/api/generate", json={"user_id": user_id, "query": rng.choice(QUERIES)})
+            try:
+                status = (await call).status_code
+            except httpx.HTTPError:
+                status = 599  # client-side failure (timeout, connection reset)
+            samples[endpoint].append((time.perf_counter() - start, status))
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "elapsed_seconds": round(elapsed, 3),
+        "total_rps": round(requests / elapsed, 2) if elapsed else 0.0,
+        "endpoints": {name: summarize(endpoint_samples, elapsed) for name, endpoint_samples in samples.items() if endpoint_samples},
+    }
+
+
+def save_results(result, label, config, results_dir=RESULTS_DIR):
+    results_dir = Path(results_dir)
+    results_dir.mkdir(parents=True, exist_ok=True)
+    commit = git_commit()
+    timestamp = datetime.now(timezone.utc)
+    document = {
+        "label": label,
+        "commit": commit,
+        "timestamp": timestamp.isoformat(),
+        "config": config,
+        **result,
+    }
+    path = results_dir / f"{timestamp:%Y%m%dT%H%M%S}-{commit}-{label}.json"
+    path.write_text(json.dumps(document, indent=2))
+    return path
+
+
+def print_report(result, label=""):
+    print(f"== {label} ({result['elapsed_seconds']}s, {result['total_rps']} req/s overall)")
+    print(f"{'endpoint':<10} {'reqs':>6} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for name, stats in result["endpoints"].items():
+        print(
+            f"{name:<10} {stats['requests']:>6} {stats['rps']:>8.1f} {stats['p50_ms']:>9} "
+            f"{stats['p95_ms']:>9} {stats['p99_ms']:>9} {stats['error_rate']:>7.1%}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--history-ratio", type=float, default=0.3)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--label", default="run")
+    parser.add_argument("--results-dir", default=str(RESULTS_DIR))
+    args = parser.parse_args(argv)
+
+    config = {k: v for k, v in vars(args).items() if k not in ("results_dir",)}
+    result = asyncio.run(run_load(
+        args.base_url,
+        concurrency=args.concurrency,
+        requests=args.requests,
+        history_ratio=args.history_ratio,
+        users=args.users,
+        seed=args.seed,
+    ))
+    print_report(result, args.label)
+    print(f"saved {save_results(result, args.label, config, args.results_dir)}")
+
+
+if __name__ == "__main__":
+    main()
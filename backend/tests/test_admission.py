@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from app.admission import AdmissionController, AdmissionRejected
+
+
+def test_slots_are_handed_out_round_robin_across_users():
+    controller = AdmissionController(max_concurrent=1, max_queue=10, max_per_user=10, queue_timeout=1)
+    order = []
+
+    async def request(user):
+        await controller.acquire(user)
+        order.append(user)
+        await asyncio.sleep(0.01)
+        controller.release(user)
+
+    async def run():
+        await controller.acquire("holder")
+        # "greedy" queues three requests before "polite" queues one
+        tasks = [asyncio.create_task(request(user)) for user in ["greedy", "greedy", "greedy", "polite"]]
+        await asyncio.sleep(0)
+        controller.release("holder")
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+
+    assert order == ["greedy", "polite", "greedy", "greedy"]
+    assert controller.stats()["in_flight"] == 0
+    assert controller.stats()["queued"] == 0
+
+
+def test_full_queue_and_per_user_limit_are_rejected_immediately():
+    controller = AdmissionController(max_concurrent=1, max_queue=1, max_per_user=2, queue_timeout=1)
+
+    async def run():
+        await controller.acquire("a")
+        waiter = asyncio.create_task(controller.acquire("a"))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as user_limit:
+            await controller.acquire("a")
+        with pytest.raises(AdmissionRejected) as queue_full:
+            await controller.acquire("b")
+        controller.release("a")
+        await waiter
+        controller.release("a")
+        return user_limit.value, queue_full.value
+
+    user_limit, queue_full = asyncio.run(run())
+
+    assert (user_limit.reason, queue_full.reason) == ("user_limit", "queue_full")
+    assert queue_full.retry_after >= 1
+    assert controller.stats()["rejected_user_limit"] == 1
+    assert controller.stats()["rejected_queue_full"] == 1
+
+
+def test_waiters_time_out_and_leave_the_queue():
+    controller = AdmissionController(max_concurrent=1, max_queue=5, max_per_user=5, queue_timeout=0.05)
+
+    async def run():
+        await controller.acquire("a")
+        with pytest.raises(AdmissionRejected) as timeout:
+            await controller.acquire("b")
+        controller.release("a")
+        # The timed-out waiter left no trace: the next request is admitted straight away
+        await asyncio.wait_for(controller.acquire("c"), 0.01)
+        return timeout.value
+
+    assert asyncio.run(run()).reason == "timeout"
+    assert controller.stats()["queued"] == 0
+    assert controller.stats()["in_flight"] == 1
@@ -1,15 +1,22 @@
+import asyncio
+import time
 import pytest
-from unittest.mock import MagicMock, patch
-from app.ai_service import AIService # Assuming your AIService is in app.ai_service
+from prometheus_client import REGISTRY
+from unittest.mock import AsyncMock, MagicMock, patch
+from app.ai_service import AIService, PartialGenerationError, parse_dual_tone # Assuming your AIService is in app.ai_service
 
 @pytest.fixture
 def ai_service():
-    with patch('app.ai_service.Groq') as mock_groq:
+    with patch('app.ai_service.Groq') as mock_groq, patch('app.ai_service.AsyncGroq') as mock_async_groq:
         # Mock the Groq client instance and its methods if necessary
         mock_client_instance = MagicMock()
         mock_groq.return_value = mock_client_instance
+        mock_async_client_instance = MagicMock()
+        mock_async_client_instance.chat.completions.create = AsyncMock()
+        mock_async_groq.return_value = mock_async_client_instance
         service = AIService()
         service.client = mock_client_instance # Ensure the service uses the mocked client
+        service.async_client = mock_async_client_instance
         return service
 
 def test_generate_casual_response_prompt_formatting(ai_service):
@@ -66,9 +73,203 @@ def test_generate_responses_calls_both_methods(ai_service):
         
         result = ai_service.generate_responses(query)
 
-        mock_casual.assert_called_once_with(query)
-        mock_formal.assert_called_once_with(query)
+        mock_casual.assert_called_once_with(query, use_cache=True)
+        mock_formal.assert_called_once_with(query, use_cache=True)
         assert result == {
             "casual_response": casual_mock_response,
             "formal_response": formal_mock_response
-        }
\ No newline at end of file
+        }
+
+def _completion(content):
+    completion = MagicMock()
+    completion.choices[0].message.content = content
+    return completion
+
+def test_generate_responses_async_runs_tones_concurrently(ai_service):
+    async def slow_create(**kwargs):
+        await asyncio.sleep(0.2)
+        return _completion(f"temp={kwargs['temperature']}")
+
+    ai_service.async_client.chat.completions.create.side_effect = slow_create
+
+    start = time.perf_counter()
+    result = asyncio.run(ai_service.generate_responses_async("Test query"))
+    elapsed = time.perf_counter() - start
+
+    assert result == {"casual_response": "temp=0.7", "formal_response": "temp=0.3"}
+    # Two 0.2s calls in parallel should take roughly one call, not the sum
+    assert elapsed < 0.35
+
+def test_generate_responses_async_keeps_completed_tone_on_partial_failure(ai_service):
+    async def create(**kwargs):
+        if kwargs["temperature"] == 0.3:
+            raise RuntimeError("formal exploded")
+        return _completion("Casual answer.")
+
+    ai_service.async_client.chat.completions.create.side_effect = create
+
+    with pytest.raises(PartialGenerationError) as exc_info:
+        asyncio.run(ai_service.generate_responses_async("Test query"))
+
+    assert exc_info.value.responses == {"casual_response": "Casual answer.", "formal_response": None}
+    assert list(exc_info.value.errors) == ["formal_response"]
+
+class _FakeStream:
+    def __init__(self, tokens, delay=0):
+        self.tokens = tokens
+        self.delay = delay
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for token in self.tokens:
+            await asyncio.sleep(self.delay)
+            chunk = MagicMock()
+            chunk.choices[0].delta.content = token
+            yield chunk
+
+def test_stream_responses_interleaves_tagged_tokens(ai_service):
+    async def create(**kwargs):
+        assert kwargs["stream"] is True
+        if kwargs["temperature"] == 0.7:
+            return _FakeStream(["Hey", " there"], delay=0.01)
+        return _FakeStream(["Greetings", "."], delay=0.015)
+
+    ai_service.async_client.chat.completions.create.side_effect = create
+
+    async def collect():
+        return [event async for event in ai_service.stream_responses("Test query")]
+
+    events = asyncio.run(collect())
+
+    casual = [payload for tone, kind, payload in events if tone == "casual" and kind == "token"]
+    formal = [payload for tone, kind, payload in events if tone == "formal" and kind == "token"]
+    assert casual == ["Hey", " there"]
+    assert formal == ["Greetings", "."]
+    assert sorted((tone, kind) for tone, kind, _ in events if kind != "token") == [("casual", "done"), ("formal", "done")]
+
+def test_generate_responses_async_only_calls_requested_tones(ai_service):
+    ai_service.async_client.chat.completions.create.return_value = _completion("Just casual.")
+
+    result = asyncio.run(ai_service.generate_responses_async("Test query", tones={"casual"}))
+
+    assert result == {"casual_response": "Just casual."}
+    ai_service.async_client.chat.completions.create.assert_called_once()
+    assert ai_service.async_client.chat.completions.create.call_args.kwargs["temperature"] == 0.7
+
+def test_identical_concurrent_queries_are_coalesced(ai_service):
+    async def slow_create(**kwargs):
+        await asyncio.sleep(0.05)
+        return _completion("Shared answer.")
+
+    ai_service.async_client.chat.completions.create.side_effect = slow_create
+    ai_service.cache.max_entries = 0  # isolate coalescing from caching
+
+    async def burst():
+        return await asyncio.gather(
+            *(ai_service.generate_casual_response_async(q) for q in ["What is AI?", "what is  ai?", "WHAT IS AI?"])
+        )
+
+    assert asyncio.run(burst()) == ["Shared answer."] * 3
+    ai_service.async_client.chat.completions.create.assert_called_once()
+    assert ai_service.singleflight.stats()["coalesced"] == 2
+
+def test_cache_hits_are_not_counted_as_routed_requests(ai_service):
+    ai_service.async_client.chat.completions.create.return_value = _completion("Cached once.")
+
+    for _ in range(3):
+        asyncio.run(ai_service.generate_casual_response_async("What is a cache?"))
+
+    ai_service.async_client.chat.completions.create.assert_called_once()
+    assert ai_service.router.stats()["small_routed"] == 1
+
+def test_completion_stage_latency_and_token_usage_are_recorded(ai_service):
+    completion = _completion("Counted.")
+    completion.usage.prompt_tokens = 11
+    completion.usage.completion_tokens = 7
+    ai_service.async_client.chat.completions.create.return_value = completion
+
+    def sample(name, labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    before_tokens = sample("ai_response_llm_tokens_total", {"tone": "formal", "kind": "completion"})
+    before_count = sample("ai_response_stage_seconds_count", {"stage": "completion_formal"})
+
+    asyncio.run(ai_service.generate_formal_response_async("Count my tokens"))
+
+    assert sample("ai_response_llm_tokens_total", {"tone": "formal", "kind": "completion"}) == before_tokens + 7
+    assert sample("ai_response_stage_seconds_count", {"stage": "completion_formal"}) == before_count + 1
+
+def test_combined_mode_returns_both_tones_from_one_completion(ai_service):
+    ai_service.generation_mode = "combined"
+    ai_service.async_client.chat.completions.create.return_value = _completion(
+        '{"casual": "Hey, it is a snake!", "formal": "Python is a programming language."}'
+    )
+
+    result = asyncio.run(ai_service.generate_responses_async("What is Python?"))
+
+    assert result == {"casual_response": "Hey, it is a snake!", "formal_response": "Python is a programming language."}
+    ai_service.async_client.chat.completions.create.assert_called_once()
+    assert ai_service.async_client.chat.completions.create.call_args.kwargs["response_format"] == {"type": "json_object"}
+    # Each tone is cached under its own key, so a later single-tone request is free
+    assert asyncio.run(ai_service.generate_casual_response_async("What is Python?")) == "Hey, it is a snake!"
+    ai_service.async_client.chat.completions.create.assert_called_once()
+
+def test_combined_mode_caches_each_tone_under_its_single_tone_model(ai_service):
+    ai_service.generation_mode = "combined"
+    ai_service.router.large_model = "large"
+    ai_service.router.thresholds = {"formal": 1, "casual": 1000}  # formal goes large, casual stays small
+    ai_service.async_client.chat.completions.create.return_value = _completion(
+        '{"casual": "Casual.", "formal": "Formal."}'
+    )
+
+    asyncio.run(ai_service.generate_responses_async("What is routing?"))
+
+    assert ai_service.async_client.chat.completions.create.call_args.kwargs["model"] == "large"
+    assert asyncio.run(ai_service.generate_casual_response_async("What is routing?")) == "Casual."
+    assert asyncio.run(ai_service.generate_formal_response_async("What is routing?")) == "Formal."
+    ai_service.async_client.chat.completions.create.assert_called_once()
+
+def test_parse_dual_tone_repairs_common_slips():
+    content = 'Sure! ```json\n{"casual": "Line one\nline two", "formal_response": "Formal.",}\n```'
+
+    responses, repaired = parse_dual_tone(content)
+
+    assert responses == {"casual": "Line one\nline two", "formal": "Formal."}
+    assert repaired
+    with pytest.raises(ValueError):
+        parse_dual_tone('{"casual": "only one tone"}')
+
+def test_combined_mode_falls_back_to_two_calls_on_unparseable_output(ai_service):
+    ai_service.generation_mode = "combined"
+
+    async def create(**kwargs):
+        if "response_format" in kwargs:
+            return _completion('{"casual": "cut off')
+        return _completion(f"temp={kwargs['temperature']}")
+
+    ai_service.async_client.chat.completions.create.side_effect = create
+
+    result = asyncio.run(ai_service.generate_responses_async("Test query"))
+
+    assert result == {"casual_response": "temp=0.7", "formal_response": "temp=0.3"}
+    assert ai_service.async_client.chat.completions.create.call_count == 3
+    assert ai_service.generation_stats()["combined_fallbacks"] == 1
+
+def test_history_goes_before_the_query_and_skips_the_cache(ai_service):
+    ai_service.async_client.chat.completions.create.return_value = _completion("Still a snake.")
+    history = [{"role": "user", "content": "What is Python?"}, {"role": "assistant", "content": "A snake."}]
+
+    for _ in range(2):
+        result = asyncio.run(ai_service.generate_responses_async(
+            "Is it venomous?", tones={"casual"}, context={"casual": history}
+        ))
+
+    assert result == {"casual_response": "Still a snake."}
+    # The answer depends on the conversation, so neither call was served from the cache
+    assert ai_service.async_client.chat.completions.create.call_count == 2
+    messages = ai_service.async_client.chat.completions.create.call_args.kwargs["messages"]
+    assert [m["role"] for m in messages] == ["system", "user", "assistant", "user"]
+    assert messages[1:3] == history
+    assert messages[-1]["content"].endswith("Is it venomous?")
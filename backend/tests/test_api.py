@@ -1,13 +1,34 @@
+import pytest
 from fastapi.testclient import TestClient
+from groq import RateLimitError
 from unittest.mock import patch, MagicMock
-from sqlalchemy import create_engine, event, TypeDecorator, CHAR
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import event, TypeDecorator, CHAR
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.pool import StaticPool
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.dialects.postgresql import UUID as PG_UUID # Keep for the model definition
+from app import database
 from app.main import app
-from app.database import Base, get_db
+from app.database import Base, get_db, get_read_db
+from app.migrations import migrate
 from app.models import Prompt
+from app.ai_service import PartialGenerationError
+from app.persistence import prompt_writer
+from app.routes import batch_jobs
+from app.archive import prompt_archiver
+from app.search import search_statement
+from app.admission import admission
+from app.conversation import conversations
+import asyncio
+import base64
+import csv
+import gzip
+import io
+import httpx
+import json
+import time
 import uuid
+from datetime import datetime
 
 # --- Custom UUID type for SQLite ---
 # This will store UUIDs as strings in SQLite for testing
@@ -34,9 +55,10 @@ class SQLiteUUID(TypeDecorator):
     def python_type(self):
         return uuid.UUID
     
-# Setup for an in-memory SQLite database for testing
-SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
-engine = create_engine(
+# Setup for an in-memory SQLite database for testing, driven through aiosqlite
+# StaticPool keeps the single in-memory connection alive across sessions
+SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///:memory:"
+engine = create_async_engine(
     SQLALCHEMY_DATABASE_URL,
     connect_args={"check_same_thread": False},
     poolclass=StaticPool,
@@ -53,32 +75,65 @@ def before_create(target, connection, **kw):
                     # Change the type to our custom SQLiteUUID for SQLite dialect
                     column.type = SQLiteUUID()
 
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+TestingSessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
 
 # Create tables in the in-memory database before tests run
 # The event listener above will modify the UUID column type for SQLite
-Base.metadata.create_all(bind=engine)
+async def create_tables():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+asyncio.run(create_tables())
 
 # Dependency override for tests
-def override_get_db():
-    try:
-        db = TestingSessionLocal()
+async def override_get_db():
+    async with TestingSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 app.dependency_overrides[get_db] = override_get_db
+# One in-memory database plays both primary and replica
+app.dependency_overrides[get_read_db] = override_get_db
 
 
 client = TestClient(app)
 
+
+@pytest.fixture
+def lifespan_database(tmp_path, monkeypatch):
+    """Point the lifespan's init_engines at a migrated temp SQLite file, never DATABASE_URL"""
+    url = f"sqlite:///{tmp_path / 'lifespan.db'}"
+    migrate(database.create_engine(url))
+    monkeypatch.setattr(database, "DATABASE_URL", url)
+    monkeypatch.setattr(database, "DATABASE_READ_URL", None)
+    for name in ("engine", "async_engine", "read_async_engine"):
+        monkeypatch.setattr(database, name, None)
+    binds = database.SessionLocal.kw.get("bind"), database.AsyncSessionLocal.kw.get("bind")
+    yield url
+    database.SessionLocal.configure(bind=binds[0])
+    database.AsyncSessionLocal.configure(bind=binds[1])
+
+
 def test_read_root():
     response = client.get("/")
     assert response.status_code == 200
     assert "message" in response.json()
 
 
-@patch("app.ai_service.AIService.generate_responses")
+def test_health_endpoints_follow_the_lifespan(lifespan_database):
+    assert client.get("/health/live").status_code == 200
+    # Without the lifespan nothing has been set up, so the app is not ready
+    assert client.get("/health/ready").status_code == 503
+
+    with TestClient(app) as lifespan_client:
+        response = lifespan_client.get("/health/ready")
+        assert response.status_code == 200
+        assert response.json()["import_to_ready_seconds"] > 0
+        assert 'ai_response_startup_seconds{phase="import_to_ready"}' in lifespan_client.get("/metrics").text
+
+    assert client.get("/health/ready").status_code == 503
+
+
+@patch("app.ai_service.AIService.generate_responses_async")
 def test_generate_endpoint(mock_generate):
     # Mock the AI service response
     mock_generate.return_value = {
@@ -97,6 +152,113 @@ def test_generate_endpoint(mock_generate):
     assert "formal_response" in response.json()
 
 
+@patch("app.ai_service.AIService.generate_responses_async")
+def test_generate_endpoint_partial_failure_returns_completed_tone(mock_generate):
+    mock_generate.side_effect = PartialGenerationError(
+        {"casual_response": "Still here", "formal_response": None},
+        {"formal_response": RuntimeError("upstream timeout")},
+    )
+
+    response = client.post(
+        "/api/generate",
+        json={"user_id": "test_user_partial", "query": "test query"}
+    )
+
+    assert response.status_code == 502
+    detail = response.json()["detail"]
+    assert detail["casual_response"] == "Still here"
+    assert detail["formal_response"] is None
+    assert detail["errors"] == {"formal_response": "upstream timeout"}
+
+
+@patch("app.ai_service.AIService.generate_responses_async")
+def test_generate_endpoint_maps_exhausted_rate_limit_to_429(mock_generate):
+    response = httpx.Response(429, headers={"retry-after": "7"}, request=httpx.Request("POST", "https://api.groq.com"))
+    throttled = RateLimitError("rate limited", response=response, body=None)
+    mock_generate.side_effect = PartialGenerationError(
+        {"casual_response": None, "formal_response": None},
+        {"casual_response": throttled, "formal_response": throttled},
+    )
+
+    result = client.post("/api/generate", json={"user_id": "throttled_user", "query": "q"})
+
+    assert result.status_code == 429
+    assert result.headers["Retry-After"] == "7"
+
+
+def _parse_sse(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+@patch("app.ai_service.AIService.stream_responses")
+def test_generate_stream_endpoint_emits_tagged_events_and_persists_once(mock_stream):
+    async def fake_stream(query, use_cache=True, tones=None, context=None):
+        for event in [
+            ("casual", "token", "Hi"),
+            ("formal", "token", "Good day"),
+            ("casual", "token", " pal"),
+            ("casual", "done", None),
+            ("formal", "done", None),
+        ]:
+            yield event
+
+    mock_stream.side_effect = fake_stream
+    test_user_id = f"stream_user_{uuid.uuid4()}"
+
+    response = client.post(
+        "/api/generate/stream",
+        json={"user_id": test_user_id, "query": "stream me"}
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = _parse_sse(response.text)
+    assert events[:3] == [
+        ("casual", {"token": "Hi"}),
+        ("formal", {"token": "Good day"}),
+        ("casual", {"token": " pal"}),
+    ]
+    assert events[-1] == ("done", {"casual_response": "Hi pal", "formal_response": "Good day"})
+
+    history = client.get(f"/api/history?user_id={test_user_id}").json()
+    assert len(history) == 1
+    assert history[0]["casual_response"] == "Hi pal"
+
+
+@patch("app.ai_service.AIService.generate_responses_async")
+def test_generate_single_tone_is_stored_and_reported_in_history(mock_generate):
+    mock_generate.return_value = {"formal_response": "Only formal."}
+    test_user_id = f"single_tone_user_{uuid.uuid4()}"
+
+    response = client.post(
+        "/api/generate",
+        json={"user_id": test_user_id, "query": "formal only", "tones": ["formal"]}
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {"casual_response": None, "formal_response": "Only formal."}
+    assert mock_generate.call_args.kwargs["tones"] == {"formal"}
+
+    history = client.get(f"/api/history?user_id={test_user_id}").json()
+    assert history[0]["casual_response"] is None
+    assert history[0]["formal_response"] == "Only formal."
+    assert history[0]["tones"] == ["formal"]
+
+
+def test_generate_endpoint_rejects_unknown_or_empty_tones():
+    for tones in (["sarcastic"], []):
+        response = client.post(
+            "/api/generate",
+            json={"user_id": "test_user", "query": "q", "tones": tones}
+        )
+        assert response.status_code == 422
+        assert "tones" in response.json()["detail"][0]["loc"]
+
+
 def test_generate_endpoint_invalid_payload_missing_userid(): # Removed mock_generate
     response = client.post(
         "/api/generate",
@@ -121,7 +283,7 @@ def test_generate_endpoint_invalid_payload_empty_query(): # Removed mock_generat
     # but the 422 tests above don't need it. If this were to pass through to the service,
     # then a mock would be essential.
     # For consistency, if we *did* want to mock it to ensure it's not called or to provide a dummy response:
-    # @patch("app.ai_service.AIService.generate_responses")
+    # @patch("app.ai_service.AIService.generate_responses_async")
     # def test_generate_endpoint_invalid_payload_empty_query(mock_generate_service_call):
     #    mock_generate_service_call.return_value = {"casual_response": "", "formal_response": ""}
     
@@ -151,7 +313,7 @@ def test_generate_endpoint_invalid_payload_empty_query(): # Removed mock_generat
     # If an empty query is allowed by Pydantic, this test as written will try to call the service.
     # Let's add a mock here to be safe and explicit for this case, as it's not a 422.
 
-    with patch("app.ai_service.AIService.generate_responses") as mock_service_call_for_empty:
+    with patch("app.ai_service.AIService.generate_responses_async") as mock_service_call_for_empty:
         mock_service_call_for_empty.return_value = {
             "casual_response": "Casual for empty",
             "formal_response": "Formal for empty"
@@ -174,7 +336,7 @@ def test_generate_endpoint_invalid_payload_wrong_type(): # Removed mock_generate
     assert "string_type" in response.json()["detail"][0]["type"]
 
 
-@patch("app.ai_service.AIService.generate_responses")
+@patch("app.ai_service.AIService.generate_responses_async")
 def test_generate_and_get_history_integration(mock_generate_ai):
     # --- Part 1: Generate a new prompt entry ---
     test_user_id = f"integration_user_{uuid.uuid4()}" # Unique user_id for test isolation
@@ -233,4 +395,525 @@ def test_generate_and_get_history_integration(mock_generate_ai):
     # db = next(override_get_db())
     # db.query(Prompt).filter(Prompt.user_id == test_user_id).delete()
     # db.commit()
-    # db.close()
\ No newline at end of file
+    # db.close()
+
+def test_get_history_keyset_pagination_walks_all_rows_once():
+    test_user_id = f"paged_user_{uuid.uuid4()}"
+    shared_timestamp = datetime(2024, 1, 1, 12, 0, 0)
+
+    async def seed():
+        async with TestingSessionLocal() as db:
+            # Several rows share a timestamp to exercise the id tie-breaker
+            for i in range(7):
+                db.add(Prompt(
+                    user_id=test_user_id,
+                    query=f"query {i}",
+                    casual_response="c",
+                    formal_response="f",
+                    created_at=shared_timestamp if i < 4 else datetime(2024, 1, 2, i),
+                ))
+            await db.commit()
+
+    asyncio.run(seed())
+
+    seen = []
+    cursor = None
+    pages = 0
+    while True:
+        url = f"/api/history?user_id={test_user_id}&limit=3"
+        if cursor:
+            url += f"&before={cursor}"
+        response = client.get(url)
+        assert response.status_code == 200
+        seen.extend(entry["query"] for entry in response.json())
+        pages += 1
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+
+    assert pages == 3
+    assert sorted(seen) == [f"query {i}" for i in range(7)]
+    assert len(set(seen)) == 7
+    assert seen[:3] == ["query 6", "query 5", "query 4"]
+
+
+def _history_query_plan(url):
+    """EXPLAIN QUERY PLAN rows of the prompts query behind a /history request"""
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if "FROM prompts" in statement and not statement.startswith("EXPLAIN"):
+            captured.append((statement, parameters))
+
+    event.listen(engine.sync_engine, "before_cursor_execute", capture)
+    try:
+        assert client.get(url).status_code == 200
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", capture)
+
+    async def explain():
+        async with engine.connect() as conn:
+            raw = await conn.get_raw_connection()
+            rows = await raw.driver_connection.execute_fetchall(f"EXPLAIN QUERY PLAN {captured[-1][0]}", captured[-1][1])
+            return [row[3] for row in rows]
+
+    return asyncio.run(explain())
+
+
+def test_get_history_before_cursor_is_one_index_range():
+    cursor = base64.urlsafe_b64encode(f"2024-01-01T12:00:00|{uuid.uuid4()}".encode()).decode()
+
+    plan = _history_query_plan(f"/api/history?user_id=plan_user&before={cursor}")
+
+    assert any("ix_prompts_user_id_created_at_id (user_id=? AND (created_at,id)<(?,?))" in step for step in plan), plan
+    assert not any("TEMP B-TREE" in step for step in plan), plan
+
+
+def test_get_history_after_returns_only_newer_rows():
+    test_user_id = f"incremental_user_{uuid.uuid4()}"
+
+    async def seed(indexes):
+        async with TestingSessionLocal() as db:
+            for i in indexes:
+                db.add(Prompt(
+                    user_id=test_user_id,
+                    query=f"query {i}",
+                    casual_response="c",
+                    created_at=datetime(2024, 1, 1, 12, i),
+                ))
+            await db.commit()
+
+    asyncio.run(seed(range(3)))
+    first = client.get(f"/api/history?user_id={test_user_id}")
+    newest = first.headers["X-Newest-Cursor"]
+    assert [entry["query"] for entry in first.json()] == ["query 2", "query 1", "query 0"]
+
+    response = client.get(f"/api/history?user_id={test_user_id}&after={newest}")
+    assert response.json() == []
+    assert "X-Newest-Cursor" not in response.headers
+
+    asyncio.run(seed(range(3, 8)))
+    # Pages walk forward from the cursor; each is still newest first
+    response = client.get(f"/api/history?user_id={test_user_id}&after={newest}&limit=3")
+    assert [entry["query"] for entry in response.json()] == ["query 5", "query 4", "query 3"]
+    response = client.get(f"/api/history?user_id={test_user_id}&after={response.headers['X-Newest-Cursor']}&limit=3")
+    assert [entry["query"] for entry in response.json()] == ["query 7", "query 6"]
+
+    assert client.get(f"/api/history?user_id={test_user_id}&after={newest}&before={newest}").status_code == 400
+
+
+def test_get_history_after_cursor_is_one_index_range():
+    cursor = base64.urlsafe_b64encode(f"2024-01-01T12:00:00|{uuid.uuid4()}".encode()).decode()
+
+    plan = _history_query_plan(f"/api/history?user_id=plan_user&after={cursor}")
+
+    assert any("ix_prompts_user_id_created_at_id (user_id=? AND (created_at,id)>(?,?))" in step for step in plan), plan
+    assert not any("TEMP B-TREE" in step for step in plan), plan
+
+
+def test_search_history_ranks_and_pages_matches():
+    test_user_id = f"search_user_{uuid.uuid4()}"
+
+    async def seed():
+        async with TestingSessionLocal() as db:
+            db.add_all([
+                Prompt(user_id=test_user_id, query="What is Python?", casual_response="Python is a snake-named language. Python rocks.", formal_response=None),
+                Prompt(user_id=test_user_id, query="Explain decorators", casual_response=None, formal_response="Decorators wrap functions in Python."),
+                Prompt(user_id=test_user_id, query="How do vaccines work?", casual_response="They train your immune system.", formal_response=None),
+                Prompt(user_id="someone_else", query="Python packaging", casual_response="pip", formal_response="pip"),
+            ])
+            await db.commit()
+
+    asyncio.run(seed())
+
+    response = client.get(f"/api/history/search?user_id={test_user_id}&q=python")
+    assert response.status_code == 200
+    results = response.json()
+    assert [r["query"] for r in results] == ["What is Python?", "Explain decorators"]
+    assert results[0]["rank"] > results[1]["rank"]
+    assert "X-Next-Offset" not in response.headers
+
+    # Stemming matches "functions" for "function"; operators in user input are treated as words
+    response = client.get(f"/api/history/search?user_id={test_user_id}&q=function AND (")
+    assert [r["query"] for r in response.json()] == []
+    response = client.get(f"/api/history/search?user_id={test_user_id}&q=wrap function")
+    assert [r["query"] for r in response.json()] == ["Explain decorators"]
+
+    first = client.get(f"/api/history/search?user_id={test_user_id}&q=python&limit=1")
+    assert first.headers["X-Next-Offset"] == "1"
+    second = client.get(f"/api/history/search?user_id={test_user_id}&q=python&limit=1&offset=1")
+    assert [r["query"] for r in first.json() + second.json()] == ["What is Python?", "Explain decorators"]
+
+
+def test_search_narrows_the_index_to_the_user_before_ranking():
+    sql = str(search_statement("postgresql", "alice", "python").compile(dialect=postgresql.dialect()))
+    assert "prompt_search.user_id = %(user_id_1)s" in sql
+    sql = str(search_statement("sqlite", "alice", "python").compile(compile_kwargs={"literal_binds": True}))
+    assert 'user_id : "u' in sql and 'AND "python"' in sql
+
+
+def test_history_summary_view_and_detail_endpoint():
+    test_user_id = f"summary_user_{uuid.uuid4()}"
+    long_answer = "word " * 2000
+
+    async def seed():
+        async with TestingSessionLocal() as db:
+            for i in range(20):
+                db.add(Prompt(
+                    user_id=test_user_id,
+                    query=f"question {i} " + "x" * 300,
+                    casual_response=long_answer,
+                    formal_response=long_answer,
+                    created_at=datetime(2024, 3, 1, 12, i),
+                ))
+            await db.commit()
+
+    asyncio.run(seed())
+
+    full = client.get(f"/api/history?user_id={test_user_id}", headers={"Accept-Encoding": "identity"})
+    summary = client.get(f"/api/history?user_id={test_user_id}&view=summary", headers={"Accept-Encoding": "identity"})
+    assert summary.status_code == 200
+    items = summary.json()
+    assert set(items[0]) == {"id", "query_preview", "created_at"}
+    assert items[0]["query_preview"] == ("question 19 " + "x" * 300)[:100]
+    assert summary.headers["X-Newest-Cursor"] == full.headers["X-Newest-Cursor"]
+    assert len(summary.content) * 100 < len(full.content)
+
+    detail = client.get(f"/api/history/{items[0]['id']}?user_id={test_user_id}")
+    assert detail.status_code == 200
+    assert detail.json()["casual_response"] == long_answer
+    assert client.get(f"/api/history/{items[0]['id']}?user_id=someone_else").status_code == 404
+    assert client.get(f"/api/history/{uuid.uuid4()}?user_id={test_user_id}").status_code == 404
+
+    # Large payloads are compressed when the client accepts gzip
+    compressed = client.get(f"/api/history?user_id={test_user_id}", headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert compressed.json() == full.json()
+
+
+def test_history_include_archived_continues_into_archive_files(tmp_path, monkeypatch):
+    test_user_id = f"archive_user_{uuid.uuid4()}"
+    monkeypatch.setattr(prompt_archiver, "archive_dir", tmp_path)
+    archived_id = uuid.uuid4()
+    with gzip.open(tmp_path / "prompts-2023-12.jsonl.gz", "wt", encoding="utf-8") as archive:
+        archive.write(json.dumps({
+            "id": str(archived_id), "user_id": test_user_id, "query": "archived question",
+            "casual_response": "old answer", "formal_response": None, "created_at": "2023-12-24T10:00:00",
+        }) + "\n")
+
+    async def seed():
+        async with TestingSessionLocal() as db:
+            for day in (1, 2):
+                db.add(Prompt(user_id=test_user_id, query=f"hot {day}", casual_response="new", created_at=datetime(2024, 3, day)))
+            await db.commit()
+
+    asyncio.run(seed())
+
+    assert [item["query"] for item in client.get(f"/api/history?user_id={test_user_id}").json()] == ["hot 2", "hot 1"]
+    first = client.get(f"/api/history?user_id={test_user_id}&limit=2&include_archived=true")
+    assert [item["query"] for item in first.json()] == ["hot 2", "hot 1"]
+    second = client.get(
+        f"/api/history?user_id={test_user_id}&limit=2&include_archived=true&view=summary",
+        params={"before": first.headers["X-Next-Cursor"]},
+    )
+    assert second.json() == [{"id": str(archived_id), "query_preview": "archived question", "created_at": "2023-12-24T10:00:00"}]
+    assert "X-Next-Cursor" not in second.headers
+
+    assert client.get(f"/api/history/{archived_id}?user_id={test_user_id}").status_code == 404
+    detail = client.get(f"/api/history/{archived_id}?user_id={test_user_id}&include_archived=true")
+    assert detail.json()["casual_response"] == "old answer"
+
+
+@patch("app.ai_service.AIService.stream_responses")
+def test_event_streams_are_not_gzipped(mock_stream):
+    async def fake_stream(query, use_cache=True, tones=None, context=None):
+        for tone in ("casual", "formal"):
+            yield tone, "token", "x" * 2000
+            yield tone, "done", None
+
+    mock_stream.side_effect = fake_stream
+
+    # Decided from the response type: clients that send no Accept header (httpx, fetch, curl) included
+    for headers in ({"Accept": "text/event-stream", "Accept-Encoding": "gzip"}, {"Accept-Encoding": "gzip"}):
+        response = client.post("/api/generate/stream", json={"user_id": "sse_gzip_user", "query": "q"}, headers=headers)
+
+        assert response.status_code == 200
+        assert "Content-Encoding" not in response.headers
+        assert response.text.count("x" * 2000) == 4  # each token event, plus the full text in done
+
+
+def test_get_history_rejects_malformed_cursor():
+    response = client.get("/api/history?user_id=someone&before=not-a-cursor")
+    assert response.status_code == 400
+
+
+@patch("app.ai_service.AIService.generate_responses_async")
+def test_generate_write_behind_persists_on_shutdown(mock_generate, lifespan_database):
+    mock_generate.return_value = {
+        "casual_response": "queued casual",
+        "formal_response": "queued formal"
+    }
+    test_user_id = f"write_behind_user_{uuid.uuid4()}"
+
+    with patch.multiple(prompt_writer, enabled=True, session_factory=TestingSessionLocal, flush_interval=60):
+        # Entering the client runs startup (writer starts); leaving it runs shutdown (writer flushes)
+        with TestClient(app) as lifespan_client:
+            for _ in range(3):
+                response = lifespan_client.post(
+                    "/api/generate",
+                    json={"user_id": test_user_id, "query": "buffer me"}
+                )
+                assert response.status_code == 200
+            # Still buffered: nothing has been committed yet
+            assert lifespan_client.get(f"/api/history?user_id={test_user_id}").json() == []
+
+    history = client.get(f"/api/history?user_id={test_user_id}").json()
+    assert [entry["casual_response"] for entry in history] == ["queued casual"] * 3
+    assert prompt_writer.stats()["rows_written"] >= 3
+
+
+def _wait_for_batch(test_client, job_id):
+    for _ in range(200):
+        status = test_client.get(f"/api/generate/batch/{job_id}").json()
+        if status["status"] == "completed":
+            return status
+        time.sleep(0.01)
+    raise AssertionError("batch job did not finish")
+
+
+@patch("app.ai_service.AIService.generate_responses_async")
+def test_generate_batch_runs_job_and_persists_each_prompt(mock_generate, lifespan_database):
+    async def fake_generate(query, use_cache=True, tones=None):
+        return {"casual_response": f"casual {query}", "formal_response": f"formal {query}"}
+
+    mock_generate.side_effect = fake_generate
+    test_user_id = f"batch_user_{uuid.uuid4()}"
+
+    with patch.object(batch_jobs, "session_factory", TestingSessionLocal):
+        # The job runs on the client's event loop, which only lives inside this block
+        with TestClient(app) as lifespan_client:
+            response = lifespan_client.post(
+                "/api/generate/batch",
+                json={"user_id": test_user_id, "queries": ["one", "two", "three"]}
+            )
+            assert response.status_code == 202
+            assert response.json()["total"] == 3
+
+            status = _wait_for_batch(lifespan_client, response.json()["job_id"])
+
+    assert status["completed"] == 3
+    assert [item["casual_response"] for item in status["results"]] == ["casual one", "casual two", "casual three"]
+    assert all(item["prompt_id"] for item in status["results"])
+
+    history = client.get(f"/api/history?user_id={test_user_id}").json()
+    assert sorted(entry["query"] for entry in history) == ["one", "three", "two"]
+
+
+@patch("app.ai_service.AIService.generate_responses_async")
+def test_generate_batch_upload_accepts_jsonl(mock_generate, lifespan_database):
+    async def fake_generate(query, use_cache=True, tones=None):
+        return {"formal_response": f"formal {query}"}
+
+    mock_generate.side_effect = fake_generate
+    test_user_id = f"batch_upload_user_{uuid.uuid4()}"
+    body = '{"query": "first"}\n\n"second"\n'
+
+    with patch.object(batch_jobs, "session_factory", TestingSessionLocal):
+        with TestClient(app) as lifespan_client:
+            response = lifespan_client.post(
+                f"/api/generate/batch/upload?user_id={test_user_id}&tones=formal",
+                files={"file": ("queries.jsonl", body, "application/jsonl")},
+            )
+            assert response.status_code == 202
+            status = _wait_for_batch(lifespan_client, response.json()["job_id"])
+
+    assert [item["query"] for item in status["results"]] == ["first", "second"]
+    assert mock_generate.call_args.kwargs["tones"] == {"formal"}
+
+
+def test_generate_batch_upload_rejects_malformed_lines():
+    response = client.post(
+        "/api/generate/batch/upload?user_id=u",
+        files={"file": ("queries.jsonl", '{"question": "no query key"}\n', "application/jsonl")},
+    )
+    assert response.status_code == 422
+    assert "Line 1" in response.json()["detail"]
+
+
+def test_get_batch_job_unknown_id_is_404():
+    assert client.get("/api/generate/batch/does-not-exist").status_code == 404
+
+
+@patch("app.ai_service.AIService.generate_responses_async")
+def test_metrics_endpoint_exposes_stage_latency_and_component_stats(mock_generate):
+    mock_generate.return_value = {
+        "casual_response": "metric casual",
+        "formal_response": "metric formal"
+    }
+    client.post("/api/generate", json={"user_id": "metrics_user", "query": "measure me"})
+    client.get("/api/history?user_id=metrics_user")
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    for stage in ("db_commit", "db_refresh", "serialization", "db_history_query"):
+        assert f'ai_response_stage_seconds_count{{stage="{stage}"}}' in body
+    assert 'ai_response_http_request_seconds_count{endpoint="generate",method="POST",status="200"}' in body
+    assert "ai_response_generations_in_flight" in body
+    # Monotonic stats() fields are counters, the rest gauges
+    assert "# TYPE ai_response_cache_hits_total counter" in body
+    assert "ai_response_cache_hits_total " in body
+    assert "ai_response_llm_scheduler_throttled_calls_total " in body
+    assert "# TYPE ai_response_llm_scheduler_in_flight gauge" in body
+    assert "# TYPE ai_response_cache_hit_rate gauge" in body
+
+
+def test_stats_and_metrics_report_the_same_components():
+    components = set(client.get("/api/stats").json())
+    body = client.get("/metrics").text
+
+    assert "profiling" in components
+    for component in components:
+        assert f"ai_response_{component}_" in body
+
+
+def test_export_streams_ndjson_and_csv_with_filters():
+    test_user_id = f"export_user_{uuid.uuid4()}"
+
+    async def seed():
+        async with TestingSessionLocal() as db:
+            for day in (1, 2, 3):
+                db.add(Prompt(
+                    user_id=test_user_id,
+                    query=f"question, {day}",
+                    casual_response=f"answer\n{day}",
+                    formal_response=None if day == 2 else "Formal.",
+                    created_at=datetime(2024, 5, day),
+                ))
+            await db.commit()
+
+    asyncio.run(seed())
+
+    response = client.get("/api/export", params={"user_id": test_user_id, "since": "2024-05-02T00:00:00"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    records = [json.loads(line) for line in response.text.splitlines()]
+    assert [record["query"] for record in records] == ["question, 2", "question, 3"]
+    assert records[0]["casual_response"] == "answer\n2"
+    assert records[0]["formal_response"] is None
+
+    response = client.get("/api/export", params={"user_id": test_user_id, "until": "2024-05-02T00:00:00", "format": "csv"})
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.reader(io.StringIO(response.text)))
+    assert rows[0] == ["id", "user_id", "query", "casual_response", "formal_response", "created_at"]
+    assert rows[1][2:] == ["question, 1", "answer\n1", "Formal.", "2024-05-01T00:00:00"]
+    assert len(rows) == 2
+
+    assert client.get("/api/export", params={"since": "2024-05-02T00:00:00", "until": "2024-05-01T00:00:00"}).status_code == 400
+
+
+def test_generate_sheds_load_with_503_before_opening_a_session(monkeypatch):
+    sessions = []
+
+    async def counting_get_db():
+        sessions.append(1)
+        async for db in override_get_db():
+            yield db
+
+    monkeypatch.setitem(app.dependency_overrides, get_db, counting_get_db)
+    # Every slot taken and no room to wait
+    monkeypatch.setattr(admission, "in_flight", admission.max_concurrent)
+    monkeypatch.setattr(admission, "max_queue", 0)
+
+    response = client.post("/api/generate", json={"user_id": "shed_user", "query": "anyone there?"})
+
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+    assert sessions == []
+    assert client.get("/api/stats").json()["admission"]["rejected_queue_full"] >= 1
+
+
+@patch.object(conversations, "summarize_later")
+@patch("app.ai_service.AIService.generate_responses_async")
+def test_thread_turns_carry_earlier_context(mock_generate, summarize_later):
+    mock_generate.side_effect = [
+        {"casual_response": "A snake!", "formal_response": "A language."},
+        {"casual_response": "Nope.", "formal_response": "It is not."},
+    ]
+    test_user_id = f"thread_user_{uuid.uuid4()}"
+
+    created = client.post("/api/threads", json={"user_id": test_user_id, "title": "Python"})
+    assert created.status_code == 201
+    thread_id = created.json()["id"]
+
+    for query in ("What is Python?", "Is it venomous?"):
+        response = client.post("/api/generate", json={"user_id": test_user_id, "query": query, "thread_id": thread_id})
+        assert response.status_code == 200
+
+    first, second = (call.kwargs["context"] for call in mock_generate.call_args_list)
+    assert first == {"casual": [], "formal": []}
+    assert second["casual"] == [
+        {"role": "user", "content": "What is Python?"},
+        {"role": "assistant", "content": "A snake!"},
+    ]
+    assert second["formal"][1]["content"] == "A language."
+
+    detail = client.get(f"/api/threads/{thread_id}", params={"user_id": test_user_id}).json()
+    assert [turn["query"] for turn in detail["turns"]] == ["What is Python?", "Is it venomous?"]
+    assert {turn["thread_id"] for turn in detail["turns"]} == {thread_id}
+    assert [t["id"] for t in client.get("/api/threads", params={"user_id": test_user_id}).json()] == [thread_id]
+
+    # Someone else's thread is invisible, for reads and for new turns alike
+    assert client.get(f"/api/threads/{thread_id}", params={"user_id": "intruder"}).status_code == 404
+    response = client.post("/api/generate", json={"user_id": "intruder", "query": "hi", "thread_id": thread_id})
+    assert response.status_code == 404
+    assert mock_generate.call_count == 2
+    # Each stored turn scheduled a summary check
+    assert [str(call.args[0]) for call in summarize_later.call_args_list] == [thread_id, thread_id]
+
+
+@patch("app.ai_service.AIService.stream_responses")
+def test_thread_summaries_run_in_their_own_session_after_a_stored_turn(mock_stream, lifespan_database):
+    order = []
+    fail = {"tone": False}
+
+    async def fake_stream(query, use_cache=True, tones=None, context=None):
+        if fail["tone"]:
+            yield "casual", "error", RuntimeError("provider down")
+            return
+        yield "casual", "token", "Hi"
+        yield "casual", "done", None
+        order.append("streamed")
+
+    mock_stream.side_effect = fake_stream
+    test_user_id = f"stream_thread_user_{uuid.uuid4()}"
+    sessions = []
+
+    def session_factory():
+        sessions.append(TestingSessionLocal())
+        return sessions[-1]
+
+    async def fake_summarize(db, thread_id, summarize):
+        order.append("summarized")
+        return 0
+
+    body = {"user_id": test_user_id, "query": "hello", "tones": ["casual"]}
+    with patch.object(conversations, "session_factory", session_factory), \
+            patch.object(conversations, "maybe_summarize", side_effect=fake_summarize) as summarize:
+        # Shutdown waits for summaries still running, so every one has finished after this block
+        with TestClient(app) as lifespan_client:
+            body["thread_id"] = lifespan_client.post("/api/threads", json={"user_id": test_user_id}).json()["id"]
+            fail["tone"] = True
+            response = lifespan_client.post("/api/generate/stream", json=body)
+            assert _parse_sse(response.text)[-1][0] == "done"
+            fail["tone"] = False
+            response = lifespan_client.post("/api/generate/stream", json=body)
+
+    assert _parse_sse(response.text)[-1] == ("done", {"casual_response": "Hi"})
+    # The failed stream stored nothing, so it scheduled no summary
+    assert order == ["streamed", "summarized"]
+    assert str(summarize.call_args.args[1]) == body["thread_id"]
+    # Not the request's session, which FastAPI would keep open until a background task ended
+    assert summarize.call_args.args[0] is sessions[0]
@@ -0,0 +1,80 @@
+import gzip
+import json
+from datetime import datetime
+
+from sqlalchemy import create_engine, func, select, text
+from sqlalchemy.orm import Session
+
+from app.archive import PromptArchiver, archivable_months, archive_path, read_archive
+from app.migrations import migrate
+from app.models import Prompt
+
+
+def _engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'archive.db'}")
+    migrate(engine)
+    return engine
+
+
+def _add(engine, *rows):
+    with Session(engine) as db:
+        db.add_all([
+            Prompt(user_id=user_id, query=query, casual_response=f"{query} answer", created_at=created_at)
+            for user_id, query, created_at in rows
+        ])
+        db.commit()
+
+
+def _archived_lines(path):
+    with gzip.open(path, "rt", encoding="utf-8") as archive:
+        return [json.loads(line) for line in archive]
+
+
+def test_archiver_moves_whole_old_months_to_compressed_jsonl(tmp_path):
+    engine = _engine(tmp_path)
+    _add(
+        engine,
+        ("u", "january walrus", datetime(2024, 1, 10)),
+        ("v", "january otter", datetime(2024, 1, 20)),
+        ("u", "february walrus", datetime(2024, 2, 20)),
+        ("u", "march walrus", datetime(2024, 3, 10)),
+    )
+    archiver = PromptArchiver(tmp_path / "archive", after_days=30)
+
+    # Cutoff 2024-02-14: only January is entirely older
+    assert archiver.run_once(now=datetime(2024, 3, 15), engine=engine) == [datetime(2024, 1, 1)]
+
+    lines = _archived_lines(archive_path(archiver.archive_dir, datetime(2024, 1, 1)))
+    assert [line["query"] for line in lines] == ["january walrus", "january otter"]
+    assert lines[0]["casual_response"] == "january walrus answer"
+    with engine.connect() as conn:
+        assert conn.scalar(select(func.count()).select_from(Prompt)) == 2
+        # Removed rows left the full-text index too
+        assert conn.scalar(text("SELECT count(*) FROM prompts_fts WHERE prompts_fts MATCH 'walrus'")) == 2
+        assert archivable_months(conn, datetime(2024, 2, 14)) == []
+    assert archiver.stats()["rows_archived"] == 2
+
+
+def test_rearchiving_a_month_merges_into_its_file(tmp_path):
+    engine = _engine(tmp_path)
+    archiver = PromptArchiver(tmp_path / "archive", after_days=1)
+    _add(engine, ("u", "first", datetime(2024, 1, 10)))
+    archiver.run_once(now=datetime(2024, 3, 1), engine=engine)
+    _add(engine, ("u", "late arrival", datetime(2024, 1, 11)))
+
+    archiver.run_once(now=datetime(2024, 3, 1), engine=engine)
+
+    lines = _archived_lines(archive_path(archiver.archive_dir, datetime(2024, 1, 1)))
+    assert [line["query"] for line in lines] == ["first", "late arrival"]
+
+
+def test_read_archive_pages_newest_first_across_files(tmp_path):
+    engine = _engine(tmp_path)
+    _add(engine, *[("u", f"q{month}-{day}", datetime(2024, month, day)) for month in (1, 2) for day in (5, 6)])
+    _add(engine, ("v", "someone else", datetime(2024, 2, 7)))
+    PromptArchiver(tmp_path / "archive", after_days=1).run_once(now=datetime(2024, 4, 1), engine=engine)
+
+    page = read_archive(tmp_path / "archive", "u", limit=3)
+    assert [record["query"] for record in page] == ["q2-6", "q2-5", "q1-6"]
+    rest = read_archive(tmp_path / "archive", "u", before=(page[-1]["created_at"], page[-1]["id"]), limit=3)
+    assert [record["query"] for record in rest] == ["q1-5"]
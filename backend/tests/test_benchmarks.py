@@ -0,0 +1,73 @@
+import asyncio
+import json
+
+import httpx
+from fastapi.testclient import TestClient
+from groq import AsyncGroq
+
+from benchmarks.compare import compare
+from benchmarks.fake_llm import FakeLLMConfig, create_app
+from benchmarks.loadgen import percentile, summarize
+
+
+def test_fake_llm_speaks_the_groq_protocol():
+    config = FakeLLMConfig(latency_ms=0, completion_tokens=5, seed=1)
+    transport = httpx.ASGITransport(app=create_app(config))
+
+    async def run():
+        async with httpx.AsyncClient(transport=transport) as http_client:
+            client = AsyncGroq(api_key="fake", base_url="http://fake-llm", http_client=http_client)
+            completion = await client.chat.completions.create(
+                messages=[{"role": "user", "content": "What is Python?"}], model="llama3-8b-8192"
+            )
+            stream = await client.chat.completions.create(
+                messages=[{"role": "user", "content": "What is Python?"}], model="llama3-8b-8192", stream=True
+            )
+            chunks = [chunk.choices[0].delta.content async for chunk in stream]
+            return completion, chunks
+
+    completion, chunks = asyncio.run(run())
+    assert len(completion.choices[0].message.content.split()) == 5
+    assert completion.usage.completion_tokens == 5
+    assert len(chunks) == 5
+
+
+def test_fake_llm_json_mode_returns_both_tones():
+    client = TestClient(create_app(FakeLLMConfig(latency_ms=0, completion_tokens=5, seed=1)))
+    response = client.post("/openai/v1/chat/completions", json={"messages": [], "response_format": {"type": "json_object"}})
+    content = json.loads(response.json()["choices"][0]["message"]["content"])
+    assert set(content) == {"casual", "formal"}
+    assert len(content["casual"].split()) == len(content["formal"].split()) == 5
+
+
+def test_fake_llm_injects_rate_limit_errors():
+    client = TestClient(create_app(FakeLLMConfig(latency_ms=0, error_rate=1.0, retry_after=2)))
+    response = client.post("/openai/v1/chat/completions", json={"messages": []})
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "2"
+
+
+def test_percentile_uses_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([3.0], 95) == 3.0
+    assert percentile([], 50) is None
+
+
+def test_summarize_reports_rps_and_error_rate():
+    samples = [(0.1, 200), (0.2, 200), (0.3, 500), (0.4, 200)]
+    stats = summarize(samples, elapsed=2.0)
+    assert stats["rps"] == 2.0
+    assert stats["error_rate"] == 0.25
+    assert stats["p50_ms"] == 200.0
+    assert stats["status_codes"] == {"200": 3, "500": 1}
+
+
+def test_compare_flags_latency_and_throughput_regressions():
+    old = {"endpoints": {"generate": {"p50_ms": 100, "p95_ms": 200, "p99_ms": 300, "rps": 50}}}
+    new = {"endpoints": {"generate": {"p50_ms": 105, "p95_ms": 260, "p99_ms": 300, "rps": 40}}}
+
+    _, regressions = compare(old, new, threshold=0.10)
+
+    assert {(endpoint, field) for endpoint, field, *_ in regressions} == {("generate", "p95_ms"), ("generate", "rps")}
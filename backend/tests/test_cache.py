@@ -0,0 +1,102 @@
+import asyncio
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.ai_service import AIService
+from app.cache import DatabaseCacheStore, ResponseCache, cache_key, normalize_query
+from app.models import CachedResponse
+
+
+def test_normalize_query_collapses_case_and_whitespace():
+    assert normalize_query("  What  is\nPython? ") == normalize_query("what is python?")
+
+
+def test_cache_key_depends_on_tone_model_and_temperature():
+    base = cache_key("What is Python?", "casual", "llama3-8b-8192", 0.7)
+    assert base == cache_key("what is   python?", "casual", "llama3-8b-8192", 0.7)
+    assert base != cache_key("What is Python?", "formal", "llama3-8b-8192", 0.7)
+    assert base != cache_key("What is Python?", "casual", "other-model", 0.7)
+    assert base != cache_key("What is Python?", "casual", "llama3-8b-8192", 0.3)
+
+
+def test_lru_evicts_least_recently_used():
+    cache = ResponseCache(max_entries=2, ttl_seconds=60)
+    cache.set("a", "A")
+    cache.set("b", "B")
+    assert cache.get("a") == "A"  # "b" is now the oldest
+    cache.set("c", "C")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "A"
+    assert cache.get("c") == "C"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entries_expire_after_ttl():
+    cache = ResponseCache(max_entries=10, ttl_seconds=0.05)
+    cache.set("a", "A")
+    assert cache.get("a") == "A"
+    time.sleep(0.06)
+    assert cache.get("a") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_persistent_tier_survives_a_fresh_memory_tier():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    CachedResponse.__table__.create(bind=engine)
+    store = DatabaseCacheStore(sessionmaker(bind=engine))
+
+    ResponseCache(store=store).set("k", "stored text")
+    cold = ResponseCache(store=store)
+
+    assert cold.get("k") == "stored text"
+    assert cold.stats()["persistent_hits"] == 1
+    # Promoted into memory, so the next lookup does not touch the store
+    assert cold._get_memory("k") == "stored text"
+
+
+@pytest.fixture
+def ai_service():
+    with patch("app.ai_service.Groq") as mock_groq, patch("app.ai_service.AsyncGroq") as mock_async_groq:
+        mock_groq.return_value = MagicMock()
+        async_client = MagicMock()
+        async_client.chat.completions.create = AsyncMock()
+        mock_async_groq.return_value = async_client
+        service = AIService()
+        service.warm_up()  # clients are lazy; build them while Groq is patched
+        service.cache = ResponseCache(max_entries=16, ttl_seconds=60)
+        return service
+
+
+def _completion(content):
+    completion = MagicMock()
+    completion.choices[0].message.content = content
+    return completion
+
+
+def test_repeated_query_is_served_from_cache(ai_service):
+    ai_service.client.chat.completions.create.return_value = _completion("A fun snake language!")
+
+    first = ai_service.generate_casual_response("What is Python?")
+    second = ai_service.generate_casual_response("what is  python?")
+
+    assert first == second == "A fun snake language!"
+    ai_service.client.chat.completions.create.assert_called_once()
+    assert ai_service.cache.stats()["hits"] == 1
+
+
+def test_use_cache_false_bypasses_lookup(ai_service):
+    create = ai_service.async_client.chat.completions.create
+    create.side_effect = [_completion("first"), _completion("second")]
+
+    assert asyncio.run(ai_service.generate_formal_response_async("q")) == "first"
+    assert asyncio.run(ai_service.generate_formal_response_async("q", use_cache=False)) == "second"
+    # The bypassed call refreshed the entry
+    assert asyncio.run(ai_service.generate_formal_response_async("q")) == "second"
+    assert create.call_count == 2
@@ -0,0 +1,143 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.conversation import ConversationManager
+from app.migrations import migrate
+from app.models import Prompt, Thread
+
+
+def turn(query, casual=None, formal=None):
+    return SimpleNamespace(query=query, casual_response=casual, formal_response=formal)
+
+
+def test_build_context_keeps_the_newest_turns_within_the_budget():
+    manager = ConversationManager(context_tokens=30)
+    turns = [turn(f"q{i}", casual="c" * 40, formal="f" * 40) for i in range(5)]
+
+    context = manager.build_context(None, turns, ["casual", "formal"])
+
+    # Each turn costs ~10 tokens, so only the newest three fit
+    assert [m["content"] for m in context["casual"] if m["role"] == "user"] == ["q2", "q3", "q4"]
+    assert context["casual"][1] == {"role": "assistant", "content": "c" * 40}
+    assert context["formal"][1] == {"role": "assistant", "content": "f" * 40}
+    assert manager.stats()["turns_trimmed"] == 2
+
+
+def test_build_context_starts_with_the_summary_and_falls_back_to_the_other_tone():
+    manager = ConversationManager(context_tokens=1000)
+
+    context = manager.build_context("They asked about snakes.", [turn("and lizards?", formal="Lizards are...")], ["casual"])
+
+    assert context["casual"] == [
+        {"role": "system", "content": "Summary of the conversation so far: They asked about snakes."},
+        {"role": "user", "content": "and lizards?"},
+        {"role": "assistant", "content": "Lizards are..."},
+    ]
+
+
+def test_maybe_summarize_folds_turns_beyond_the_window_in_batches(tmp_path):
+    path = tmp_path / "threads.db"
+    migrate(create_engine(f"sqlite:///{path}"))
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+    manager = ConversationManager(context_tokens=1000, window_turns=2, summarize_every=2)
+    calls = []
+
+    async def summarize(summary, turns):
+        calls.append((summary, [query for query, _ in turns]))
+        return f"summary of {len(turns)}"
+
+    async def scenario():
+        async with sessions() as db:
+            thread = Thread(user_id="u")
+            db.add(thread)
+            await db.commit()
+            start = datetime(2024, 1, 1)
+            for i in range(3):
+                db.add(Prompt(user_id="u", query=f"q{i}", formal_response=f"a{i}", thread_id=thread.id, created_at=start + timedelta(minutes=i)))
+            await db.commit()
+            # Three unsummarized turns: one past the window, but not yet a full batch
+            assert await manager.maybe_summarize(db, thread.id, summarize) == 0
+
+            db.add(Prompt(user_id="u", query="q3", formal_response="a3", thread_id=thread.id, created_at=start + timedelta(minutes=3)))
+            await db.commit()
+            assert await manager.maybe_summarize(db, thread.id, summarize) == 2
+            await db.refresh(thread)
+            context = await manager.context(db, thread, ["formal"])
+        await engine.dispose()
+        return thread, context
+
+    thread, context = asyncio.run(scenario())
+
+    assert calls == [(None, ["q0", "q1"])]
+    assert thread.summary == "summary of 2"
+    assert thread.summarized_turns == 2
+    assert [m["content"] for m in context["formal"]] == [
+        "Summary of the conversation so far: summary of 2", "q2", "a2", "q3", "a3",
+    ]
+    assert manager.stats()["summaries"] == 1
+
+
+def test_failed_summary_leaves_the_thread_unchanged(tmp_path):
+    path = tmp_path / "threads.db"
+    migrate(create_engine(f"sqlite:///{path}"))
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+    manager = ConversationManager(window_turns=1, summarize_every=1)
+
+    async def summarize(summary, turns):
+        raise RuntimeError("model unavailable")
+
+    async def scenario():
+        async with sessions() as db:
+            thread = Thread(user_id="u")
+            db.add(thread)
+            await db.commit()
+            for i in range(2):
+                db.add(Prompt(user_id="u", query=f"q{i}", casual_response="a", thread_id=thread.id, created_at=datetime(2024, 1, 1, 0, i)))
+            await db.commit()
+            folded = await manager.maybe_summarize(db, thread.id, summarize)
+            await db.refresh(thread)
+        await engine.dispose()
+        return folded, thread
+
+    folded, thread = asyncio.run(scenario())
+
+    assert folded == 0
+    assert thread.summary is None and thread.summarized_turns == 0
+    assert manager.stats()["summary_failures"] == 1
+
+
+def test_summarize_later_uses_its_own_session_and_shutdown_waits_for_it(tmp_path):
+    path = tmp_path / "threads.db"
+    migrate(create_engine(f"sqlite:///{path}"))
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+    manager = ConversationManager(window_turns=1, summarize_every=1, session_factory=sessions)
+
+    async def summarize(summary, turns):
+        await asyncio.sleep(0.01)
+        return "folded"
+
+    async def scenario():
+        async with sessions() as db:
+            thread = Thread(user_id="u")
+            db.add(thread)
+            await db.commit()
+            for i in range(2):
+                db.add(Prompt(user_id="u", query=f"q{i}", casual_response="a", thread_id=thread.id, created_at=datetime(2024, 1, 1, 0, i)))
+            await db.commit()
+        manager.summarize_later(thread.id, summarize)
+        await manager.shutdown()
+        async with sessions() as db:
+            thread = await db.get(Thread, thread.id)
+        await engine.dispose()
+        return thread
+
+    thread = asyncio.run(scenario())
+
+    assert thread.summary == "folded" and thread.summarized_turns == 1
@@ -0,0 +1,107 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from app import database
+from app.database import ReadOnlySession, ReadRouter, get_read_db, pool_options, to_async_url
+from app.migrations import migrate
+from app.models import Prompt
+
+
+def test_to_async_url_swaps_in_async_drivers():
+    assert to_async_url("postgresql://u:p@db:5432/ai") == "postgresql+asyncpg://u:p@db:5432/ai"
+    assert to_async_url("postgresql+psycopg2://u:p@db/ai") == "postgresql+asyncpg://u:p@db/ai"
+    assert to_async_url("sqlite:///./test.db") == "sqlite+aiosqlite:///./test.db"
+    # Already async: left alone
+    assert to_async_url("postgresql+asyncpg://u:p@db/ai") == "postgresql+asyncpg://u:p@db/ai"
+
+
+def test_pool_options_read_from_environment():
+    env = {
+        "DB_POOL_SIZE": "3",
+        "DB_MAX_OVERFLOW": "7",
+        "DB_POOL_PRE_PING": "false",
+        "DB_POOL_RECYCLE": "60",
+        "DB_POOL_TIMEOUT": "2.5",
+    }
+    with patch.dict("os.environ", env):
+        options = pool_options("postgresql://u:p@db/ai")
+
+    assert options == {
+        "pool_pre_ping": False,
+        "pool_size": 3,
+        "max_overflow": 7,
+        "pool_timeout": 2.5,
+        "pool_recycle": 60,
+    }
+
+
+def test_pool_options_skip_sizing_for_sqlite():
+    assert set(pool_options("sqlite:///:memory:")) == {"pool_pre_ping"}
+
+
+def test_read_router_keeps_recent_writers_on_the_primary():
+    now = [100.0]
+    router = ReadRouter(window=5, clock=lambda: now[0])
+
+    router.record_write("alice")
+    assert not router.use_replica("alice")
+    assert router.use_replica("bob")
+    assert router.use_replica(None)
+
+    now[0] += 5
+    assert router.use_replica("alice")
+    assert router.stats()["recent_writers"] == 0
+    assert (router.stats()["primary_reads"], router.stats()["replica_reads"]) == (1, 3)
+
+
+def test_get_read_db_reads_the_replica_except_right_after_a_write(tmp_path, monkeypatch):
+    primary_path, replica_path = tmp_path / "primary.db", tmp_path / "replica.db"
+    for path in (primary_path, replica_path):
+        migrate(create_engine(f"sqlite:///{path}"))
+    # Fresh globals, so the app's own engines are left alone
+    monkeypatch.setattr(database, "engine", None)
+    monkeypatch.setattr(database, "async_engine", None)
+    monkeypatch.setattr(database, "read_async_engine", None)
+    monkeypatch.setattr(database, "SessionLocal", sessionmaker())
+    monkeypatch.setattr(database, "AsyncSessionLocal", async_sessionmaker(class_=AsyncSession))
+    monkeypatch.setattr(database, "read_router", ReadRouter(window=60))
+    database.init_engines(f"sqlite:///{primary_path}", read_url=f"sqlite:///{replica_path}")
+
+    async def count_prompts(user_id):
+        dependency = get_read_db(user_id)
+        db = await dependency.__anext__()
+        try:
+            return await db.scalar(select(func.count()).select_from(Prompt))
+        finally:
+            await dependency.aclose()
+
+    async def scenario():
+        # A write the replica has not caught up with yet
+        async with database.AsyncSessionLocal() as db:
+            db.add(Prompt(user_id="alice", query="fresh"))
+            await db.commit()
+        counts = [await count_prompts("alice")]
+        database.read_router.record_write("alice")
+        counts += [await count_prompts("alice"), await count_prompts("bob")]
+        await database.dispose_engines()
+        return counts
+
+    assert asyncio.run(scenario()) == [0, 1, 0]
+    assert database.read_router.stats()["replica_configured"]
+
+
+def test_read_only_session_refuses_to_flush(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'read.db'}")
+    migrate(engine)
+
+    with ReadOnlySession(engine) as db:
+        assert db.scalar(select(func.count()).select_from(Prompt)) == 0
+        db.add(Prompt(user_id="u", query="q"))
+        with pytest.raises(InvalidRequestError):
+            db.flush()
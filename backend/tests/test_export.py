@@ -0,0 +1,34 @@
+import io
+import json
+from datetime import datetime
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app import export
+from app.migrations import migrate
+from app.models import Prompt
+
+
+def test_write_export_streams_in_chunks(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'export.db'}")
+    migrate(engine)
+    with Session(engine) as db:
+        db.add_all([
+            Prompt(user_id="u" if i % 2 else "v", query=f"q{i}", casual_response="same answer", created_at=datetime(2024, 1, 1, 0, i))
+            for i in range(25)
+        ])
+        db.commit()
+    monkeypatch.setattr(export, "EXPORT_CHUNK_SIZE", 4)
+    chunks = []
+    monkeypatch.setattr(export, "encode_chunk", lambda rows, fmt, encode=export.encode_chunk: chunks.append(len(rows)) or encode(rows, fmt))
+
+    out = io.StringIO()
+    with engine.connect() as conn:
+        count = export.write_export(conn, out, user_id="u")
+
+    assert count == 12
+    assert chunks == [4, 4, 4]
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [record["query"] for record in records] == [f"q{i}" for i in range(1, 25, 2)]
+    assert {record["casual_response"] for record in records} == {"same answer"}
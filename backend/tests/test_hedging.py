@@ -0,0 +1,150 @@
+import asyncio
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from app.ai_service import AIService
+from app.hedging import Hedger
+from app.model_routing import ModelRouter
+from app.rate_limit import LLMScheduler
+
+
+def _warm(hedger, key, seconds, count):
+    for _ in range(count):
+        hedger._record(key, seconds)
+
+
+def test_hedger_fires_backup_after_the_percentile_deadline():
+    hedger = Hedger(enabled=True, percentile=95, min_samples=5)
+    _warm(hedger, "m", 0.02, 5)
+    delays = iter([1.0, 0.01])  # primary stalls, backup is fast
+
+    async def call():
+        delay = next(delays)
+        await asyncio.sleep(delay)
+        return delay
+
+    start = time.perf_counter()
+    assert asyncio.run(hedger.run("m", call)) == 0.01
+    assert time.perf_counter() - start < 0.5
+    assert hedger.stats()["hedges_fired"] == 1
+    assert hedger.stats()["hedges_won"] == 1
+    # The cancelled primary still counts, with the time it had run
+    assert max(hedger._latencies["m"]) >= 0.02
+
+
+def test_hedger_waits_for_the_backup_when_the_primary_fails():
+    hedger = Hedger(enabled=True, min_samples=1)
+    _warm(hedger, "m", 0.01, 1)
+    attempts = []
+
+    async def call():
+        attempts.append(1)
+        if len(attempts) == 1:
+            await asyncio.sleep(0.05)
+            raise RuntimeError("primary failed")
+        await asyncio.sleep(0.1)
+        return "backup"
+
+    assert asyncio.run(hedger.run("m", call)) == "backup"
+    assert hedger.stats()["hedges_won"] == 1
+
+
+def test_hedger_does_not_hedge_without_enough_samples():
+    hedger = Hedger(enabled=True, min_samples=20)
+    _warm(hedger, "m", 0.01, 19)
+
+    async def call():
+        await asyncio.sleep(0.05)
+        return "only"
+
+    assert asyncio.run(hedger.run("m", call)) == "only"
+    assert hedger.stats()["hedges_fired"] == 0
+    with pytest.raises(RuntimeError):
+        asyncio.run(Hedger(enabled=True).run("m", AsyncMock(side_effect=RuntimeError("boom"))))
+
+
+def test_ai_service_routes_and_hedges_completions():
+    with patch("app.ai_service.Groq"), patch("app.ai_service.AsyncGroq"):
+        service = AIService()
+    service.router = ModelRouter("small", "large", thresholds={"casual": 1000, "formal": 1})
+    service.hedger = Hedger(enabled=True, min_samples=1)
+    service.hedger._record("large", 0.01)
+    service.async_client = MagicMock()
+    calls = []
+
+    async def create(**kwargs):
+        calls.append(kwargs["model"])
+        if len(calls) == 1:
+            await asyncio.sleep(1)
+        completion = MagicMock()
+        completion.choices[0].message.content = f"answer from {kwargs['model']}"
+        return completion
+
+    service.async_client.chat.completions.create = create
+
+    result = asyncio.run(service.generate_formal_response_async("Explain the CAP theorem.", use_cache=False))
+
+    assert result == "answer from large"
+    assert calls == ["large", "large"]
+    assert service.hedger.stats()["hedges_won"] == 1
+
+
+def _service_with_hedger(create):
+    with patch("app.ai_service.Groq"), patch("app.ai_service.AsyncGroq"):
+        service = AIService()
+    service.hedger = Hedger(enabled=True, min_samples=1)
+    service.hedger._record(service.model, 0.01)
+    service.async_client = MagicMock()
+    service.async_client.chat.completions.create = create
+    return service
+
+
+def test_no_hedges_while_the_rate_limiter_is_queueing():
+    calls = []
+
+    async def create(**kwargs):
+        calls.append(1)
+        await asyncio.sleep(0.03)  # past the 0.01s deadline every time
+        completion = MagicMock()
+        completion.usage = None
+        return completion
+
+    service = _service_with_hedger(create)
+    service.scheduler = LLMScheduler(requests_per_minute=600, tokens_per_minute=0)
+    service.scheduler.request_bucket.tokens = 0  # drained: one request every 0.1s
+
+    async def scenario():
+        messages = [{"role": "user", "content": "q"}]
+        await asyncio.gather(*(service._create_completion(messages, 0.7) for _ in range(4)))
+
+    asyncio.run(scenario())
+
+    assert len(calls) == 4
+    assert service.hedger.stats()["hedges_fired"] == 0
+    assert service.scheduler.stats()["hedges_denied"] >= 1
+    # Only the provider call is timed, never the wait for a request token
+    assert max(service.hedger._latencies[service.model]) < 0.09
+
+
+def test_hedges_take_spare_rate_limit_budget():
+    calls = []
+
+    async def create(**kwargs):
+        calls.append(1)
+        if len(calls) == 1:
+            await asyncio.sleep(1)
+        completion = MagicMock()
+        completion.usage = None
+        return completion
+
+    service = _service_with_hedger(create)
+    service.scheduler = LLMScheduler(requests_per_minute=600, tokens_per_minute=0)
+    before = service.scheduler.request_bucket.tokens
+
+    asyncio.run(service._create_completion([{"role": "user", "content": "q"}], 0.7))
+
+    assert len(calls) == 2
+    assert service.scheduler.stats()["hedges_allowed"] == 1
+    assert service.scheduler.request_bucket.tokens < before - 1.5  # the backup paid for its request
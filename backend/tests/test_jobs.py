@@ -0,0 +1,81 @@
+import asyncio
+
+from app.ai_service import PartialGenerationError
+from app.jobs import BatchJobManager
+
+
+class FakeAIService:
+    def __init__(self, delay=0.02):
+        self.delay = delay
+        self.active = 0
+        self.peak = 0
+
+    async def generate_responses_async(self, query, use_cache=True, tones=None):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+            if query == "boom":
+                raise PartialGenerationError(
+                    {"casual_response": "half", "formal_response": None},
+                    {"formal_response": RuntimeError("nope")},
+                )
+            return {f"{tone}_response": f"{tone}: {query}" for tone in sorted(tones)}
+        finally:
+            self.active -= 1
+
+
+class FakeSession:
+    def __init__(self, stored):
+        self.stored = stored
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def add(self, prompt):
+        self.stored.append(prompt)
+
+    async def commit(self):
+        pass
+
+
+def test_batch_job_respects_concurrency_and_records_results():
+    ai_service = FakeAIService()
+    stored = []
+    manager = BatchJobManager(ai_service, lambda: FakeSession(stored), concurrency=3)
+    queries = [f"q{i}" for i in range(10)] + ["boom"]
+
+    async def scenario():
+        job = manager.submit("batch_user", queries, {"casual"})
+        assert job.counts()["pending"] == 11
+        while job.status != "completed":
+            await asyncio.sleep(0.01)
+        return job
+
+    job = asyncio.run(scenario())
+
+    assert ai_service.peak == 3
+    assert job.counts() == {"pending": 0, "running": 0, "completed": 10, "failed": 1}
+    assert job.items[0].responses == {"casual_response": "casual: q0"}
+    assert job.items[-1].status == "failed"
+    assert job.items[-1].responses["casual_response"] == "half"
+    # Only successful items were persisted, one row each
+    assert sorted(prompt.query for prompt in stored) == sorted(queries[:-1])
+    assert {prompt.user_id for prompt in stored} == {"batch_user"}
+
+
+def test_shutdown_cancels_running_jobs():
+    manager = BatchJobManager(FakeAIService(delay=10), lambda: FakeSession([]), concurrency=1)
+
+    async def scenario():
+        job = manager.submit("u", ["slow", "slower"], {"formal"})
+        await asyncio.sleep(0.01)
+        await manager.shutdown()
+        return job
+
+    job = asyncio.run(scenario())
+    assert job.status == "cancelled"
+    assert job.finished_at is not None
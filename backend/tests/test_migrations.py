@@ -0,0 +1,96 @@
+from types import SimpleNamespace
+
+from sqlalchemy import create_engine, inspect, select, text
+from sqlalchemy.orm import Session
+
+from app import migrations
+from app.migrations import MIGRATIONS, migrate, partition_prompts, pending_migrations
+from app.models import Prompt, search_user_token
+from app.storage import storage_report
+
+
+def test_migrate_creates_schema_once(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+
+    assert migrate(engine) == [name for name, _ in MIGRATIONS]
+    assert migrate(engine) == []
+    assert pending_migrations(engine) == []
+    tables = set(inspect(engine).get_table_names())
+    assert {"prompts", "response_blobs", "response_cache", "prompts_fts", "schema_migrations"} <= tables
+
+
+def test_migrate_upgrades_a_legacy_database(tmp_path):
+    # Shape of a database created by the old import-time create_all: no indexes, no FTS
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE prompts (id CHAR(32) PRIMARY KEY, user_id VARCHAR NOT NULL, query TEXT NOT NULL, "
+            "casual_response TEXT, formal_response TEXT, created_at DATETIME)"
+        ))
+        conn.execute(text(
+            "INSERT INTO prompts VALUES ('0123456789abcdef0123456789abcdef', 'u', 'What is Python?', 'a snake', NULL, '2024-01-01')"
+        ))
+        conn.execute(text(
+            "INSERT INTO prompts VALUES ('fedcba9876543210fedcba9876543210', 'v', 'Define python', 'a snake', 'A reptile.', '2024-01-02')"
+        ))
+
+    migrate(engine)
+
+    indexes = {ix["name"] for ix in inspect(engine).get_indexes("prompts")}
+    assert "ix_prompts_user_id_created_at_id" in indexes
+    assert "ix_prompts_user_id_created_at" not in indexes
+    with engine.connect() as conn:
+        # Existing rows were indexed for search
+        assert conn.scalar(text("SELECT count(*) FROM prompts_fts WHERE prompts_fts MATCH 'python'")) == 2
+        assert conn.scalar(text("SELECT count(*) FROM prompts_fts WHERE prompts_fts MATCH 'reptile'")) == 1
+        # 0009 rebuilt the index with each row's owner, so a search narrows to one user in FTS5 itself
+        match = f'user_id : "{search_user_token("v")}" AND "python"'
+        assert conn.scalar(text("SELECT count(*) FROM prompts_fts WHERE prompts_fts MATCH :m"), {"m": match}) == 1
+        report = storage_report(conn)
+
+    # Response text moved out of prompts, deduplicated, and still reads back the same
+    assert "casual_response" not in {column["name"] for column in inspect(engine).get_columns("prompts")}
+    assert (report["responses"], report["unique_responses"]) == (3, 2)
+    with Session(engine) as db:
+        prompts = {p.query: p for p in db.scalars(select(Prompt)).unique()}
+    assert prompts["What is Python?"].casual_response == "a snake"
+    assert prompts["What is Python?"].formal_response is None
+    assert prompts["Define python"].formal_response == "A reptile."
+
+
+def test_migrate_in_stages_adds_threads_last(tmp_path, monkeypatch):
+    # A database migrated through 0005 before threads existed, then upgraded
+    engine = create_engine(f"sqlite:///{tmp_path / 'staged.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE prompts (id CHAR(32) PRIMARY KEY, user_id VARCHAR NOT NULL, query TEXT NOT NULL, "
+            "casual_response TEXT, formal_response TEXT, created_at DATETIME)"
+        ))
+    monkeypatch.setattr(migrations, "MIGRATIONS", MIGRATIONS[:5])
+    migrate(engine)
+    assert "thread_id" not in {column["name"] for column in inspect(engine).get_columns("prompts")}
+
+    monkeypatch.setattr(migrations, "MIGRATIONS", MIGRATIONS)
+    assert migrate(engine) == [name for name, _ in MIGRATIONS[5:]]
+    assert "thread_id" in {column["name"] for column in inspect(engine).get_columns("prompts")}
+    assert "ix_prompts_thread_id_created_at" in {ix["name"] for ix in inspect(engine).get_indexes("prompts")}
+    assert inspect(engine).has_table("threads")
+
+
+def test_partition_prompts_does_not_depend_on_later_tables():
+    statements = []
+
+    class RecordingConnection:
+        dialect = SimpleNamespace(name="postgresql")
+
+        def execute(self, statement, *args):
+            statements.append(str(statement))
+
+        def scalar(self, statement):
+            return "r" if "relkind" in str(statement) else None  # a plain, empty prompts table
+
+    partition_prompts(RecordingConnection())
+
+    created = next(statement for statement in statements if statement.startswith("CREATE TABLE prompts ("))
+    assert "PARTITION BY RANGE (created_at)" in created
+    assert not any("threads" in statement or "thread_id" in statement for statement in statements)
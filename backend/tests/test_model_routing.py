@@ -0,0 +1,27 @@
+from app.model_routing import ModelRouter
+
+
+def test_router_sends_long_or_formal_queries_to_the_large_model():
+    router = ModelRouter("small", "large", thresholds={"casual": 100, "formal": 10})
+
+    assert router.model_for("What is Python?", "casual") == "small"
+    assert router.model_for("x" * 400, "casual") == "large"
+    assert router.model_for("x" * 40, "formal") == "large"
+    # One completion for both tones uses the large model if either tone needs it
+    assert router.model_for("x" * 40, "casual", "formal") == "large"
+
+
+def test_router_counts_only_recorded_requests():
+    router = ModelRouter("small", "large", thresholds={"formal": 10})
+
+    router.model_for("x" * 40, "formal")  # e.g. to build a cache key that then hits
+    router.record(router.model_for("x" * 40, "formal"))
+    router.record(router.model_for("short", "formal"))
+
+    assert router.stats()["small_routed"] == 1
+    assert router.stats()["large_routed"] == 1
+
+
+def test_router_without_large_model_always_uses_the_default():
+    router = ModelRouter("small")
+    assert router.model_for("x" * 10_000, "formal") == "small"
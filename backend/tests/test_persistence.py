@@ -0,0 +1,118 @@
+import asyncio
+
+from app.persistence import PromptWriter
+
+
+class FakeSession:
+    def __init__(self, batches, delay=0, failures=None):
+        self.batches = batches
+        self.delay = delay
+        self.failures = failures  # commits left to fail, shared across sessions
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def add_all(self, rows):
+        self.batches.append([row.query for row in rows])
+
+    async def commit(self):
+        await asyncio.sleep(self.delay)
+        if self.failures and self.failures[0] > 0:
+            self.failures[0] -= 1
+            self.batches.pop()
+            raise ConnectionError("database went away")
+
+
+def make_writer(batches, **kwargs):
+    return PromptWriter(lambda: FakeSession(batches), enabled=True, **kwargs)
+
+
+def test_flushes_full_batches_by_size():
+    batches = []
+    writer = make_writer(batches, batch_size=3, flush_interval=10)
+
+    async def scenario():
+        await writer.start()
+        for i in range(7):
+            await writer.enqueue("u", f"q{i}", "c", "f")
+        await writer.stop()
+
+    asyncio.run(scenario())
+
+    assert batches == [["q0", "q1", "q2"], ["q3", "q4", "q5"], ["q6"]]
+    stats = writer.stats()
+    assert stats["rows_written"] == 7
+    assert stats["batches_flushed"] == 3
+    assert stats["max_batch_size"] == 3
+    assert stats["queue_depth"] == 0
+
+
+def test_flushes_partial_batch_after_interval():
+    batches = []
+    writer = make_writer(batches, batch_size=100, flush_interval=0.05)
+
+    async def scenario():
+        await writer.start()
+        await writer.enqueue("u", "lonely", "c", "f")
+        await asyncio.sleep(0.2)
+        flushed_before_stop = list(batches)
+        await writer.stop()
+        return flushed_before_stop
+
+    assert asyncio.run(scenario()) == [["lonely"]]
+
+
+def test_stop_drains_queue_and_disabled_writer_never_starts():
+    batches = []
+    writer = make_writer(batches, batch_size=2, flush_interval=10, max_queue=4)
+
+    async def scenario():
+        await writer.start()
+        await asyncio.gather(*(writer.enqueue("u", f"q{i}", "c", "f") for i in range(10)))
+        await writer.stop()
+
+    asyncio.run(scenario())
+    assert sum(len(batch) for batch in batches) == 10
+    assert not writer.running
+
+    disabled = PromptWriter(lambda: FakeSession([]), enabled=False)
+    asyncio.run(disabled.start())
+    assert not disabled.running
+
+
+def test_failed_flush_is_retried_before_rows_are_dropped():
+    batches = []
+    failures = [2]
+    writer = PromptWriter(
+        lambda: FakeSession(batches, failures=failures), enabled=True, batch_size=2, flush_interval=10, retry_delay=0.01
+    )
+
+    async def scenario():
+        await writer.start()
+        for i in range(2):
+            await writer.enqueue("u", f"q{i}", "c", "f")
+        await writer.stop()
+
+    asyncio.run(scenario())
+
+    # Two transient failures, then the same batch commits
+    assert batches == [["q0", "q1"]]
+    assert (writer.stats()["rows_written"], writer.stats()["rows_failed"], writer.stats()["flush_retries"]) == (2, 0, 2)
+
+    failures[0] = 10
+    batches.clear()
+    giving_up = PromptWriter(
+        lambda: FakeSession(batches, failures=failures), enabled=True, max_retries=2, retry_delay=0.01
+    )
+
+    async def drain():
+        await giving_up.start()
+        await giving_up.enqueue("u", "lost", "c", "f")
+        await giving_up.stop()
+
+    asyncio.run(drain())
+    assert batches == []
+    assert (giving_up.stats()["rows_failed"], giving_up.stats()["flush_retries"]) == (1, 2)
@@ -0,0 +1,49 @@
+import logging
+import marshal
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+
+from app.database import log_slow_queries
+from app.main import app
+from app.profiling import profile_store
+
+
+def test_profiled_request_can_be_downloaded(monkeypatch):
+    monkeypatch.setattr(profile_store, "enabled", True)
+    monkeypatch.setattr(profile_store, "token", "secret")
+    client = TestClient(app)
+
+    assert "X-Profile-Id" not in client.get("/").headers
+    assert "X-Profile-Id" not in client.get("/", headers={"X-Profile": "wrong"}).headers
+    response = client.get("/", headers={"X-Profile": "secret"})
+    profile_id = response.headers["X-Profile-Id"]
+
+    assert client.get("/debug/profiles").status_code == 403
+    listing = client.get("/debug/profiles", headers={"X-Profile": "secret"}).json()
+    assert listing[0]["id"] == profile_id
+    assert (listing[0]["path"], listing[0]["status"]) == ("/", 200)
+    download = client.get(f"/debug/profiles/{profile_id}", headers={"X-Profile": "secret"})
+    assert isinstance(marshal.loads(download.content), dict)  # the pstats .prof format
+    report = client.get(f"/debug/profiles/{profile_id}?format=text&limit=5", headers={"X-Profile": "secret"})
+    assert "function calls" in report.text
+
+
+def test_profiling_endpoints_are_hidden_when_disabled(monkeypatch):
+    monkeypatch.setattr(profile_store, "enabled", False)
+    client = TestClient(app)
+    assert "X-Profile-Id" not in client.get("/", headers={"X-Profile": "1"}).headers
+    assert client.get("/debug/profiles").status_code == 404
+
+
+def test_slow_queries_are_logged_with_parameters(caplog):
+    engine = create_engine("sqlite:///:memory:")
+    log_slow_queries(engine, threshold=1e-9)
+
+    with caplog.at_level(logging.WARNING, logger="app.database"), engine.connect() as conn:
+        conn.execute(text("SELECT :word || 'x'"), {"word": "a" * 500})
+
+    record = next(r for r in caplog.records if "Slow query" in r.getMessage())
+    message = record.getMessage()
+    assert "SELECT ? || 'x'" in message
+    assert "aaa" in message and "a" * 300 not in message  # long parameters are truncated
@@ -0,0 +1,134 @@
+import asyncio
+import email.utils
+import time
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+from groq import BadRequestError, RateLimitError
+
+from app.rate_limit import (
+    AdaptiveConcurrencyLimiter, LLMScheduler, TokenBucket, estimate_text_tokens, estimate_tokens, retry_after_seconds,
+)
+
+
+def _error(cls, status, headers=None):
+    response = httpx.Response(status, headers=headers or {}, request=httpx.Request("POST", "https://api.groq.com"))
+    return cls("provider said no", response=response, body=None)
+
+
+def test_retry_after_seconds_reads_provider_headers():
+    assert retry_after_seconds(_error(RateLimitError, 429, {"retry-after": "2"})) == 2.0
+    assert retry_after_seconds(_error(RateLimitError, 429, {"retry-after-ms": "250"})) == 0.25
+    assert retry_after_seconds(_error(RateLimitError, 429)) is None
+
+
+def test_retry_after_seconds_handles_http_dates():
+    future = email.utils.format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    assert 25 < retry_after_seconds(_error(RateLimitError, 429, {"retry-after": future})) <= 30
+    past = email.utils.format_datetime(datetime.now(timezone.utc) - timedelta(seconds=30), usegmt=True)
+    assert retry_after_seconds(_error(RateLimitError, 429, {"retry-after": past})) == 0.0
+    # Malformed: no hint, rather than an exception that turns a retryable 429 into a failure
+    assert retry_after_seconds(_error(RateLimitError, 429, {"retry-after": "soon"})) is None
+
+
+def test_scheduler_backs_off_on_a_malformed_retry_after():
+    scheduler = LLMScheduler(requests_per_minute=0, tokens_per_minute=0, max_retries=2, base_delay=0.001)
+    attempts = []
+
+    async def call():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise _error(RateLimitError, 429, {"retry-after": "soon"})
+        return "ok"
+
+    assert asyncio.run(scheduler.run(call)) == "ok"
+    assert scheduler.stats()["retries"] == 1
+
+
+def test_token_estimates_share_one_text_estimator():
+    assert estimate_text_tokens("x" * 41) == 10
+    assert estimate_text_tokens(None) == 0
+    messages = [{"role": "system", "content": "x" * 40}, {"role": "user", "content": "y" * 80}]
+    assert estimate_tokens(messages, completion_tokens=5) == 35
+
+
+def test_token_bucket_throttles_beyond_capacity():
+    bucket = TokenBucket(per_minute=600)  # 10 per second, burst of 600
+    bucket.tokens = 1
+
+    async def scenario():
+        start = time.perf_counter()
+        await bucket.acquire(1)
+        await bucket.acquire(1)  # must wait ~0.1s for a refill
+        return time.perf_counter() - start
+
+    assert 0.08 <= asyncio.run(scenario()) < 0.5
+
+
+def test_adaptive_limiter_halves_on_throttle_and_grows_back():
+    limiter = AdaptiveConcurrencyLimiter(initial=8, maximum=8)
+    limiter.on_throttle()
+    assert limiter.limit == 4
+    for _ in range(4):
+        limiter.on_success()
+    assert limiter.limit == 5
+
+
+def test_scheduler_retries_429_after_retry_after():
+    scheduler = LLMScheduler(requests_per_minute=0, tokens_per_minute=0, max_retries=3)
+    attempts = []
+
+    async def call():
+        attempts.append(time.perf_counter())
+        if len(attempts) < 3:
+            raise _error(RateLimitError, 429, {"retry-after": "0.05"})
+        return "ok"
+
+    assert asyncio.run(scheduler.run(call)) == "ok"
+    assert len(attempts) == 3
+    assert attempts[1] - attempts[0] >= 0.045
+    stats = scheduler.stats()
+    assert stats["throttled_calls"] == 2
+    assert stats["retries"] == 2
+    assert stats["concurrency_limit"] == 2  # 8 -> 4 -> 2
+
+
+def test_scheduler_gives_up_after_max_retries_and_skips_non_retryable():
+    scheduler = LLMScheduler(requests_per_minute=0, tokens_per_minute=0, max_retries=1, base_delay=0.001)
+
+    async def throttled():
+        raise _error(RateLimitError, 429)
+
+    with pytest.raises(RateLimitError):
+        asyncio.run(scheduler.run(throttled))
+    assert scheduler.stats()["failures"] == 1
+
+    calls = []
+
+    async def bad_request():
+        calls.append(1)
+        raise _error(BadRequestError, 400)
+
+    with pytest.raises(BadRequestError):
+        asyncio.run(scheduler.run(bad_request))
+    assert calls == [1]
+
+
+def test_scheduler_caps_in_flight_calls():
+    scheduler = LLMScheduler(requests_per_minute=0, tokens_per_minute=0, max_concurrency=2)
+    active = []
+    peak = []
+
+    async def call():
+        active.append(1)
+        peak.append(len(active))
+        await asyncio.sleep(0.02)
+        active.pop()
+
+    async def scenario():
+        await asyncio.gather(*(scheduler.run(call) for _ in range(6)))
+
+    asyncio.run(scenario())
+    assert max(peak) == 2
+    assert scheduler.stats()["queue_wait_seconds_max"] > 0
@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+from app.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    executions = []
+
+    async def work():
+        executions.append(1)
+        await asyncio.sleep(0.02)
+        return "shared"
+
+    async def scenario():
+        return await asyncio.gather(*(flight.do("k", work) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == ["shared"] * 5
+    assert executions == [1]
+    assert flight.stats() == {
+        "calls": 5,
+        "executions": 1,
+        "coalesced": 4,
+        "coalesce_rate": 0.8,
+        "in_flight": 0,
+    }
+
+
+def test_different_keys_and_later_calls_run_separately():
+    flight = SingleFlight()
+
+    async def work(value):
+        await asyncio.sleep(0.01)
+        return value
+
+    async def scenario():
+        first = await asyncio.gather(flight.do("a", lambda: work("A")), flight.do("b", lambda: work("B")))
+        # The earlier flight for "a" has landed, so this starts a new one
+        second = await flight.do("a", lambda: work("A again"))
+        return first, second
+
+    assert asyncio.run(scenario()) == (["A", "B"], "A again")
+    assert flight.stats()["executions"] == 3
+
+
+def test_errors_reach_every_waiter_and_leader_cancellation_does_not_cancel_followers():
+    flight = SingleFlight()
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    async def failing_scenario():
+        return await asyncio.gather(flight.do("k", failing), flight.do("k", failing), return_exceptions=True)
+
+    results = asyncio.run(failing_scenario())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+    async def slow():
+        await asyncio.sleep(0.03)
+        return "survived"
+
+    async def cancel_scenario():
+        leader = asyncio.create_task(flight.do("slow", slow))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do("slow", slow))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(cancel_scenario()) == "survived"
@@ -0,0 +1,40 @@
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+
+from app.migrations import migrate
+from app.models import Prompt, ResponseBlob
+from app.storage import compress, content_hash, decompress, storage_report
+
+
+def test_compress_round_trips_text():
+    text = "Ünïcode résumé " * 50
+    assert decompress(compress(text)) == text
+    assert len(compress(text)) < len(text.encode())
+    assert content_hash(text) == content_hash(text) != content_hash(text + " ")
+
+
+def test_identical_responses_are_stored_once(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'blobs.db'}")
+    migrate(engine)
+    Session = sessionmaker(engine, expire_on_commit=False)
+    answer = "Python is a programming language. " * 100
+
+    with Session() as db:
+        db.add_all([Prompt(user_id="u", query="What is Python?", casual_response=answer, formal_response=answer) for _ in range(3)])
+        db.commit()
+    with Session() as db:
+        db.add(Prompt(user_id="u", query="What is Python?", casual_response=answer, formal_response=None))
+        db.commit()
+
+    with Session() as db:
+        assert db.scalar(select(func.count()).select_from(ResponseBlob)) == 1
+        prompts = db.scalars(select(Prompt)).unique().all()
+        assert {p.casual_response for p in prompts} == {answer}
+        assert sorted(p.formal_response is None for p in prompts) == [False, False, False, True]
+
+    with engine.connect() as conn:
+        report = storage_report(conn)
+    assert report["responses"] == 7
+    assert report["unique_responses"] == 1
+    assert report["logical_bytes"] == 7 * len(answer)
+    assert report["saved_bytes"] > 6 * len(answer)
@@ -1,11 +1,12 @@
 # Add content to frontend/app.py
 import streamlit as st
-import requests
 import os
 import json
 from datetime import datetime
 from dotenv import load_dotenv
 
+from utils import fetch_history_item, load_older_history, stream_api, sync_history
+
 load_dotenv()
 
 # API endpoint
@@ -25,26 +26,45 @@ with st.sidebar:
     user_id = st.text_input("Enter User ID", value="user123")
     
     st.header("History")
+    # Only rows newer than the cached ones are fetched, so refreshing stays cheap
     if st.button("Refresh History"):
         try:
-            response = requests.get(f"{API_URL}/history?user_id={user_id}")
-            if response.status_code == 200:
-                st.session_state.history = response.json()
-            else:
-                st.error(f"Error fetching history: {response.status_code}")
+            st.session_state.history = sync_history(f"{API_URL}/history", user_id, st.session_state.get("history"))
         except Exception as e:
-            st.error(f"Error: {str(e)}")
+            st.error(f"Error fetching history: {str(e)}")
     
     # Display history if available
-    if "history" in st.session_state:
-        for item in st.session_state.history:
-            with st.expander(f"{item['query'][:30]}... ({item['created_at'][:10]})"):
+    history = st.session_state.get("history")
+    if history and history["user_id"] == user_id:
+        details = st.session_state.setdefault("history_details", {})
+        for item in history["items"]:
+            with st.expander(f"{item['query_preview'][:30]}... ({item['created_at'][:10]})"):
+                # The list holds summaries only; full text is fetched once per entry, on request
+                detail = details.get(item["id"])
+                if detail is None:
+                    st.write(item["query_preview"])
+                    st.button(
+                        "Show responses",
+                        key=f"detail-{item['id']}",
+                        on_click=lambda prompt_id=item["id"]: details.__setitem__(
+                            prompt_id, fetch_history_item(f"{API_URL}/history", prompt_id, user_id)
+                        ),
+                    )
+                    continue
                 st.write("**Query:**")
-                st.write(item["query"])
-                st.write("**Casual Response:**")
-                st.write(item["casual_response"])
-                st.write("**Formal Response:**")
-                st.write(item["formal_response"])
+                st.write(detail["query"])
+                if detail.get("casual_response") is not None:
+                    st.write("**Casual Response:**")
+                    st.write(detail["casual_response"])
+                if detail.get("formal_response") is not None:
+                    st.write("**Formal Response:**")
+                    st.write(detail["formal_response"])
+        # Older rows are paged in on demand rather than downloaded up front
+        if history["older"]:
+            st.button(
+                "Load older",
+                on_click=lambda: load_older_history(f"{API_URL}/history", st.session_state.history),
+            )
 
 # Main area for query input and responses
 st.header("Ask a Question")
@@ -52,54 +72,66 @@ st.header("Ask a Question")
 # Dropdown for tone selection
 tone_options = ["Both", "Casual", "Formal"]
 selected_tone = st.selectbox("Select response style:", tone_options)
+# Only the selected style is generated (and paid for) on the backend
+requested_tones = {"Both": ["casual", "formal"], "Casual": ["casual"], "Formal": ["formal"]}
 
 with st.form("query_form"):
     query = st.text_area("Enter your query", height=100)
     submitted = st.form_submit_button("Generate Responses")
-    
-    if submitted and query:
-        with st.spinner("Generating responses..."):
-            try:
-                payload = {
-                    "user_id": user_id,
-                    "query": query
-                }
-                
-                response = requests.post(f"{API_URL}/generate", json=payload)
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    
-                    # Store in session state for display
-                    st.session_state.casual_response = result["casual_response"]
-                    st.session_state.formal_response = result["formal_response"]
-                    st.session_state.last_selected_tone = selected_tone # Store the tone selected for this generation
-                    
-                    # Refresh history
-                    history_response = requests.get(f"{API_URL}/history?user_id={user_id}")
-                    if history_response.status_code == 200:
-                        st.session_state.history = history_response.json()
-                else:
-                    st.error(f"Error: {response.status_code} - {response.text}")
-            except Exception as e:
-                st.error(f"Error: {str(e)}")
-
-# Display responses if available
-if "casual_response" in st.session_state and "formal_response" in st.session_state:
-    
-    current_display_tone = st.session_state.get("last_selected_tone", "Both")
 
-    if current_display_tone == "Both":
+def response_placeholders(display_tone):
+    """Lay out the response area for the chosen tone and return a placeholder per tone"""
+    placeholders = {}
+    if display_tone == "Both":
         col1, col2 = st.columns(2)
         with col1:
             st.subheader("Casual Response")
-            st.write(st.session_state.casual_response)
+            placeholders["casual"] = st.empty()
         with col2:
             st.subheader("Formal Response")
-            st.write(st.session_state.formal_response)
-    elif current_display_tone == "Casual":
+            placeholders["formal"] = st.empty()
+    elif display_tone == "Casual":
         st.subheader("Casual Response")
-        st.write(st.session_state.casual_response)
-    elif current_display_tone == "Formal":
+        placeholders["casual"] = st.empty()
+    elif display_tone == "Formal":
         st.subheader("Formal Response")
-        st.write(st.session_state.formal_response)
+        placeholders["formal"] = st.empty()
+    return placeholders
+
+if submitted and query:
+    payload = {
+        "user_id": user_id,
+        "query": query,
+        "tones": requested_tones[selected_tone]
+    }
+    placeholders = response_placeholders(selected_tone)
+    texts = {"casual": "", "formal": ""}
+    try:
+        # Render tokens as they arrive so the first words show up immediately
+        for event, data in stream_api(f"{API_URL}/generate/stream", payload):
+            if event in texts:
+                texts[event] += data["token"]
+                if event in placeholders:
+                    placeholders[event].write(texts[event] + "▌")
+            elif event == "error":
+                st.error(f"Error ({data['tone'] or 'storage'}): {data['error']}")
+            elif event == "done":
+                for tone, placeholder in placeholders.items():
+                    placeholder.write(data.get(f"{tone}_response") or texts[tone])
+                if not data.get("errors"):
+                    # Store in session state for display
+                    st.session_state.casual_response = data.get("casual_response")
+                    st.session_state.formal_response = data.get("formal_response")
+                    st.session_state.last_selected_tone = selected_tone # Store the tone selected for this generation
+
+                    # Pull just the new row into the cached history
+                    st.session_state.history = sync_history(f"{API_URL}/history", user_id, st.session_state.get("history"))
+    except Exception as e:
+        st.error(f"Error: {str(e)}")
+
+# Display responses if available
+elif "casual_response" in st.session_state and "formal_response" in st.session_state:
+    current_display_tone = st.session_state.get("last_selected_tone", "Both")
+    placeholders = response_placeholders(current_display_tone)
+    for tone, placeholder in placeholders.items():
+        placeholder.write(st.session_state[f"{tone}_response"])
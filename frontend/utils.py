@@ -1,9 +1,18 @@
 # Add content to frontend/utils.py
 import requests
-from typing import Dict, List, Any
+from requests.adapters import HTTPAdapter
+from typing import Dict, List, Any, Iterator, Optional, Tuple
 import json
 
-def call_api(endpoint: str, method: str = "GET", data: Dict = None) -> Dict[str, Any]:
+# One pooled session per process: Streamlit reruns the script on every
+# interaction, and a fresh connection per call adds a TCP (and TLS) handshake
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+HISTORY_PAGE_SIZE = 50
+
+def call_api(endpoint: str, method: str = "GET", data: Dict = None, params: Dict = None) -> Dict[str, Any]:
     """
     Helper function to call the backend API
     
@@ -11,15 +20,16 @@ def call_api(endpoint: str, method: str = "GET", data: Dict = None) -> Dict[str,
         endpoint: API endpoint to call
         method: HTTP method (GET, POST, etc.)
         data: Data to send in the request body
+        params: Query string parameters
         
     Returns:
         API response as dictionary
     """
     try:
         if method.upper() == "GET":
-            response = requests.get(endpoint)
+            response = session.get(endpoint, params=params)
         elif method.upper() == "POST":
-            response = requests.post(endpoint, json=data)
+            response = session.post(endpoint, json=data, params=params)
         else:
             raise ValueError(f"Unsupported HTTP method: {method}")
             
@@ -29,3 +39,86 @@ def call_api(endpoint: str, method: str = "GET", data: Dict = None) -> Dict[str,
         return {"error": str(e)}
     except json.JSONDecodeError:
         return {"error": "Invalid JSON response from API"}
+
+def stream_api(endpoint: str, data: Dict = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    POST to a Server-Sent Events endpoint and yield events as they arrive
+
+    Args:
+        endpoint: API endpoint to call
+        data: Data to send in the request body
+
+    Yields:
+        (event name, decoded JSON data) tuples
+    """
+    with session.post(endpoint, json=data, stream=True, headers={"Accept": "text/event-stream"}) as response:
+        response.raise_for_status()
+        event, data_lines = None, []
+        for line in response.iter_lines(decode_unicode=True):
+            if line:
+                field, _, value = line.partition(": ")
+                if field == "event":
+                    event = value
+                elif field == "data":
+                    data_lines.append(value)
+                continue
+            # A blank line terminates the current event
+            if event is not None:
+                yield event, json.loads("\n".join(data_lines))
+            event, data_lines = None, []
+
+def _fetch_history_page(endpoint: str, params: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], Any]:
+    # Summary rows only: full responses are fetched per item by fetch_history_item
+    response = session.get(endpoint, params={"limit": HISTORY_PAGE_SIZE, "view": "summary", **params})
+    response.raise_for_status()
+    return response.json(), response.headers
+
+def sync_history(endpoint: str, user_id: str, cache: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Bring a cached history up to date, fetching only rows newer than the newest one held
+
+    Args:
+        endpoint: History endpoint URL
+        user_id: User whose history is cached
+        cache: Previous return value of this function, if any
+
+    Returns:
+        Cache dict with "items" (newest first) and the cursors needed for the next sync
+        ("newest") and for loading older pages ("older")
+    """
+    if not cache or cache["user_id"] != user_id or cache["newest"] is None:
+        items, headers = _fetch_history_page(endpoint, {"user_id": user_id})
+        return {
+            "user_id": user_id,
+            "items": items,
+            "newest": headers.get("X-Newest-Cursor"),
+            "older": headers.get("X-Next-Cursor"),
+        }
+
+    new_items = []
+    while True:
+        page, headers = _fetch_history_page(endpoint, {"user_id": user_id, "after": cache["newest"]})
+        if not page:
+            break
+        # Pages walk forward in time, so each one sits above the previous
+        new_items = page + new_items
+        cache["newest"] = headers["X-Newest-Cursor"]
+        if len(page) < HISTORY_PAGE_SIZE:
+            break
+    if new_items:
+        cache["items"] = new_items + cache["items"]
+    return cache
+
+def load_older_history(endpoint: str, cache: Dict[str, Any]) -> Dict[str, Any]:
+    """Append the next page of older rows to a cache built by sync_history"""
+    if cache.get("older"):
+        items, headers = _fetch_history_page(endpoint, {"user_id": cache["user_id"], "before": cache["older"]})
+        cache["items"] = cache["items"] + items
+        cache["older"] = headers.get("X-Next-Cursor")
+    return cache
+
+def fetch_history_item(endpoint: str, prompt_id: str, user_id: str) -> Dict[str, Any]:
+    """Full prompt (query and responses) for one history entry"""
+    response = session.get(f"{endpoint}/{prompt_id}", params={"user_id": user_id})
+    response.raise_for_status()
+    return response.json()